@@ -0,0 +1,271 @@
+# -*- coding: utf-8 -*-
+"""
+Cross-year trend analytics for EPR System
+
+Per-year rollups are kept in two small tables that SQLite triggers update
+incrementally whenever evaluations or competency_evaluations change, so trend
+views read a few rows per year instead of re-aggregating raw evaluation rows.
+Rows are keyed on the user's current department and manager; when those change,
+a trigger on users moves the user's live evaluations to the new keys (archived
+years keep the keys they were rebuilt with when archived).
+
+    rollup_ratings:      year x dimension (company/department/manager) x rating
+    rollup_competencies: year x department x competency
+"""
+from scoring import rating_case_sql
+
+# Score used for trends: final score once reviewed, self-assessment before that
+SCORE_SQL = "COALESCE({row}.final_score, {row}.employee_score, 0)"
+LEVEL_SQL = "COALESCE({row}.final_level, {row}.manager_level, {row}.employee_level)"
+
+DIMENSIONS = ('company', 'department', 'manager')
+
+
+def _rating_delta_sql(row, sign):
+    """Upsert adding (sign=+1) or removing (sign=-1) one evaluation row"""
+    score = SCORE_SQL.format(row=row)
+    return f'''
+        INSERT INTO rollup_ratings (year, dimension, dim_key, rating, evaluations, score_sum)
+        SELECT {row}.year, d.dimension, d.dim_key, {rating_case_sql(score)}, {sign}, {sign} * ({score})
+        FROM (
+            SELECT 'company' AS dimension, '' AS dim_key
+            UNION ALL SELECT 'department',
+                COALESCE((SELECT department FROM users WHERE id = {row}.user_id), '')
+            UNION ALL SELECT 'manager',
+                COALESCE((SELECT report_to FROM users WHERE id = {row}.user_id), '')
+        ) d
+        WHERE true
+        ON CONFLICT (year, dimension, dim_key, rating) DO UPDATE SET
+            evaluations = evaluations + excluded.evaluations,
+            score_sum = score_sum + excluded.score_sum;
+    '''
+
+
+def _competency_delta_sql(row, sign):
+    """Upsert adding or removing one competency_evaluations row"""
+    level = LEVEL_SQL.format(row=row)
+    return f'''
+        INSERT INTO rollup_competencies (year, department, competency_id, evaluations, level_sum)
+        SELECT e.year, COALESCE(u.department, ''), {row}.competency_id, {sign}, {sign} * ({level})
+        FROM evaluations e
+        LEFT JOIN users u ON u.id = e.user_id
+        WHERE e.id = {row}.evaluation_id AND ({level}) IS NOT NULL
+        ON CONFLICT (year, department, competency_id) DO UPDATE SET
+            evaluations = evaluations + excluded.evaluations,
+            level_sum = level_sum + excluded.level_sum;
+    '''
+
+
+def _orphaned_competencies_sql():
+    """Remove the competency rows of a deleted evaluation from the rollup"""
+    level = LEVEL_SQL.format(row='ce')
+    return f'''
+        INSERT INTO rollup_competencies (year, department, competency_id, evaluations, level_sum)
+        SELECT OLD.year, COALESCE(u.department, ''), ce.competency_id, -COUNT(*), -SUM({level})
+        FROM competency_evaluations ce
+        LEFT JOIN users u ON u.id = OLD.user_id
+        WHERE ce.evaluation_id = OLD.id AND ({level}) IS NOT NULL
+        GROUP BY ce.competency_id
+        ON CONFLICT (year, department, competency_id) DO UPDATE SET
+            evaluations = evaluations + excluded.evaluations,
+            level_sum = level_sum + excluded.level_sum;
+    '''
+
+
+def _user_move_sql():
+    """Move a user's evaluations from the OLD to the NEW department/manager keys"""
+    score = SCORE_SQL.format(row='e')
+    level = LEVEL_SQL.format(row='ce')
+    return f'''
+        INSERT INTO rollup_ratings (year, dimension, dim_key, rating, evaluations, score_sum)
+        SELECT e.year, d.dimension, d.dim_key, {rating_case_sql(score)}, d.sign * COUNT(*), d.sign * SUM({score})
+        FROM evaluations e, (
+            SELECT 'department' AS dimension, COALESCE(OLD.department, '') AS dim_key, -1 AS sign
+            UNION ALL SELECT 'department', COALESCE(NEW.department, ''), 1
+            UNION ALL SELECT 'manager', COALESCE(OLD.report_to, ''), -1
+            UNION ALL SELECT 'manager', COALESCE(NEW.report_to, ''), 1
+        ) d
+        WHERE e.user_id = NEW.id
+        GROUP BY 1, 2, 3, 4, d.sign
+        ON CONFLICT (year, dimension, dim_key, rating) DO UPDATE SET
+            evaluations = evaluations + excluded.evaluations,
+            score_sum = score_sum + excluded.score_sum;
+        INSERT INTO rollup_competencies (year, department, competency_id, evaluations, level_sum)
+        SELECT e.year, d.department, ce.competency_id, d.sign * COUNT(*), d.sign * SUM({level})
+        FROM competency_evaluations ce
+        JOIN evaluations e ON e.id = ce.evaluation_id, (
+            SELECT COALESCE(OLD.department, '') AS department, -1 AS sign
+            UNION ALL SELECT COALESCE(NEW.department, ''), 1
+        ) d
+        WHERE e.user_id = NEW.id AND ({level}) IS NOT NULL
+        GROUP BY 1, 2, 3, d.sign
+        ON CONFLICT (year, department, competency_id) DO UPDATE SET
+            evaluations = evaluations + excluded.evaluations,
+            level_sum = level_sum + excluded.level_sum;
+    '''
+
+
+_PRUNE_RATINGS = "DELETE FROM rollup_ratings WHERE evaluations <= 0;"
+_PRUNE_COMPETENCIES = "DELETE FROM rollup_competencies WHERE evaluations <= 0;"
+
+
+def ensure_rollups(conn):
+    """Create rollup tables and maintenance triggers, backfilling on first run"""
+    cursor = conn.cursor()
+    cursor.execute("SELECT 1 FROM sqlite_master WHERE type = 'table' AND name = 'rollup_ratings'")
+    existed = cursor.fetchone() is not None
+
+    cursor.execute('''
+    CREATE TABLE IF NOT EXISTS rollup_ratings (
+        year INTEGER NOT NULL,
+        dimension TEXT NOT NULL,
+        dim_key TEXT NOT NULL,
+        rating TEXT NOT NULL,
+        evaluations INTEGER NOT NULL DEFAULT 0,
+        score_sum REAL NOT NULL DEFAULT 0,
+        PRIMARY KEY (year, dimension, dim_key, rating)
+    ) WITHOUT ROWID
+    ''')
+
+    cursor.execute('''
+    CREATE TABLE IF NOT EXISTS rollup_competencies (
+        year INTEGER NOT NULL,
+        department TEXT NOT NULL,
+        competency_id INTEGER NOT NULL,
+        evaluations INTEGER NOT NULL DEFAULT 0,
+        level_sum REAL NOT NULL DEFAULT 0,
+        PRIMARY KEY (year, department, competency_id)
+    ) WITHOUT ROWID
+    ''')
+
+    triggers = {
+        'trg_rollup_evaluations_insert':
+            f"AFTER INSERT ON evaluations BEGIN {_rating_delta_sql('NEW', 1)} END",
+        'trg_rollup_evaluations_delete':
+            f"AFTER DELETE ON evaluations BEGIN {_rating_delta_sql('OLD', -1)} {_PRUNE_RATINGS} "
+            f"{_orphaned_competencies_sql()} {_PRUNE_COMPETENCIES} END",
+        'trg_rollup_evaluations_update':
+            "AFTER UPDATE OF year, user_id, employee_score, final_score ON evaluations BEGIN "
+            f"{_rating_delta_sql('OLD', -1)} {_rating_delta_sql('NEW', 1)} {_PRUNE_RATINGS} END",
+        'trg_rollup_competencies_insert':
+            f"AFTER INSERT ON competency_evaluations BEGIN {_competency_delta_sql('NEW', 1)} END",
+        'trg_rollup_competencies_delete':
+            "AFTER DELETE ON competency_evaluations BEGIN "
+            f"{_competency_delta_sql('OLD', -1)} {_PRUNE_COMPETENCIES} END",
+        'trg_rollup_competencies_update':
+            "AFTER UPDATE OF competency_id, employee_level, manager_level, final_level "
+            "ON competency_evaluations BEGIN "
+            f"{_competency_delta_sql('OLD', -1)} {_competency_delta_sql('NEW', 1)} "
+            f"{_PRUNE_COMPETENCIES} END",
+        'trg_rollup_users_move':
+            "AFTER UPDATE OF department, report_to ON users "
+            "WHEN OLD.department IS NOT NEW.department OR OLD.report_to IS NOT NEW.report_to BEGIN "
+            f"{_user_move_sql()} {_PRUNE_RATINGS} {_PRUNE_COMPETENCIES} END",
+    }
+    for name, body in triggers.items():
+        cursor.execute(f"CREATE TRIGGER IF NOT EXISTS {name} {body}")
+
+    if not existed:
+        rebuild_rollups(conn, commit=False)
+    conn.commit()
+
+
+def rebuild_rollups(conn, year=None, schema='main', commit=True):
+    """Recompute rollups from raw rows (backfill, or after bulk moves such as archiving)
+
+    schema lets an ATTACHed database holding the raw rows be used as the source.
+    """
+    cursor = conn.cursor()
+    year_filter = "WHERE e.year = ?" if year is not None else ""
+    params = (year,) if year is not None else ()
+    if year is not None:
+        cursor.execute("DELETE FROM rollup_ratings WHERE year = ?", params)
+        cursor.execute("DELETE FROM rollup_competencies WHERE year = ?", params)
+    else:
+        cursor.execute("DELETE FROM rollup_ratings")
+        cursor.execute("DELETE FROM rollup_competencies")
+
+    score = SCORE_SQL.format(row='e')
+    for dimension, key_sql in (('company', "''"),
+                               ('department', "COALESCE(u.department, '')"),
+                               ('manager', "COALESCE(u.report_to, '')")):
+        cursor.execute(f'''
+            INSERT INTO rollup_ratings (year, dimension, dim_key, rating, evaluations, score_sum)
+            SELECT e.year, '{dimension}', {key_sql}, {rating_case_sql(score)}, COUNT(*), SUM({score})
+            FROM {schema}.evaluations e
+            LEFT JOIN main.users u ON u.id = e.user_id
+            {year_filter}
+            GROUP BY 1, 2, 3, 4
+        ''', params)
+
+    level = LEVEL_SQL.format(row='ce')
+    cursor.execute(f'''
+        INSERT INTO rollup_competencies (year, department, competency_id, evaluations, level_sum)
+        SELECT e.year, COALESCE(u.department, ''), ce.competency_id, COUNT(*), SUM({level})
+        FROM {schema}.competency_evaluations ce
+        JOIN {schema}.evaluations e ON e.id = ce.evaluation_id
+        LEFT JOIN main.users u ON u.id = e.user_id
+        {"WHERE e.year = ? AND" if year is not None else "WHERE"} ({level}) IS NOT NULL
+        GROUP BY 1, 2, 3
+    ''', params)
+    if commit:
+        conn.commit()
+
+
+def available_years(conn):
+    """Years that have at least one evaluation"""
+    cursor = conn.cursor()
+    cursor.execute("SELECT DISTINCT year FROM rollup_ratings ORDER BY year")
+    return [row[0] for row in cursor.fetchall()]
+
+
+def dimension_keys(conn, dimension):
+    """Distinct departments or managers present in the rollups"""
+    cursor = conn.cursor()
+    cursor.execute(
+        "SELECT DISTINCT dim_key FROM rollup_ratings WHERE dimension = ? ORDER BY dim_key",
+        (dimension,)
+    )
+    return [row[0] for row in cursor.fetchall()]
+
+
+def rating_distribution(conn, dimension='company', dim_key=''):
+    """Evaluations per (year, rating) for one department/manager or the whole company"""
+    cursor = conn.cursor()
+    cursor.execute('''
+        SELECT year, rating, evaluations, score_sum / evaluations AS avg_score
+        FROM rollup_ratings
+        WHERE dimension = ? AND dim_key = ?
+        ORDER BY year, rating
+    ''', (dimension, dim_key))
+    return [dict(row) for row in cursor.fetchall()]
+
+
+def average_score_trend(conn, dimension='department'):
+    """Average score per year for every department or manager"""
+    cursor = conn.cursor()
+    cursor.execute('''
+        SELECT year, dim_key, SUM(evaluations) AS evaluations,
+               SUM(score_sum) / SUM(evaluations) AS avg_score
+        FROM rollup_ratings
+        WHERE dimension = ?
+        GROUP BY year, dim_key
+        ORDER BY year, dim_key
+    ''', (dimension,))
+    return [dict(row) for row in cursor.fetchall()]
+
+
+def competency_trend(conn, department=None):
+    """Average competency level per year, company-wide or for one department"""
+    cursor = conn.cursor()
+    dept_filter = "WHERE r.department = ?" if department is not None else ""
+    cursor.execute(f'''
+        SELECT r.year, c.name AS competency, SUM(r.evaluations) AS evaluations,
+               SUM(r.level_sum) / SUM(r.evaluations) AS avg_level
+        FROM rollup_competencies r
+        JOIN competencies c ON c.id = r.competency_id
+        {dept_filter}
+        GROUP BY r.year, r.competency_id
+        ORDER BY r.year, c.id
+    ''', (department,) if department is not None else ())
+    return [dict(row) for row in cursor.fetchall()]
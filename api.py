@@ -0,0 +1,358 @@
+# -*- coding: utf-8 -*-
+"""
+JSON/HTTP API for HRIS integration with EPR System
+
+Runs as its own process next to Streamlit, on the same data layer (storage
+backend for reads, write queue for writes), so integration traffic never
+competes with UI reruns.
+
+    GET  /api/users?after=<id>&limit=<n>                keyset pages of users (no passwords)
+    GET  /api/evaluations?after=<id>&limit=<n>&year=<y>  keyset pages of scores and ratings (live and archived years)
+    POST /api/users/bulk                                 upsert users by code
+    POST /api/criteria/bulk                              upsert KRAs by department + kra_name (department
+                                                         totals checked as in catalogue.py)
+    GET  /api/health
+
+Pages end with "next_after": pass it as ?after= to get the next page (null
+on the last page). GET responses carry an ETag; send it back in
+If-None-Match to get 304 Not Modified while nothing changed. Every request
+needs "Authorization: Bearer <EPR_API_TOKEN>".
+
+Usage:
+    EPR_API_TOKEN=... python api.py [--host 127.0.0.1] [--port 8502]
+"""
+import argparse
+import hashlib
+import hmac
+import json
+import os
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from urllib.parse import parse_qs, urlparse
+
+import archive
+import catalogue
+import database
+import passwords
+import sessions
+import storage
+import writer
+from scoring import rating_for
+
+API_TOKEN = os.environ.get('EPR_API_TOKEN', '')
+DEFAULT_LIMIT = 100
+MAX_LIMIT = 1000
+MAX_BODY_BYTES = 5 * 1024 * 1024
+
+USER_FIELDS = ('id', 'code', 'fullname', 'username', 'email', 'department', 'role_type',
+               'area', 'report_to', 'emp_type', 'is_manager', 'created_at', 'updated_at')
+# Fields HRIS may set; code is the natural key
+USER_WRITABLE = ('fullname', 'username', 'email', 'department', 'role_type',
+                 'area', 'report_to', 'emp_type', 'is_manager')
+USER_REQUIRED = ('code', 'fullname', 'username', 'role_type')
+# Changing any of these (or the password) ends the user's login sessions
+USER_PRIVILEGE_FIELDS = ('username', 'department', 'role_type', 'report_to', 'is_manager')
+
+# JSON types accepted per field of a bulk item; null is allowed, required fields are checked after
+USER_TYPES = dict({field: (str,) for field in ('code', 'password') + USER_WRITABLE}, is_manager=(bool, int))
+CRITERIA_TYPES = {'department': (str,), 'kra_name': (str,), 'category': (str,), 'description': (str,),
+                  'weight': (int, float), 'category_total': (int, float)}
+
+
+class ApiError(Exception):
+    """Request failed with an HTTP status and a message for the client"""
+
+    def __init__(self, status, message, details=None):
+        super().__init__(message)
+        self.status = status
+        self.details = details
+
+
+def _int_param(query, name, default=None, minimum=0, maximum=None):
+    values = query.get(name)
+    if not values:
+        return default
+    try:
+        value = int(values[0])
+    except ValueError:
+        raise ApiError(400, f"'{name}' must be an integer")
+    if value < minimum or (maximum is not None and value > maximum):
+        raise ApiError(400, f"'{name}' must be between {minimum} and {maximum}")
+    return value
+
+
+def _namespace_versions(conn, namespaces):
+    """cache_versions counters of the namespaces, or None where they are not maintained"""
+    if storage.dialect_of(conn) != 'sqlite':
+        return None
+    rows = conn.execute(
+        f"SELECT version FROM cache_versions WHERE namespace IN ({', '.join('?' * len(namespaces))}) "
+        "ORDER BY namespace", namespaces).fetchall()
+    return '.'.join(str(row[0]) for row in rows) if rows else None
+
+
+def _page(conn, sql, params, after, limit):
+    """Keyset page: rows with id > after, plus the cursor of the next page"""
+    cursor = conn.cursor()
+    cursor.execute(f"{sql} AND t.id > ? ORDER BY t.id LIMIT ?", list(params) + [after, limit + 1])
+    rows = [dict(row) for row in cursor.fetchall()]
+    more = len(rows) > limit
+    rows = rows[:limit]
+    return {'items': rows, 'next_after': rows[-1]['id'] if more else None}
+
+
+def list_users(conn, query):
+    after = _int_param(query, 'after', 0)
+    limit = _int_param(query, 'limit', DEFAULT_LIMIT, 1, MAX_LIMIT)
+    cursor = conn.cursor()
+    cursor.execute("SELECT * FROM users LIMIT 0")
+    columns = {column[0] for column in cursor.description}
+    fields = ', '.join(f"t.{field}" for field in USER_FIELDS if field in columns)
+    return _page(conn, f"SELECT {fields} FROM users t WHERE 1 = 1", (), after, limit)
+
+
+def list_evaluations(conn, query):
+    after = _int_param(query, 'after', 0)
+    limit = _int_param(query, 'limit', DEFAULT_LIMIT, 1, MAX_LIMIT)
+    year = _int_param(query, 'year')
+    # Closed years moved to archive files are read through their ATTACHed copies
+    evaluations = archive.history_tables(conn)['evaluations']
+    archived = "t.archived" if evaluations != 'evaluations' else "0"
+    page = _page(conn, f'''
+        SELECT t.id, t.user_id, u.code, t.year, t.period, t.status,
+               t.employee_score, t.manager_score, t.final_score, t.rating AS review_result,
+               t.employee_submitted_at, t.manager_submitted_at, {archived} AS archived
+        FROM {evaluations} t
+        LEFT JOIN users u ON u.id = t.user_id
+        WHERE (? IS NULL OR t.year = ?)
+    ''', (year, year), after, limit)
+    # Rating band of the final score; null until the manager has reviewed
+    for item in page['items']:
+        item['rating'] = rating_for(item['final_score']) if item['final_score'] is not None else None
+        item['archived'] = bool(item['archived'])
+    return page
+
+
+def _item_error(item, types):
+    """Why a bulk item does not have the expected JSON shape, or None"""
+    if not isinstance(item, dict):
+        return "item must be a JSON object"
+    wrong = [field for field, allowed in types.items()
+             if item.get(field) is not None
+             and (not isinstance(item[field], allowed) or isinstance(item[field], bool) and bool not in allowed)]
+    if wrong:
+        return f"wrong type for {', '.join(wrong)}"
+    return None
+
+
+def _upsert_users(conn, inserts, updates):
+    """Write transaction for /api/users/bulk"""
+    for user in inserts:
+        columns = ['code', 'password'] + [field for field in USER_WRITABLE if field in user]
+        conn.execute(
+            f"INSERT INTO users ({', '.join(columns)}) VALUES ({', '.join('?' * len(columns))})",
+            [user[column] for column in columns]
+        )
+    for user in updates:
+        current = conn.execute(
+            f"SELECT id, {', '.join(USER_PRIVILEGE_FIELDS)} FROM users WHERE code = ?", (user['code'],)
+        ).fetchone()
+        if current is not None and ('password' in user or any(
+                field in user and user[field] != current[field] for field in USER_PRIVILEGE_FIELDS)):
+            sessions.delete_user_sessions(conn, current['id'])
+        fields = [field for field in USER_WRITABLE if field in user]
+        assignments = ', '.join(f"{field} = ?" for field in fields)
+        if 'password' in user:
+            assignments += (', ' if assignments else '') + "password = ?"
+            fields.append('password')
+        if fields:
+            conn.execute(
+                f"UPDATE users SET {assignments}, updated_at = CURRENT_TIMESTAMP WHERE code = ?",
+                [user[field] for field in fields] + [user['code']]
+            )
+
+
+def bulk_users(conn, items):
+    """Validate and upsert users by code in one transaction"""
+    if not isinstance(items, list):
+        raise ApiError(400, "Body must be a JSON array of users")
+    cursor = conn.cursor()
+    cursor.execute("SELECT code FROM users")
+    existing = {row[0] for row in cursor.fetchall()}
+
+    errors, inserts, updates, seen = [], [], [], set()
+    for index, item in enumerate(items):
+        error = _item_error(item, USER_TYPES)
+        if error:
+            errors.append({'index': index, 'error': error})
+            continue
+        if not item.get('code'):
+            errors.append({'index': index, 'error': "missing 'code'"})
+            continue
+        if item['code'] in seen:
+            errors.append({'index': index, 'error': f"duplicate code {item['code']!r}"})
+            continue
+        seen.add(item['code'])
+        user = {field: item[field] for field in ('code',) + USER_WRITABLE if field in item}
+        if item.get('password'):
+            user['password'] = passwords.hash_password(item['password'])
+        if item['code'] in existing:
+            updates.append(user)
+            continue
+        missing = [field for field in USER_REQUIRED if not item.get(field)]
+        if missing or 'password' not in user:
+            errors.append({'index': index, 'error': f"new user needs {', '.join(missing + ['password'])}"})
+            continue
+        inserts.append(user)
+    if errors:
+        raise ApiError(400, "Validation failed; nothing was written", errors)
+    try:
+        writer.run(_upsert_users, inserts, updates)
+    except storage.IntegrityError as e:
+        raise ApiError(409, f"Constraint violated: {e}")
+    return {'inserted': len(inserts), 'updated': len(updates)}
+
+
+def bulk_criteria(conn, items):
+    """Upsert KRAs through the catalogue importer"""
+    if not isinstance(items, list):
+        raise ApiError(400, "Body must be a JSON array of criteria")
+    criteria, errors = [], []
+    for index, item in enumerate(items):
+        error = _item_error(item, CRITERIA_TYPES)
+        if error:
+            errors.append({'index': index, 'error': error})
+            continue
+        try:
+            weight = float(item['weight'])
+            if weight <= 0 or not item['department'] or not item['kra_name'] or not item['category']:
+                raise ValueError
+        except (KeyError, TypeError, ValueError):
+            errors.append({'index': index, 'error': "needs department, kra_name, category and a positive weight"})
+            continue
+        criteria.append({'department': item['department'], 'kra_name': item['kra_name'],
+                         'description': item.get('description'), 'weight': weight,
+                         'category': item['category'], 'category_total': item.get('category_total')})
+    if errors:
+        raise ApiError(400, "Validation failed; nothing was written", errors)
+    # Same department totals as a workbook import
+    errors = catalogue.total_errors(conn, criteria)
+    if errors:
+        raise ApiError(400, "Department weight totals do not add up; nothing was written",
+                       [{'error': error} for error in errors])
+    written, _ = catalogue.apply_catalogue(criteria, [])
+    return {'upserted': written}
+
+
+# path -> (handler, cache namespaces the response depends on)
+GET_ROUTES = {
+    '/api/users': (list_users, ('users',)),
+    '/api/evaluations': (list_evaluations, ('evaluations', 'users')),
+}
+POST_ROUTES = {
+    '/api/users/bulk': bulk_users,
+    '/api/criteria/bulk': bulk_criteria,
+}
+
+
+class ApiHandler(BaseHTTPRequestHandler):
+    server_version = 'EPR-API/1.0'
+
+    def _send(self, status, payload=None, headers=None):
+        body = b'' if payload is None else json.dumps(payload, ensure_ascii=False, default=str).encode('utf-8')
+        self.send_response(status)
+        for name, value in (headers or {}).items():
+            self.send_header(name, value)
+        if payload is not None:
+            self.send_header('Content-Type', 'application/json; charset=utf-8')
+        self.send_header('Content-Length', str(len(body)))
+        self.end_headers()
+        if body:
+            self.wfile.write(body)
+
+    def _authorize(self):
+        supplied = self.headers.get('Authorization', '')
+        if not hmac.compare_digest(supplied.encode(), f"Bearer {API_TOKEN}".encode()):
+            raise ApiError(401, "Missing or invalid API token")
+
+    def _handle(self, method):
+        try:
+            url = urlparse(self.path)
+            if url.path == '/api/health':
+                return self._send(200, {'status': 'ok'})
+            self._authorize()
+            if method == 'GET':
+                self._get(url)
+            else:
+                self._post(url)
+        except ApiError as e:
+            payload = {'error': str(e)}
+            if e.details:
+                payload['details'] = e.details
+            self._send(e.status, payload)
+        except Exception as e:
+            self.log_error("Unhandled error: %r", e)
+            self._send(500, {'error': 'Internal server error'})
+
+    def _get(self, url):
+        if url.path not in GET_ROUTES:
+            raise ApiError(404, "Not found")
+        handler, namespaces = GET_ROUTES[url.path]
+        with storage.get_storage().connection() as conn:
+            # Cheap ETag from the namespace version: a match skips the page query
+            version = _namespace_versions(conn, namespaces)
+            etag = None
+            if version is not None:
+                etag = '"' + hashlib.sha1(f"{version}:{url.path}?{url.query}".encode()).hexdigest() + '"'
+                if self.headers.get('If-None-Match') == etag:
+                    return self._send(304, headers={'ETag': etag})
+            payload = handler(conn, parse_qs(url.query))
+        if etag is None:
+            etag = '"' + hashlib.sha1(json.dumps(payload, sort_keys=True, default=str).encode()).hexdigest() + '"'
+            if self.headers.get('If-None-Match') == etag:
+                return self._send(304, headers={'ETag': etag})
+        self._send(200, payload, {'ETag': etag, 'Cache-Control': 'no-cache'})
+
+    def _post(self, url):
+        if url.path not in POST_ROUTES:
+            raise ApiError(404, "Not found")
+        length = int(self.headers.get('Content-Length') or 0)
+        if length > MAX_BODY_BYTES:
+            raise ApiError(413, "Request body too large")
+        try:
+            items = json.loads(self.rfile.read(length) or b'null')
+        except ValueError:
+            raise ApiError(400, "Body is not valid JSON")
+        with storage.get_storage().connection() as conn:
+            result = POST_ROUTES[url.path](conn, items)
+        self._send(200, result)
+
+    def do_GET(self):
+        self._handle('GET')
+
+    def do_POST(self):
+        self._handle('POST')
+
+
+def serve(host='127.0.0.1', port=8502):
+    if not API_TOKEN:
+        raise SystemExit("Set EPR_API_TOKEN before starting the API")
+    with storage.get_storage().connection() as conn:
+        # Version counters for ETags and the natural-key constraints for upserts
+        database.ensure_schema(conn)
+    server = ThreadingHTTPServer((host, port), ApiHandler)
+    print(f"EPR API listening on http://{host}:{port}")
+    try:
+        server.serve_forever()
+    except KeyboardInterrupt:
+        pass
+    finally:
+        server.server_close()
+        writer.get_writer().close()
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="EPR System HTTP API")
+    parser.add_argument('--host', default=os.environ.get('EPR_API_HOST', '127.0.0.1'))
+    parser.add_argument('--port', type=int, default=int(os.environ.get('EPR_API_PORT', 8502)))
+    args = parser.parse_args()
+    serve(args.host, args.port)
@@ -4,12 +4,29 @@ EPR System - Employee Performance Review Application
 Main Streamlit Application
 """
 import streamlit as st
-import sqlite3
-import pandas as pd
-import hashlib
+from streamlit.runtime.scriptrunner import get_script_run_ctx
 from datetime import datetime
 import io
-from pdf_generator import generate_evaluation_pdf
+import os
+import passwords
+import database
+import analytics
+import backup
+import maintenance
+import writer
+import storage
+import sessions
+import cache
+import search
+import tracker
+import records
+import session_memory
+import archive
+import profiling
+from scoring import rating_for, RATINGS, REVIEW_YEAR, LEVEL_PERCENTAGES, ScoreAccumulator
+# pandas, ReportLab (pdf_generator) and the admin modules built on them
+# (calibration, snapshot, catalogue) are imported where they are used, so a
+# process serving only employees never pays for loading them
 
 # Page configuration
 st.set_page_config(
@@ -22,39 +39,84 @@ st.set_page_config(
 # Database helper functions
 def get_db_connection():
     """Create database connection"""
-    conn = sqlite3.connect('epr_system.db')
-    conn.row_factory = sqlite3.Row
-    return conn
+    return storage.get_storage().connect()
+
+@st.cache_resource
+def init_schema():
+    """Create rollup tables and triggers once per server process"""
+    conn = get_db_connection()
+    try:
+        database.ensure_schema(conn)
+    finally:
+        conn.close()
+    return True
+
+init_schema()
+
+@st.cache_resource
+def start_background_jobs():
+    """Start periodic jobs once per server process"""
+    interval = float(os.environ.get('EPR_SNAPSHOT_INTERVAL_MINUTES', 0))
+    if interval > 0:
+        import snapshot
+        snapshot.start_scheduler(interval)
+    backup_hours = float(os.environ.get('EPR_BACKUP_INTERVAL_HOURS', 0))
+    # Online backups copy the SQLite file; PostgreSQL uses its own tooling
+    if backup_hours > 0 and storage.get_storage().dialect == 'sqlite':
+        backup.start_scheduler(backup_hours)
+    maintenance_hours = float(os.environ.get('EPR_MAINTENANCE_INTERVAL_HOURS', 0))
+    if maintenance_hours > 0 and storage.get_storage().dialect == 'sqlite':
+        maintenance.start_scheduler(maintenance_hours)
+    sessions.start_purger()
+    return True
+
+start_background_jobs()
 
 def hash_password(password):
-    """Hash password using SHA256"""
-    return hashlib.sha256(password.encode()).hexdigest()
+    """Hash password with the configured salted hasher"""
+    return passwords.hash_password_async(password).result()
 
 def authenticate_user(username, password):
-    """Authenticate user"""
+    """Authenticate user, upgrading old password hashes on success"""
     conn = get_db_connection()
     cursor = conn.cursor()
     # Case-insensitive username search
     cursor.execute(
-        "SELECT * FROM users WHERE LOWER(username) = LOWER(?) AND password = ?",
-        (username, hash_password(password))
+        "SELECT * FROM users WHERE LOWER(username) = LOWER(?)",
+        (username,)
     )
     user = cursor.fetchone()
     conn.close()
-    return dict(user) if user else None
+    if not user:
+        return None
+    
+    ok, new_hash = passwords.check_password(password, user['password'])
+    if ok and new_hash:
+        # Transparent upgrade: legacy SHA-256 or outdated work factor (same password, sessions stay)
+        writer.run(writer.update_password, user['id'], new_hash, revoke_sessions=False)
+    if not ok:
+        return None
+    user = dict(user)
+    if new_hash:
+        user['password'] = new_hash
+    return user
 
+@cache.cached('evaluations')
 def get_user_evaluations(user_id):
     """Get all evaluations for a user"""
     conn = get_db_connection()
     cursor = conn.cursor()
+    # Closed years come from the read-only archive files
+    history = archive.history_tables(conn)
     cursor.execute(
-        "SELECT * FROM evaluations WHERE user_id = ? ORDER BY created_at DESC",
+        f"SELECT * FROM {history['evaluations']} e WHERE user_id = ? ORDER BY created_at DESC",
         (user_id,)
     )
-    evaluations = [dict(row) for row in cursor.fetchall()]
+    evaluations = records.fetch_records(cursor, records.Evaluation)
     conn.close()
     return evaluations
 
+@cache.cached('criteria')
 def get_evaluation_criteria(department):
     """Get evaluation criteria for a department"""
     conn = get_db_connection()
@@ -64,10 +126,11 @@ def get_evaluation_criteria(department):
         "SELECT * FROM evaluation_criteria WHERE department = ? ORDER BY category, kra_name",
         (department,)
     )
-    criteria = [dict(row) for row in cursor.fetchall()]
+    criteria = records.fetch_records(cursor, records.Criterion)
     conn.close()
     return criteria
 
+@cache.cached('competencies')
 def get_all_competencies():
     """Get all competencies ordered by category"""
     conn = get_db_connection()
@@ -83,16 +146,90 @@ def get_all_competencies():
             END,
             id
     """)
-    competencies = [dict(row) for row in cursor.fetchall()]
+    competencies = records.fetch_records(cursor, records.Competency)
     conn.close()
     return competencies
 
+@cache.cached('users')
+def get_team(manager_name):
+    """Get employees reporting directly to a manager"""
+    conn = get_db_connection()
+    cursor = conn.cursor()
+    cursor.execute(
+        "SELECT * FROM users WHERE report_to = ? AND is_manager = 0",
+        (manager_name,)
+    )
+    employees = records.fetch_records(cursor, records.User)
+    conn.close()
+    return employees
+
+def get_book_evaluations(department=None, report_to=None, year=REVIEW_YEAR):
+    """Evaluations of a department or a manager's team with their employees, for the PDF book"""
+    conn = get_db_connection()
+    cursor = conn.cursor()
+    cursor.execute('''
+        SELECT e.id, e.year, e.status, e.employee_score, e.manager_score, e.final_score, e.rating,
+               e.employee_comment, u.code, u.fullname, u.department, u.role_type, u.report_to
+        FROM evaluations e
+        JOIN users u ON e.user_id = u.id
+        WHERE e.year = ? AND (? IS NULL OR u.department = ?) AND (? IS NULL OR u.report_to = ?)
+        ORDER BY u.fullname, e.id
+    ''', (year, department, department, report_to, report_to))
+    evaluations = [dict(row, archived=False) for row in cursor.fetchall()]
+    conn.close()
+    return evaluations
+
 # Session state initialization
 if 'logged_in' not in st.session_state:
     st.session_state.logged_in = False
 if 'user' not in st.session_state:
     st.session_state.user = None
 
+def write_session_cookie(token):
+    """Queue storing the session token in the browser cookie (None clears it)"""
+    # Written on the next run: login and logout call st.rerun() right after
+    st.session_state.session_cookie = token
+
+def flush_session_cookie():
+    """Send a queued cookie write to the browser"""
+    if 'session_cookie' not in st.session_state:
+        return
+    token = st.session_state.pop('session_cookie')
+    # The token goes into an inline script; only the token alphabet may reach it.
+    # Script-written cookies cannot be HttpOnly, so page scripts can read it (see sessions.py)
+    if token and not sessions.is_token(token):
+        raise ValueError("Session token has unexpected characters")
+    max_age = int(sessions.SESSION_TTL_HOURS * 3600) if token else 0
+    st.html(
+        f"<script>document.cookie = '{sessions.COOKIE_NAME}={token or ''}; path=/; max-age={max_age}; "
+        f"SameSite=Strict' + (location.protocol === 'https:' ? '; Secure' : '');</script>",
+        unsafe_allow_javascript=True
+    )
+
+# Tokens from before the cookie must not linger in bookmarks and history
+if 'session' in st.query_params:
+    del st.query_params['session']
+
+# Restore the login from the session cookie after a reload, restart or on another worker.
+# The user row is re-read on every rerun: role or department changes apply at once,
+# and a revoked session (password change, logout elsewhere) ends on the next click.
+if 'session_token' not in st.session_state:
+    token = st.context.cookies.get(sessions.COOKIE_NAME)
+    # Without a browser (AppTest, bare mode) cookies are not strings
+    st.session_state.session_token = token if isinstance(token, str) else None
+if st.session_state.session_token:
+    profile = sessions.resolve(st.session_state.session_token)
+    if profile:
+        st.session_state.logged_in = True
+        st.session_state.user = records.User.from_mapping(profile)
+    else:
+        session_memory.clear(st.session_state)
+        st.session_state.logged_in = False
+        st.session_state.user = None
+        st.session_state.session_token = None
+        write_session_cookie(None)
+flush_session_cookie()
+
 # Login page
 def login_page():
     """Display login page"""
@@ -109,13 +246,267 @@ def login_page():
         if st.button("Đăng nhập", use_container_width=True):
             user = authenticate_user(username, password)
             if user:
+                token = sessions.create_session(user)
                 st.session_state.logged_in = True
-                st.session_state.user = user
+                st.session_state.user = records.User.from_mapping(user)
+                st.session_state.session_token = token
+                write_session_cookie(token)
                 st.success(f"Chào mừng {user['fullname']}!")
                 st.rerun()
             else:
                 st.error("Tên đăng nhập hoặc mật khẩu không đúng!")
 
+def get_score_accumulator(criteria, competencies):
+    """Per-session running score of the employee form, rebuilt when the catalogue changes"""
+    signature = (tuple((c['id'], c['weight']) for c in criteria),
+                 tuple((c['id'], c.get('importance_level', 2)) for c in competencies))
+    stored = st.session_state.get('score_accumulator')
+    if stored is None or stored[0] != signature:
+        accumulator = ScoreAccumulator(criteria, competencies)
+        # Pick up values already entered in this session
+        for c in criteria:
+            accumulator.set_kpi(c['id'], st.session_state.get(f"score_{c['id']}", 100.0))
+        for c in competencies:
+            accumulator.set_level(c['id'], st.session_state.get(f"comp_{c['id']}", 3))
+        stored = st.session_state.score_accumulator = (signature, accumulator)
+    return stored[1]
+
+def update_kpi_term(criterion_id, criteria, competencies):
+    """on_change of a KRA input: replace only that KRA's weighted term"""
+    get_score_accumulator(criteria, competencies).set_kpi(criterion_id, st.session_state[f"score_{criterion_id}"])
+
+def update_competency_term(competency_id, criteria, competencies):
+    """on_change of a competency level: replace only that competency's weighted term"""
+    get_score_accumulator(criteria, competencies).set_level(competency_id, st.session_state[f"comp_{competency_id}"])
+
+@st.fragment
+def evaluation_inputs(criteria, competencies):
+    """Phần 1-3 of the employee form; score changes rerun only this fragment"""
+    # Group criteria by category
+    categories = {}
+    for criterion in criteria:
+        cat = criterion.get('category', 'Khác')
+        if cat not in categories:
+            categories[cat] = []
+        categories[cat].append(criterion)
+    
+    # Display each category
+    for category, items in categories.items():
+        st.markdown(f"### {category}")
+        total_weight = sum(item['weight'] for item in items)
+        st.caption(f"Tổng trọng số: {total_weight} điểm")
+        
+        for criterion in items:
+            # Extract KRA code and description
+            kra_parts = criterion['kra_name'].split(' - ', 1)
+            kra_code = kra_parts[0] if len(kra_parts) > 1 else ''
+            kra_desc = kra_parts[1] if len(kra_parts) > 1 else criterion['kra_name']
+            
+            with st.container():
+                st.markdown(f"**{kra_code}** {kra_desc}")
+                
+                col1, col2, col3 = st.columns([2, 2, 1])
+                
+                with col1:
+                    st.caption(f"📏 Cách đo lường: {criterion['description']}")
+                
+                with col2:
+                    st.number_input(
+                        "Dữ liệu thực tế (%)",
+                        min_value=0.0,
+                        max_value=150.0,
+                        value=100.0,
+                        step=1.0,
+                        key=f"score_{criterion['id']}",
+                        on_change=update_kpi_term,
+                        args=(criterion['id'], criteria, competencies)
+                    )
+                
+                with col3:
+                    st.metric("Trọng số", f"{criterion['weight']}")
+                
+                # Rating scale guide
+                with st.expander("📊 Thang đánh giá"):
+                    cols = st.columns(6)
+                    labels = [("Chưa đạt", "<70%"), ("Đạt", "70-89%"), 
+                             ("Tốt", "90-100%"), ("Xuất sắc", ">100%"),
+                             ("Vượt mức", "120%"), ("Xuất sắc", "150%")]
+                    for col, (label, range_val) in zip(cols, labels):
+                        col.caption(f"{label}\n{range_val}")
+                
+                st.text_input(
+                    "Ghi chú/Minh chứng",
+                    key=f"comment_{criterion['id']}"
+                )
+                st.markdown("---")
+    
+    st.markdown("")  # Spacing
+    
+    st.markdown("---")
+    st.markdown("### Phần 2: KPI Năng Lực")
+    st.info("Quản lý trực tiếp và nhân viên sẽ thảo luận và liệt kê những năng lực mà nhân viên cần phát huy trong quá trình làm việc.")
+    
+    # Group competencies by category
+    comp_categories = {}
+    for comp in competencies:
+        comp_categories.setdefault(comp.get('category', 'Khác'), []).append(comp)
+    
+    # Display competencies by category
+    for category, comps in comp_categories.items():
+        st.markdown(f"### {category}")
+        
+        if category == 'A. Năng lực cốt lõi':
+            st.caption("Năng lực cốt lõi và Mức độ quan trọng của phần này là cố định và áp dụng cho toàn bộ nhân viên")
+        elif category == 'B. Năng lực quản lý, lãnh đạo':
+            st.caption("Năng lực quản lý, lãnh đạo và Mức độ quan trọng của phần này chỉ áp dụng đối với các nhân viên đang giữ vị trí quản lý (Khối, phòng, bộ phận, nhóm)")
+        elif category == 'C. Năng lực chuyên môn':
+            st.caption("Trưởng bộ phận xác định năng lực chuyên môn cần thiết cho các vị trí công việc của bộ phận")
+        
+        for comp in comps:
+            with st.container():
+                # Competency name and importance
+                col_header1, col_header2 = st.columns([3, 1])
+                with col_header1:
+                    st.markdown(f"**{comp['name']}**")
+                    st.caption(comp['description'])
+                with col_header2:
+                    st.metric("Mức độ quan trọng", comp.get('importance_level', 2))
+                
+                # Show level scale
+                with st.expander("📊 Thang năng lực (Cấp độ 1-5)"):
+                    scale_cols = st.columns(5)
+                    scale_labels = [
+                        ("Cấp độ 1: Nhận thức (50%)", comp['level_1']),
+                        ("Cấp độ 2: Cơ bản (80%)", comp['level_2']),
+                        ("Cấp độ 3: Trung bình (100%)", comp['level_3']),
+                        ("Cấp độ 4: Cao cấp (120%)", comp['level_4']),
+                        ("Cấp độ 5: Chuyên gia (150%)", comp['level_5'])
+                    ]
+                    for col, (title, desc) in zip(scale_cols, scale_labels):
+                        col.caption(f"**{title}**")
+                        col.caption(desc)
+                
+                # Assessment inputs
+                col1, col2, col3 = st.columns([1, 1, 2])
+                
+                with col1:
+                    selected_level = st.number_input(
+                        "NV đánh giá (Cấp độ)",
+                        min_value=1,
+                        max_value=5,
+                        value=3,
+                        step=1,
+                        key=f"comp_{comp['id']}",
+                        on_change=update_competency_term,
+                        args=(comp['id'], criteria, competencies),
+                        help="Cấp 1→50% | Cấp 2→80% | Cấp 3→100% | Cấp 4→120% | Cấp 5→150%"
+                    )
+                        
+                    # Show mapping
+                    st.caption(f"**Điểm thực tế: {LEVEL_PERCENTAGES[selected_level]}%** • Quy tắc: 1→50% | 2→80% | 3→100% | 4→120% | 5→150%")
+                
+                with col2:
+                    st.text("")  # Placeholder for alignment
+                
+                with col3:
+                    st.text_area(
+                        "Minh chứng/Ví dụ cụ thể",
+                        key=f"comp_comment_{comp['id']}",
+                        height=80,
+                        help="Đưa ra ví dụ cụ thể thể hiện năng lực này"
+                    )
+                
+                st.markdown("---")
+        
+    st.markdown("")  # Spacing
+
+    st.markdown("---")
+    st.markdown("#### Phần 3: Sơ kết")
+    st.info("📊 Điểm số được cập nhật ngay khi bạn thay đổi dữ liệu")
+    
+    # Running totals kept by the input callbacks: no recomputation over every KRA, no DB query
+    # (rebuilt from the inputs if the session state governor evicted it)
+    accumulator = get_score_accumulator(criteria, competencies)
+    kpi_result = accumulator.kpi_result
+    comp_result = accumulator.comp_result
+    final_score = accumulator.final_score
+    
+    # Determine rating
+    rating = rating_for(final_score)
+    rating_emoji = {"A++": "🏆", "A+": "🥇", "A": "🟢", "B": "🟡"}.get(rating, "🔴")
+    
+    # Display summary table with improved UI
+    st.markdown("")
+    
+    # Header row
+    col_h1, col_h2, col_h3, col_h4 = st.columns([2, 2, 2, 1.5])
+    with col_h1:
+        st.markdown("<h6 style='text-align: center; color: #666;'>Trọng số</h6>", unsafe_allow_html=True)
+    with col_h2:
+        st.markdown("<h6 style='text-align: center; color: #666;'>Kết quả thực tế</h6>", unsafe_allow_html=True)
+    with col_h3:
+        st.markdown("<h6 style='text-align: center; color: #666;'>Kết quả sau cùng</h6>", unsafe_allow_html=True)
+    with col_h4:
+        st.markdown("<h6 style='text-align: center; color: #666;'>Xếp hạng</h6>", unsafe_allow_html=True)
+    
+    # KPI Thành tích row
+    col1, col2, col3, col4 = st.columns([2, 2, 2, 1.5])
+    with col1:
+        st.markdown("<div style='background-color: #f0f8ff; padding: 10px; border-radius: 5px; text-align: center;'>"
+                  "<b>KPI Thành tích</b><br><span style='font-size: 24px; color: #1f77b4;'>90%</span></div>", 
+                  unsafe_allow_html=True)
+    with col2:
+        st.markdown(f"<div style='background-color: #f0f8ff; padding: 10px; border-radius: 5px; text-align: center;'>"
+                  f"<span style='font-size: 24px; color: #1f77b4; font-weight: bold;'>{kpi_result:.1f}%</span></div>", 
+                  unsafe_allow_html=True)
+    with col3:
+        st.markdown(f"<div style='background-color: #e6f3ff; padding: 10px; border-radius: 5px; text-align: center;'>"
+                  f"<span style='font-size: 24px; color: #0066cc; font-weight: bold;'>{kpi_result * 0.9:.1f}%</span></div>", 
+                  unsafe_allow_html=True)
+    with col4:
+        st.markdown("")
+    
+    # KPI Năng lực row
+    col1, col2, col3, col4 = st.columns([2, 2, 2, 1.5])
+    with col1:
+        st.markdown("<div style='background-color: #fff5e6; padding: 10px; border-radius: 5px; text-align: center;'>"
+                  "<b>KPI Năng lực</b><br><span style='font-size: 24px; color: #ff8c00;'>10%</span></div>", 
+                  unsafe_allow_html=True)
+    with col2:
+        st.markdown(f"<div style='background-color: #fff5e6; padding: 10px; border-radius: 5px; text-align: center;'>"
+                  f"<span style='font-size: 24px; color: #ff8c00; font-weight: bold;'>{comp_result:.1f}%</span></div>", 
+                  unsafe_allow_html=True)
+    with col3:
+        st.markdown(f"<div style='background-color: #ffe6cc; padding: 10px; border-radius: 5px; text-align: center;'>"
+                  f"<span style='font-size: 24px; color: #cc6600; font-weight: bold;'>{comp_result * 0.1:.1f}%</span></div>", 
+                  unsafe_allow_html=True)
+    with col4:
+        st.markdown("")
+    
+    st.markdown("")
+    
+    # Final result row
+    col1, col2, col3, col4 = st.columns([2, 2, 2, 1.5])
+    with col1:
+        st.markdown("<div style='background-color: #f0f0f0; padding: 10px; border-radius: 5px; text-align: center;'>"
+                  "<b>Kết quả đánh giá</b></div>", 
+                  unsafe_allow_html=True)
+    with col2:
+        st.markdown("")
+    with col3:
+        delta_sign = "+" if final_score >= 100 else ""
+        delta_color = "#28a745" if final_score >= 100 else "#dc3545"
+        st.markdown(f"<div style='background-color: #e8f5e9; padding: 15px; border-radius: 5px; text-align: center; border: 2px solid #4caf50;'>"
+                  f"<span style='font-size: 32px; color: #2e7d32; font-weight: bold;'>{final_score:.1f}%</span><br>"
+                  f"<span style='font-size: 14px; color: {delta_color};'>{delta_sign}{final_score - 100:.1f}%</span></div>", 
+                  unsafe_allow_html=True)
+    with col4:
+        st.markdown(f"<div style='background-color: #fff3e0; padding: 15px; border-radius: 5px; text-align: center; border: 2px solid #ff9800;'>"
+                  f"<span style='font-size: 36px;'>{rating_emoji}</span><br>"
+                  f"<span style='font-size: 28px; color: #f57c00; font-weight: bold;'>{rating}</span></div>", 
+                  unsafe_allow_html=True)
+    
+
 # Employee dashboard
 def employee_dashboard():
     """Dashboard for employees"""
@@ -164,290 +555,24 @@ def employee_dashboard():
         st.success(f"✅ Tìm thấy {len(criteria)} tiêu chí đánh giá cho phòng ban '{department}'.")
         
         # Initialize session state for storing evaluation data
-        if 'eval_scores' not in st.session_state:
-            st.session_state.eval_scores = {}
-        if 'eval_comments' not in st.session_state:
-            st.session_state.eval_comments = {}
-        if 'eval_comp_levels' not in st.session_state:
-            st.session_state.eval_comp_levels = {}
-        if 'eval_comp_comments' not in st.session_state:
-            st.session_state.eval_comp_comments = {}
-        if 'show_results' not in st.session_state:
-            st.session_state.show_results = False
-        
         st.markdown("#### MỤC TIÊU CÔNG VIỆC")
         
+        competencies = get_all_competencies()
+        
+        # Check if user is manager to show leadership competencies
+        user_role = st.session_state.user.get('role_type', 'employee')
+        is_manager = user_role == 'manager'
+        
+        # Filter competencies based on role (exclude category B for employees)
+        relevant_competencies = [c for c in competencies 
+                                if is_manager or c.get('category') != 'B. Năng lực quản lý, lãnh đạo']
+        
+        # Score inputs and the Sơ kết preview rerun as a fragment, not the whole page
+        accumulator = get_score_accumulator(criteria, relevant_competencies)
+        evaluation_inputs(criteria, relevant_competencies)
+        
         # Use form to prevent Enter from submitting
         with st.form("employee_evaluation", clear_on_submit=False):
-            scores = {}
-            comments = {}
-            
-            # Group criteria by category
-            categories = {}
-            for criterion in criteria:
-                cat = criterion.get('category', 'Khác')
-                if cat not in categories:
-                    categories[cat] = []
-                categories[cat].append(criterion)
-            
-            # Display each category
-            for category, items in categories.items():
-                st.markdown(f"### {category}")
-                total_weight = sum(item['weight'] for item in items)
-                st.caption(f"Tổng trọng số: {total_weight} điểm")
-                
-                for criterion in items:
-                    # Extract KRA code and description
-                    kra_parts = criterion['kra_name'].split(' - ', 1)
-                    kra_code = kra_parts[0] if len(kra_parts) > 1 else ''
-                    kra_desc = kra_parts[1] if len(kra_parts) > 1 else criterion['kra_name']
-                    
-                    with st.container():
-                        st.markdown(f"**{kra_code}** {kra_desc}")
-                        
-                        col1, col2, col3 = st.columns([2, 2, 1])
-                        
-                        with col1:
-                            st.caption(f"📏 Cách đo lường: {criterion['description']}")
-                        
-                        with col2:
-                            scores[criterion['id']] = st.number_input(
-                                "Dữ liệu thực tế (%)",
-                                min_value=0.0,
-                                max_value=150.0,
-                                value=100.0,
-                                step=1.0,
-                                key=f"score_{criterion['id']}"
-                            )
-                        
-                        with col3:
-                            st.metric("Trọng số", f"{criterion['weight']}")
-                        
-                        # Rating scale guide
-                        with st.expander("📊 Thang đánh giá"):
-                            cols = st.columns(6)
-                            labels = [("Chưa đạt", "<70%"), ("Đạt", "70-89%"), 
-                                     ("Tốt", "90-100%"), ("Xuất sắc", ">100%"),
-                                     ("Vượt mức", "120%"), ("Xuất sắc", "150%")]
-                            for col, (label, range_val) in zip(cols, labels):
-                                col.caption(f"{label}\n{range_val}")
-                        
-                        comments[criterion['id']] = st.text_input(
-                            "Ghi chú/Minh chứng",
-                            key=f"comment_{criterion['id']}"
-                        )
-                        st.markdown("---")
-            
-            st.markdown("")  # Spacing
-            
-            st.markdown("---")
-            st.markdown("### Phần 2: KPI Năng Lực")
-            st.info("Quản lý trực tiếp và nhân viên sẽ thảo luận và liệt kê những năng lực mà nhân viên cần phát huy trong quá trình làm việc.")
-            
-            competencies = get_all_competencies()
-            comp_levels = {}
-            comp_comments = {}
-            
-            # Check if user is manager to show leadership competencies
-            user_role = st.session_state.user.get('role_type', 'employee')
-            is_manager = user_role == 'manager'
-            
-            # Group competencies by category
-            comp_categories = {}
-            for comp in competencies:
-                cat = comp.get('category', 'Khác')
-                
-                # Skip category B (leadership) for non-managers
-                if cat == 'B. Năng lực quản lý, lãnh đạo' and not is_manager:
-                    continue
-                    
-                if cat not in comp_categories:
-                    comp_categories[cat] = []
-                comp_categories[cat].append(comp)
-            
-            # Display competencies by category
-            for category, comps in comp_categories.items():
-                st.markdown(f"### {category}")
-                
-                if category == 'A. Năng lực cốt lõi':
-                    st.caption("Năng lực cốt lõi và Mức độ quan trọng của phần này là cố định và áp dụng cho toàn bộ nhân viên")
-                elif category == 'B. Năng lực quản lý, lãnh đạo':
-                    st.caption("Năng lực quản lý, lãnh đạo và Mức độ quan trọng của phần này chỉ áp dụng đối với các nhân viên đang giữ vị trí quản lý (Khối, phòng, bộ phận, nhóm)")
-                elif category == 'C. Năng lực chuyên môn':
-                    st.caption("Trưởng bộ phận xác định năng lực chuyên môn cần thiết cho các vị trí công việc của bộ phận")
-                
-                for comp in comps:
-                    with st.container():
-                        # Competency name and importance
-                        col_header1, col_header2 = st.columns([3, 1])
-                        with col_header1:
-                            st.markdown(f"**{comp['name']}**")
-                            st.caption(comp['description'])
-                        with col_header2:
-                            st.metric("Mức độ quan trọng", comp.get('importance_level', 2))
-                        
-                        # Show level scale
-                        with st.expander("📊 Thang năng lực (Cấp độ 1-5)"):
-                            scale_cols = st.columns(5)
-                            scale_labels = [
-                                ("Cấp độ 1: Nhận thức (50%)", comp['level_1']),
-                                ("Cấp độ 2: Cơ bản (80%)", comp['level_2']),
-                                ("Cấp độ 3: Trung bình (100%)", comp['level_3']),
-                                ("Cấp độ 4: Cao cấp (120%)", comp['level_4']),
-                                ("Cấp độ 5: Chuyên gia (150%)", comp['level_5'])
-                            ]
-                            for col, (title, desc) in zip(scale_cols, scale_labels):
-                                col.caption(f"**{title}**")
-                                col.caption(desc)
-                        
-                        # Assessment inputs
-                        col1, col2, col3 = st.columns([1, 1, 2])
-                        
-                        # Map level to percentage: 1->50%, 2->80%, 3->100%, 4->120%, 5->150%
-                        level_percentages = {1: 50, 2: 80, 3: 100, 4: 120, 5: 150}
-                        
-                        with col1:
-                            selected_level = st.number_input(
-                                "NV đánh giá (Cấp độ)",
-                                min_value=1,
-                                max_value=5,
-                                value=3,
-                                step=1,
-                                key=f"comp_{comp['id']}",
-                                help="Cấp 1→50% | Cấp 2→80% | Cấp 3→100% | Cấp 4→120% | Cấp 5→150%"
-                            )
-                            comp_levels[comp['id']] = selected_level
-                            
-                            # Show mapping
-                            st.caption(f"**Điểm thực tế: {level_percentages[selected_level]}%** • Quy tắc: 1→50% | 2→80% | 3→100% | 4→120% | 5→150%")
-                        
-                        with col2:
-                            st.text("")  # Placeholder for alignment
-                        
-                        with col3:
-                            comp_comments[comp['id']] = st.text_area(
-                                "Minh chứng/Ví dụ cụ thể",
-                                key=f"comp_comment_{comp['id']}",
-                                height=80,
-                                help="Đưa ra ví dụ cụ thể thể hiện năng lực này"
-                            )
-                        
-                        st.markdown("---")
-                
-            st.markdown("")  # Spacing
-        
-            st.markdown("---")
-            st.markdown("#### Phần 3: Sơ kết")
-            st.info("📊 Phần điểm số sẽ được tính tự động")
-            
-            # Calculate scores preview
-            kpi_score = sum(scores.get(cid, 0) * c['weight'] for c in criteria for cid in [c['id']] if cid in scores)
-            total_kpi_weight = sum(c['weight'] for c in criteria)
-            kpi_result = (kpi_score / total_kpi_weight) if total_kpi_weight > 0 else 0
-            
-            # Calculate competency score
-            # Map level to percentage: 1->50%, 2->80%, 3->100%, 4->120%, 5->150%
-            level_percentages = {1: 50, 2: 80, 3: 100, 4: 120, 5: 150}
-            
-            # Filter competencies based on role (exclude category B for employees)
-            relevant_competencies = [c for c in competencies 
-                                    if is_manager or c.get('category') != 'B. Năng lực quản lý, lãnh đạo']
-            
-            comp_score = sum(level_percentages[comp_levels.get(c['id'], 3)] * c.get('importance_level', 2)
-                           for c in relevant_competencies if c['id'] in comp_levels)
-            total_comp_weight = sum(c.get('importance_level', 2) * 100 for c in relevant_competencies)
-            comp_result = (comp_score / total_comp_weight * 100) if total_comp_weight > 0 else 0
-            
-            # Final calculation
-            final_score = kpi_result * 0.9 + comp_result * 0.1
-            
-            # Determine rating
-            rating = "C"
-            rating_emoji = "🔴"
-            if final_score >= 135:
-                rating = "A++"
-                rating_emoji = "🏆"
-            elif final_score >= 120:
-                rating = "A+"
-                rating_emoji = "🥇"
-            elif final_score >= 100:
-                rating = "A"
-                rating_emoji = "🟢"
-            elif final_score >= 80:
-                rating = "B"
-                rating_emoji = "🟡"
-            
-            # Display summary table with improved UI
-            st.markdown("")
-            
-            # Header row
-            col_h1, col_h2, col_h3, col_h4 = st.columns([2, 2, 2, 1.5])
-            with col_h1:
-                st.markdown("<h6 style='text-align: center; color: #666;'>Trọng số</h6>", unsafe_allow_html=True)
-            with col_h2:
-                st.markdown("<h6 style='text-align: center; color: #666;'>Kết quả thực tế</h6>", unsafe_allow_html=True)
-            with col_h3:
-                st.markdown("<h6 style='text-align: center; color: #666;'>Kết quả sau cùng</h6>", unsafe_allow_html=True)
-            with col_h4:
-                st.markdown("<h6 style='text-align: center; color: #666;'>Xếp hạng</h6>", unsafe_allow_html=True)
-            
-            # KPI Thành tích row
-            col1, col2, col3, col4 = st.columns([2, 2, 2, 1.5])
-            with col1:
-                st.markdown("<div style='background-color: #f0f8ff; padding: 10px; border-radius: 5px; text-align: center;'>"
-                          "<b>KPI Thành tích</b><br><span style='font-size: 24px; color: #1f77b4;'>90%</span></div>", 
-                          unsafe_allow_html=True)
-            with col2:
-                st.markdown(f"<div style='background-color: #f0f8ff; padding: 10px; border-radius: 5px; text-align: center;'>"
-                          f"<span style='font-size: 24px; color: #1f77b4; font-weight: bold;'>{kpi_result:.1f}%</span></div>", 
-                          unsafe_allow_html=True)
-            with col3:
-                st.markdown(f"<div style='background-color: #e6f3ff; padding: 10px; border-radius: 5px; text-align: center;'>"
-                          f"<span style='font-size: 24px; color: #0066cc; font-weight: bold;'>{kpi_result * 0.9:.1f}%</span></div>", 
-                          unsafe_allow_html=True)
-            with col4:
-                st.markdown("")
-            
-            # KPI Năng lực row
-            col1, col2, col3, col4 = st.columns([2, 2, 2, 1.5])
-            with col1:
-                st.markdown("<div style='background-color: #fff5e6; padding: 10px; border-radius: 5px; text-align: center;'>"
-                          "<b>KPI Năng lực</b><br><span style='font-size: 24px; color: #ff8c00;'>10%</span></div>", 
-                          unsafe_allow_html=True)
-            with col2:
-                st.markdown(f"<div style='background-color: #fff5e6; padding: 10px; border-radius: 5px; text-align: center;'>"
-                          f"<span style='font-size: 24px; color: #ff8c00; font-weight: bold;'>{comp_result:.1f}%</span></div>", 
-                          unsafe_allow_html=True)
-            with col3:
-                st.markdown(f"<div style='background-color: #ffe6cc; padding: 10px; border-radius: 5px; text-align: center;'>"
-                          f"<span style='font-size: 24px; color: #cc6600; font-weight: bold;'>{comp_result * 0.1:.1f}%</span></div>", 
-                          unsafe_allow_html=True)
-            with col4:
-                st.markdown("")
-            
-            st.markdown("")
-            
-            # Final result row
-            col1, col2, col3, col4 = st.columns([2, 2, 2, 1.5])
-            with col1:
-                st.markdown("<div style='background-color: #f0f0f0; padding: 10px; border-radius: 5px; text-align: center;'>"
-                          "<b>Kết quả đánh giá</b></div>", 
-                          unsafe_allow_html=True)
-            with col2:
-                st.markdown("")
-            with col3:
-                delta_sign = "+" if final_score >= 100 else ""
-                delta_color = "#28a745" if final_score >= 100 else "#dc3545"
-                st.markdown(f"<div style='background-color: #e8f5e9; padding: 15px; border-radius: 5px; text-align: center; border: 2px solid #4caf50;'>"
-                          f"<span style='font-size: 32px; color: #2e7d32; font-weight: bold;'>{final_score:.1f}%</span><br>"
-                          f"<span style='font-size: 14px; color: {delta_color};'>{delta_sign}{final_score - 100:.1f}%</span></div>", 
-                          unsafe_allow_html=True)
-            with col4:
-                st.markdown(f"<div style='background-color: #fff3e0; padding: 15px; border-radius: 5px; text-align: center; border: 2px solid #ff9800;'>"
-                          f"<span style='font-size: 36px;'>{rating_emoji}</span><br>"
-                          f"<span style='font-size: 28px; color: #f57c00; font-weight: bold;'>{rating}</span></div>", 
-                          unsafe_allow_html=True)
-            
             st.markdown("---")
             st.markdown("### Phần 4: Lĩnh vực cần phát triển")
             st.info("Nhân viên hoàn tất phần này và thảo luận cùng với Cấp trên trực tiếp để đảm bảo sự hiểu rõ kết quả nhận cầu phát triển của mỗi nhân viên và tổ chức.")
@@ -466,50 +591,26 @@ def employee_dashboard():
             
             st.markdown("---")
             
-            # Two buttons: Calculate and Submit  
-            col_btn1, col_btn2 = st.columns(2)
-            with col_btn1:
-                calculate_btn = st.form_submit_button("🧮 Tính điểm", use_container_width=True, type="primary")
-            with col_btn2:
-                submit_btn = st.form_submit_button("📤 Nộp hồ sơ", use_container_width=True, type="secondary")
-            
-            if calculate_btn:
-                st.success("✅ Đã tính điểm! Vui lòng xem Phần 3: Sơ kết ở trên.")
-                st.info("💡 Sau khi kiểm tra điểm số, nhấn '📤 Nộp hồ sơ' để lưu vào hệ thống.")
+            submit_btn = st.form_submit_button("📤 Nộp hồ sơ", use_container_width=True, type="primary")
             
             if submit_btn:
-                # Save to database
-                conn = get_db_connection()
-                cursor = conn.cursor()
+                scores = {c['id']: st.session_state[f"score_{c['id']}"] for c in criteria}
+                comments = {c['id']: st.session_state[f"comment_{c['id']}"] for c in criteria}
+                comp_levels = {c['id']: st.session_state[f"comp_{c['id']}"] for c in relevant_competencies}
+                comp_comments = {c['id']: st.session_state[f"comp_comment_{c['id']}"] for c in relevant_competencies}
+                kpi_result = accumulator.kpi_result
+                comp_result = accumulator.comp_result
+                final_score = accumulator.final_score
+                rating = accumulator.rating
                 
+                # Save to database through the single writer (one group commit)
                 try:
-                    # Create evaluation record
-                    cursor.execute('''
-                    INSERT INTO evaluations 
-                    (user_id, year, period, status, employee_score, employee_comment, development_areas, employee_submitted_at)
-                    VALUES (?, ?, ?, ?, ?, ?, ?, ?)
-                    ''', (st.session_state.user['id'], 2025, 'Annual', 'submitted', 
-                          final_score, overall_comment, development_areas, datetime.now()))
-                    
-                    evaluation_id = cursor.lastrowid
-                    
-                    # Save criterion details
-                    for criterion_id, score in scores.items():
-                        cursor.execute('''
-                        INSERT INTO evaluation_details 
-                        (evaluation_id, criterion_id, employee_score, employee_comment)
-                        VALUES (?, ?, ?, ?)
-                        ''', (evaluation_id, criterion_id, score, comments.get(criterion_id, '')))
-                    
-                    # Save competency evaluations
-                    for comp_id, level in comp_levels.items():
-                        cursor.execute('''
-                        INSERT INTO competency_evaluations
-                        (evaluation_id, competency_id, employee_level, employee_comment)
-                        VALUES (?, ?, ?, ?)
-                        ''', (evaluation_id, comp_id, level, comp_comments.get(comp_id, '')))
-                    
-                    conn.commit()
+                    writer.run(
+                        writer.submit_evaluation,
+                        st.session_state.user['id'], REVIEW_YEAR, final_score,
+                        overall_comment, development_areas,
+                        scores, comments, comp_levels, comp_comments
+                    )
                     
                     # Display results
                     st.success(f"✅ Đánh giá đã được lưu thành công!")
@@ -526,10 +627,7 @@ def employee_dashboard():
                     st.balloons()
                     
                 except Exception as e:
-                    conn.rollback()
                     st.error(f"Lỗi khi lưu đánh giá: {str(e)}")
-                finally:
-                    conn.close()
     
     with tab2:
         st.markdown("### 📋 Lịch sử đánh giá")
@@ -540,22 +638,8 @@ def employee_dashboard():
         else:
             for eval in evaluations:
                 # Calculate rating
-                score = eval['employee_score'] or 0
-                if score >= 135:
-                    rating = "A++"
-                    rating_color = "🟢"
-                elif score >= 120:
-                    rating = "A+"
-                    rating_color = "🟢"
-                elif score >= 100:
-                    rating = "A"
-                    rating_color = "🟡"
-                elif score >= 80:
-                    rating = "B"
-                    rating_color = "🟠"
-                else:
-                    rating = "C"
-                    rating_color = "🔴"
+                rating = rating_for(eval['employee_score'])
+                rating_color = {"A++": "🟢", "A+": "🟢", "A": "🟡", "B": "🟠"}.get(rating, "🔴")
                 
                 with st.expander(f"📅 Đánh giá năm {eval['year']} - {eval['period']} | {rating_color} Xếp hạng: {rating} ({eval['status']})"):
                     
@@ -579,82 +663,70 @@ def employee_dashboard():
                     # Get detailed criteria scores
                     conn = get_db_connection()
                     cursor = conn.cursor()
+                    details_table = archive.table_for(conn, 'evaluation_details', eval['year'], eval['archived'])
+                    competencies_table = archive.table_for(conn, 'competency_evaluations', eval['year'], eval['archived'])
                     
                     # KPI Details
                     st.markdown("#### 📈 Chi tiết KPI Thành tích")
-                    cursor.execute('''
+                    cursor.execute(f'''
                         SELECT ec.category, ec.kra_name, ec.description, ec.weight,
                                ed.employee_score, ed.employee_comment
-                        FROM evaluation_details ed
+                        FROM {details_table} ed
                         JOIN evaluation_criteria ec ON ed.criterion_id = ec.id
                         WHERE ed.evaluation_id = ?
                         ORDER BY ec.category, ec.kra_name
                     ''', (eval['id'],))
                     
-                    kpi_details = cursor.fetchall()
+                    kpi_details = records.fetch_records(cursor, records.EvaluationDetail)
                     if kpi_details:
                         current_category = None
                         for detail in kpi_details:
-                            category = detail[0]
-                            if category != current_category:
-                                st.markdown(f"**{category}**")
-                                current_category = category
-                            
-                            kra_name = detail[1]
-                            description = detail[2]
-                            weight = detail[3]
-                            score = detail[4]
-                            comment = detail[5]
+                            if detail.category != current_category:
+                                st.markdown(f"**{detail.category}**")
+                                current_category = detail.category
                             
                             col_a, col_b, col_c = st.columns([3, 1, 2])
                             with col_a:
-                                st.caption(f"• {kra_name}")
-                                st.caption(f"  📏 {description}")
+                                st.caption(f"• {detail.kra_name}")
+                                st.caption(f"  📏 {detail.description}")
                             with col_b:
-                                st.caption(f"Trọng số: {weight}")
-                                st.caption(f"Điểm: {score}%")
+                                st.caption(f"Trọng số: {detail.weight}")
+                                st.caption(f"Điểm: {detail.employee_score}%")
                             with col_c:
-                                if comment:
-                                    st.caption(f"💬 {comment}")
+                                if detail.employee_comment:
+                                    st.caption(f"💬 {detail.employee_comment}")
                     
                     st.markdown("---")
                     
                     # Competency Details
                     st.markdown("#### 🎯 Chi tiết KPI Năng lực")
-                    cursor.execute('''
+                    cursor.execute(f'''
                         SELECT c.category, c.name, c.description, c.importance_level,
                                ce.employee_level, ce.employee_comment
-                        FROM competency_evaluations ce
+                        FROM {competencies_table} ce
                         JOIN competencies c ON ce.competency_id = c.id
                         WHERE ce.evaluation_id = ?
                         ORDER BY c.category, c.name
                     ''', (eval['id'],))
                     
-                    comp_details = cursor.fetchall()
+                    comp_details = records.fetch_records(cursor, records.CompetencyDetail)
                     if comp_details:
                         current_category = None
                         for detail in comp_details:
-                            category = detail[0]
-                            if category != current_category:
-                                st.markdown(f"**{category}**")
-                                current_category = category
-                            
-                            name = detail[1]
-                            description = detail[2]
-                            importance = detail[3]
-                            level = detail[4]
-                            comment = detail[5]
+                            if detail.category != current_category:
+                                st.markdown(f"**{detail.category}**")
+                                current_category = detail.category
                             
                             col_a, col_b, col_c = st.columns([3, 1, 2])
                             with col_a:
-                                st.caption(f"• {name}")
-                                st.caption(f"  {description}")
+                                st.caption(f"• {detail.name}")
+                                st.caption(f"  {detail.description}")
                             with col_b:
-                                st.caption(f"Mức quan trọng: {importance}")
-                                st.caption(f"Cấp độ: {level}/5")
+                                st.caption(f"Mức quan trọng: {detail.importance_level}")
+                                st.caption(f"Cấp độ: {detail.employee_level}/5")
                             with col_c:
-                                if comment:
-                                    st.caption(f"💬 {comment}")
+                                if detail.employee_comment:
+                                    st.caption(f"💬 {detail.employee_comment}")
                     
                     conn.close()
                     
@@ -690,99 +762,14 @@ def employee_dashboard():
                     
                     # Prepare data for PDF from database
                     conn_pdf = get_db_connection()
-                    cursor_pdf = conn_pdf.cursor()
-                    
-                    # Get KPI items
-                    cursor_pdf.execute('''
-                        SELECT ec.kra_name, ec.weight, ed.employee_score, ed.employee_comment
-                        FROM evaluation_details ed
-                        JOIN evaluation_criteria ec ON ed.criterion_id = ec.id
-                        WHERE ed.evaluation_id = ?
-                    ''', (eval['id'],))
-                    
-                    kpi_items = []
-                    kpi_score_sum = 0
-                    total_kpi_weight = 0
-                    for row in cursor_pdf.fetchall():
-                        kra_name, weight, score, comment = row
-                        achieved = score * weight  # score is already in %, weight is %
-                        kpi_score_sum += achieved
-                        total_kpi_weight += weight
-                        kpi_items.append({
-                            'name': kra_name,
-                            'weight': weight,
-                            'result': score,
-                            'score': achieved,
-                            'evidence': comment or ''
-                        })
-                    
-                    # Calculate KPI result percentage
-                    kpi_result = (kpi_score_sum / total_kpi_weight) if total_kpi_weight > 0 else 0
-                    
-                    # Get competency items
-                    cursor_pdf.execute('''
-                        SELECT c.name, c.importance_level, ce.employee_level, ce.employee_comment
-                        FROM competency_evaluations ce
-                        JOIN competencies c ON ce.competency_id = c.id
-                        WHERE ce.evaluation_id = ?
-                    ''', (eval['id'],))
-                    
-                    comp_items = []
-                    level_mapping = {1: 50, 2: 80, 3: 100, 4: 120, 5: 150}
-                    comp_score_sum = 0
-                    total_comp_weight = 0
-                    for row in cursor_pdf.fetchall():
-                        name, importance_level, level, comment = row
-                        percentage = level_mapping.get(level, 100)
-                        # Score for this competency: percentage * importance_level
-                        comp_score = percentage * importance_level
-                        comp_score_sum += comp_score
-                        total_comp_weight += importance_level * 100
-                        comp_items.append({
-                            'name': name,
-                            'level': level,
-                            'percentage': percentage,
-                            'weight': importance_level,
-                            'score': comp_score,
-                            'evidence': comment or ''
-                        })
-                    
-                    # Calculate competency result percentage
-                    comp_result = (comp_score_sum / total_comp_weight * 100) if total_comp_weight > 0 else 0
-                    
+                    pdf_data = evaluation_pdf_data(conn_pdf, eval)
                     conn_pdf.close()
                     
-                    # Calculate final score
-                    final_score_pdf = kpi_result * 0.9 + comp_result * 0.1
-                    
-                    # Determine rating (same logic as in form)
-                    if final_score_pdf >= 135:
-                        rating = "A++"
-                    elif final_score_pdf >= 120:
-                        rating = "A+"
-                    elif final_score_pdf >= 100:
-                        rating = "A"
-                    elif final_score_pdf >= 80:
-                        rating = "B"
-                    else:
-                        rating = "C"
-                    
-                    pdf_data = {
-                        'kpi_items': kpi_items,
-                        'kpi_total': kpi_result,
-                        'comp_items': comp_items,
-                        'comp_total': comp_result,
-                        'final_score': final_score_pdf,
-                        'rating': rating,
-                        'comments': eval.get('employee_comment', '')
-                    }
-                    
                     try:
-                        pdf_buffer = generate_evaluation_pdf(st.session_state.user, pdf_data)
-                        
+                        # Built on click, so ReportLab is only loaded when a PDF is requested
                         st.download_button(
                             label="📄 Tải xuống Phiếu đánh giá (PDF)",
-                            data=pdf_buffer,
+                            data=evaluation_pdf(dict(st.session_state.user), pdf_data),
                             file_name=f"EPR_{st.session_state.user['fullname'].replace(' ', '_')}_{eval['year']}_{datetime.now().strftime('%Y%m%d')}.pdf",
                             mime="application/pdf",
                             use_container_width=True,
@@ -792,6 +779,106 @@ def employee_dashboard():
                     except Exception as e:
                         st.error(f"Lỗi tạo PDF: {str(e)}")
 
+def evaluation_pdf_data(conn, evaluation):
+    """KPI and competency lines, totals and rating of one evaluation for its PDF"""
+    cursor = conn.cursor()
+    details_table = archive.table_for(conn, 'evaluation_details', evaluation['year'], evaluation['archived'])
+    competencies_table = archive.table_for(conn, 'competency_evaluations', evaluation['year'], evaluation['archived'])
+
+    # Get KPI items
+    cursor.execute(f'''
+        SELECT ec.kra_name, ec.weight, ed.employee_score, ed.employee_comment
+        FROM {details_table} ed
+        JOIN evaluation_criteria ec ON ed.criterion_id = ec.id
+        WHERE ed.evaluation_id = ?
+    ''', (evaluation['id'],))
+
+    kpi_items = []
+    kpi_score_sum = 0
+    total_kpi_weight = 0
+    for row in cursor.fetchall():
+        kra_name, weight, score, comment = row
+        achieved = score * weight  # score is already in %, weight is %
+        kpi_score_sum += achieved
+        total_kpi_weight += weight
+        kpi_items.append({
+            'name': kra_name,
+            'weight': weight,
+            'result': score,
+            'score': achieved,
+            'evidence': comment or ''
+        })
+
+    # Calculate KPI result percentage
+    kpi_result = (kpi_score_sum / total_kpi_weight) if total_kpi_weight > 0 else 0
+
+    # Get competency items
+    cursor.execute(f'''
+        SELECT c.name, c.importance_level, ce.employee_level, ce.employee_comment
+        FROM {competencies_table} ce
+        JOIN competencies c ON ce.competency_id = c.id
+        WHERE ce.evaluation_id = ?
+    ''', (evaluation['id'],))
+
+    comp_items = []
+    level_mapping = {1: 50, 2: 80, 3: 100, 4: 120, 5: 150}
+    comp_score_sum = 0
+    total_comp_weight = 0
+    for row in cursor.fetchall():
+        name, importance_level, level, comment = row
+        percentage = level_mapping.get(level, 100)
+        # Score for this competency: percentage * importance_level
+        comp_score = percentage * importance_level
+        comp_score_sum += comp_score
+        total_comp_weight += importance_level * 100
+        comp_items.append({
+            'name': name,
+            'level': level,
+            'percentage': percentage,
+            'weight': importance_level,
+            'score': comp_score,
+            'evidence': comment or ''
+        })
+
+    # Calculate competency result percentage
+    comp_result = (comp_score_sum / total_comp_weight * 100) if total_comp_weight > 0 else 0
+
+    # Calculate final score
+    final_score_pdf = kpi_result * 0.9 + comp_result * 0.1
+
+    # Determine rating (same logic as in form)
+    rating = rating_for(final_score_pdf)
+
+    return {
+        'kpi_items': kpi_items,
+        'kpi_total': kpi_result,
+        'comp_items': comp_items,
+        'comp_total': comp_result,
+        'final_score': final_score_pdf,
+        'rating': rating,
+        'comments': evaluation.get('employee_comment', '')
+    }
+
+def evaluation_pdf(user_info, pdf_data):
+    """Deferred PDF for st.download_button"""
+    def build():
+        from pdf_generator import generate_evaluation_pdf
+        return generate_evaluation_pdf(user_info, pdf_data).getvalue()
+    return build
+
+def department_book_pdf(title, evaluations):
+    """Deferred department book for st.download_button; reports are read one at a time"""
+    def build():
+        from pdf_generator import generate_department_book
+        conn = get_db_connection()
+        try:
+            reports = ((evaluation, evaluation_pdf_data(conn, evaluation)) for evaluation in evaluations)
+            # One copy of the embedded fonts for the whole book, no ASCII85
+            return generate_department_book(title, evaluations, reports, profile='archival').getvalue()
+        finally:
+            conn.close()
+    return build
+
 # Manager dashboard
 def manager_dashboard():
     """Dashboard for managers"""
@@ -799,19 +886,25 @@ def manager_dashboard():
     st.subheader(f"Chào {st.session_state.user['fullname']}")
     
     # Get all employees reporting to this manager
-    conn = get_db_connection()
-    cursor = conn.cursor()
-    cursor.execute(
-        "SELECT * FROM users WHERE report_to = ? AND is_manager = 0",
-        (st.session_state.user['fullname'],)
-    )
-    employees = [dict(row) for row in cursor.fetchall()]
-    conn.close()
+    employees = get_team(st.session_state.user['fullname'])
     
     if not employees:
         st.info("Bạn chưa có nhân viên nào báo cáo trực tiếp.")
         return
     
+    with st.expander("⚖️ Mô phỏng phân phối xếp loại"):
+        calibration_view(report_to=st.session_state.user['fullname'])
+    
+    book = get_book_evaluations(report_to=st.session_state.user['fullname'])
+    if book:
+        st.download_button(
+            label=f"📚 Tải sổ đánh giá của nhóm {REVIEW_YEAR} (PDF)",
+            data=department_book_pdf(f"Sổ đánh giá nhóm {st.session_state.user['fullname']} {REVIEW_YEAR}", book),
+            file_name=f"EPR_Team_{REVIEW_YEAR}_{datetime.now().strftime('%Y%m%d')}.pdf",
+            mime="application/pdf",
+            key="mgr_book"
+        )
+    
     st.markdown(f"### Danh sách nhân viên ({len(employees)} người)")
     
     for emp in employees:
@@ -833,6 +926,15 @@ def manager_dashboard():
                         st.write(eval['employee_comment'])
                 
                 with col2:
+                    if eval['archived']:
+                        # Closed years live in read-only archive files
+                        st.markdown("**Đánh giá của quản lý:**")
+                        st.metric("Điểm quản lý", f"{eval['manager_score']:.2f}" if eval['manager_score'] else "N/A")
+                        if eval['manager_comment']:
+                            st.write(eval['manager_comment'])
+                        st.caption("🗄️ Năm đã lưu trữ, không thể chỉnh sửa")
+                        st.markdown("---")
+                        continue
                     with st.form(f"manager_review_{eval['id']}"):
                         st.markdown("**Đánh giá của bạn:**")
                         
@@ -851,36 +953,42 @@ def manager_dashboard():
                         )
                         
                         if st.form_submit_button("💾 Lưu đánh giá quản lý"):
-                            conn = get_db_connection()
-                            cursor = conn.cursor()
                             try:
-                                cursor.execute('''
-                                UPDATE evaluations 
-                                SET manager_score = ?, manager_comment = ?, 
-                                    manager_submitted_at = ?, status = 'manager_reviewed',
-                                    final_score = ?, rating = ?
-                                WHERE id = ?
-                                ''', (manager_score, manager_comment, datetime.now(),
-                                     (eval['employee_score'] + manager_score) / 2,
-                                     'Đạt' if manager_score >= 70 else 'Chưa đạt',
-                                     eval['id']))
-                                conn.commit()
+                                writer.run(writer.save_manager_review, eval['id'],
+                                           eval['employee_score'], manager_score, manager_comment)
                                 st.success("✅ Đánh giá đã được lưu!")
                                 st.rerun()
                             except Exception as e:
-                                conn.rollback()
                                 st.error(f"Lỗi: {str(e)}")
-                            finally:
-                                conn.close()
                 st.markdown("---")
 
 # Admin dashboard
 def admin_dashboard():
     """Dashboard for administrators"""
+    import pandas as pd
+    import snapshot
     st.title("🔧 Quản trị Hệ thống")
     st.subheader(f"Chào {st.session_state.user['fullname']}")
     
-    tab1, tab2, tab3 = st.tabs(["📊 Tổng quan", "👥 Quản lý người dùng", "📥 Xuất báo cáo"])
+    # Reports can read the latest columnar snapshot instead of the live database
+    snap_col1, snap_col2 = st.columns([3, 1])
+    latest = snapshot.latest_snapshot()
+    with snap_col1:
+        use_snapshot = False
+        if latest:
+            taken_at = snapshot.snapshot_time(latest[0]).strftime('%d/%m/%Y %H:%M')
+            use_snapshot = st.toggle(f"Đọc báo cáo từ snapshot ({taken_at})", key="admin_use_snapshot")
+        else:
+            st.caption("Chưa có snapshot dữ liệu cho báo cáo.")
+    with snap_col2:
+        if st.button("📸 Tạo snapshot", use_container_width=True):
+            snapshot.export_snapshot()
+            st.rerun()
+    tables = snapshot.load_snapshot() if use_snapshot else None
+    
+    tab1, tab2, tab3, tab4, tab5, tab6, tab7, tab8 = st.tabs(["📊 Tổng quan", "👥 Quản lý người dùng", "📥 Xuất báo cáo",
+                                                              "📈 Xu hướng", "⚖️ Hiệu chỉnh", "📚 Danh mục",
+                                                              "🔎 Tìm kiếm", "✅ Tiến độ"])
     
     with tab1:
         st.markdown("### Thống kê tổng quan")
@@ -892,9 +1000,9 @@ def admin_dashboard():
         cursor.execute("SELECT role_type, COUNT(*) as count FROM users GROUP BY role_type")
         role_counts = cursor.fetchall()
         
-        col1, col2, col3 = st.columns(3)
-        for i, row in enumerate(role_counts):
-            with [col1, col2, col3][i]:
+        role_cols = st.columns(max(len(role_counts), 1))
+        for col, row in zip(role_cols, role_counts):
+            with col:
                 st.metric(row['role_type'].title(), row['count'])
         
         # Evaluation statistics
@@ -918,14 +1026,24 @@ def admin_dashboard():
         
         # All evaluations table
         st.markdown("### Danh sách đánh giá")
-        cursor.execute('''
-        SELECT u.fullname, u.code, u.department, e.year, e.status,
-               e.employee_score, e.manager_score, e.final_score, e.rating
-        FROM evaluations e
-        JOIN users u ON e.user_id = u.id
-        ORDER BY e.created_at DESC
-        ''')
-        evals_df = pd.DataFrame([dict(row) for row in cursor.fetchall()])
+        if tables is not None:
+            evals_df = (snapshot.to_frame(tables['evaluations'],
+                                          ['user_id', 'created_at', 'year', 'status', 'employee_score',
+                                           'manager_score', 'final_score', 'rating'])
+                        .merge(snapshot.to_frame(tables['users'], ['id', 'fullname', 'code', 'department']),
+                               left_on='user_id', right_on='id')
+                        .sort_values('created_at', ascending=False)
+                        [['fullname', 'code', 'department', 'year', 'status',
+                          'employee_score', 'manager_score', 'final_score', 'rating']])
+        else:
+            cursor.execute('''
+            SELECT u.fullname, u.code, u.department, e.year, e.status,
+                   e.employee_score, e.manager_score, e.final_score, e.rating
+            FROM evaluations e
+            JOIN users u ON e.user_id = u.id
+            ORDER BY e.created_at DESC
+            ''')
+            evals_df = pd.DataFrame([dict(row) for row in cursor.fetchall()])
         
         if not evals_df.empty:
             st.dataframe(evals_df, use_container_width=True)
@@ -933,6 +1051,23 @@ def admin_dashboard():
             st.info("Chưa có đánh giá nào trong hệ thống.")
         
         conn.close()
+        
+        # Session state held by this server process (see session_memory.py)
+        st.markdown("### Bộ nhớ phiên")
+        usage = session_memory.totals()
+        col1, col2, col3, col4 = st.columns(4)
+        with col1:
+            st.metric("Phiên đang hoạt động", usage['sessions'])
+        with col2:
+            st.metric("Tổng dung lượng", f"{usage['bytes'] / 2 ** 20:.1f} MB")
+        with col3:
+            st.metric("Phiên lớn nhất", f"{usage['max_bytes'] / 1024:.0f} KB")
+        with col4:
+            st.metric("Vượt ngưỡng", usage['over_threshold'],
+                      help=f"Ngưỡng cảnh báo {session_memory.WARN_SESSION_BYTES // 1024} KB/phiên "
+                           "(EPR_SESSION_STATE_WARN_KB); dữ liệu người dùng đang nhập không bị xóa")
+        
+        profiling_panel()
     
     with tab2:
         st.markdown("### Danh sách người dùng")
@@ -963,23 +1098,14 @@ def admin_dashboard():
                 new_report_to = st.text_input("Báo cáo cho (mã)")
             
             if st.form_submit_button("➕ Thêm người dùng"):
-                conn = get_db_connection()
-                cursor = conn.cursor()
                 try:
-                    cursor.execute('''
-                    INSERT INTO users (code, fullname, username, password, department, 
-                                      role_type, emp_type, report_to)
-                    VALUES (?, ?, ?, ?, ?, ?, ?, ?)
-                    ''', (new_code, new_fullname, new_username, hash_password(new_password),
-                         new_department, new_role, new_emp_type, new_report_to))
-                    conn.commit()
+                    writer.run(writer.insert_user, new_code, new_fullname, new_username,
+                               hash_password(new_password), new_department, new_role,
+                               new_emp_type, new_report_to)
                     st.success(f"✅ Đã thêm người dùng {new_fullname}!")
                     st.rerun()
                 except Exception as e:
-                    conn.rollback()
                     st.error(f"Lỗi: {str(e)}")
-                finally:
-                    conn.close()
     
     with tab3:
         st.markdown("### Xuất báo cáo")
@@ -989,50 +1115,481 @@ def admin_dashboard():
             ["Tất cả đánh giá", "Theo phòng ban", "Theo trạng thái"]
         )
         
+        conn = get_db_connection()
+        cursor = conn.cursor()
+        if report_type == "Theo phòng ban":
+            cursor.execute("SELECT DISTINCT department FROM users WHERE department IS NOT NULL ORDER BY department")
+            dept = st.selectbox("Chọn phòng ban", [row[0] for row in cursor.fetchall()])
+        elif report_type == "Theo trạng thái":
+            cursor.execute("SELECT DISTINCT status FROM evaluations WHERE status IS NOT NULL ORDER BY status")
+            status = st.selectbox("Chọn trạng thái", [row[0] for row in cursor.fetchall()])
+        conn.close()
+        
+        detailed = st.checkbox("Chi tiết: mỗi KRA và năng lực một cột, mỗi phòng ban một sheet",
+                               key="admin_export_detailed")
+        
         if st.button("📥 Xuất Excel"):
             conn = get_db_connection()
+            output = io.BytesIO()
             
-            if report_type == "Tất cả đánh giá":
+            if detailed:
+                # Pivoted in SQL and streamed into a write-only workbook
+                import detailed_export
+                detailed_export.export_workbook(
+                    conn, output,
+                    department=dept if report_type == "Theo phòng ban" else None,
+                    status=status if report_type == "Theo trạng thái" else None
+                )
+                conn.close()
+                file_name = f"EPR_Report_Detail_{datetime.now().strftime('%Y%m%d')}.xlsx"
+            else:
+                # Filters are always bound as parameters, never formatted into the SQL
                 query = '''
                 SELECT u.code, u.fullname, u.department, e.year, e.period,
                        e.employee_score, e.manager_score, e.final_score, 
                        e.rating, e.status
                 FROM evaluations e
                 JOIN users u ON e.user_id = u.id
-                ORDER BY u.department, u.code
                 '''
-            elif report_type == "Theo phòng ban":
-                dept = st.selectbox("Chọn phòng ban", ['Sales', 'Office', 'Marketing', 'CS'])
-                query = f'''
-                SELECT u.code, u.fullname, u.department, e.year, e.period,
-                       e.employee_score, e.manager_score, e.final_score, 
-                       e.rating, e.status
-                FROM evaluations e
-                JOIN users u ON e.user_id = u.id
-                WHERE u.department = '{dept}'
-                ORDER BY u.code
-                '''
-            
-            df = pd.read_sql_query(query, conn)
-            conn.close()
-            
-            # Create Excel file in memory
-            output = io.BytesIO()
-            with pd.ExcelWriter(output, engine='xlsxwriter') as writer:
-                df.to_excel(writer, sheet_name='Evaluations', index=False)
+                params = []
+                if report_type == "Theo phòng ban":
+                    query += " WHERE u.department = ? ORDER BY u.code"
+                    params.append(dept)
+                elif report_type == "Theo trạng thái":
+                    query += " WHERE e.status = ? ORDER BY u.department, u.code"
+                    params.append(status)
+                else:
+                    query += " ORDER BY u.department, u.code"
+                
+                df = storage.read_frame(conn, query, params)
+                conn.close()
+                
+                # Create Excel file in memory
+                with pd.ExcelWriter(output, engine='openpyxl') as excel_writer:
+                    df.to_excel(excel_writer, sheet_name='Evaluations', index=False)
+                file_name = f"EPR_Report_{datetime.now().strftime('%Y%m%d')}.xlsx"
             
             st.download_button(
                 label="⬇️ Tải xuống",
                 data=output.getvalue(),
-                file_name=f"EPR_Report_{datetime.now().strftime('%Y%m%d')}.xlsx",
+                file_name=file_name,
                 mime="application/vnd.openxmlformats-officedocument.spreadsheetml.sheet"
             )
             st.success("✅ File đã sẵn sàng để tải!")
+        
+        if report_type == "Theo phòng ban" and dept:
+            book = get_book_evaluations(department=dept)
+            if book:
+                st.download_button(
+                    label=f"📚 Tải sổ đánh giá phòng ban {REVIEW_YEAR} (PDF, {len(book)} phiếu)",
+                    data=department_book_pdf(f"Sổ đánh giá {dept} {REVIEW_YEAR}", book),
+                    file_name=f"EPR_Book_{dept.replace(' ', '_')}_{REVIEW_YEAR}_{datetime.now().strftime('%Y%m%d')}.pdf",
+                    mime="application/pdf",
+                    key="admin_book"
+                )
+    
+    with tab4:
+        trends_tab()
+    
+    with tab5:
+        calibration_view(tables=tables)
+    
+    with tab6:
+        catalogue_tab()
+    
+    with tab7:
+        search_tab()
+    
+    with tab8:
+        progress_tab()
+
+def profiling_panel():
+    """Arm page profiling for a user and download the captures"""
+    st.markdown("### Profiling trang")
+    st.caption("Ghi lại một lượt tải trang khi người dùng báo chậm. Cũng có thể thêm `?profile=1` "
+               "(hoặc `?profile=cprofile`) vào URL của phiên cần đo.")
+    conn = get_db_connection()
+    usernames = [row[0] for row in conn.execute("SELECT username FROM users ORDER BY username")]
+    conn.close()
+    col1, col2, col3, col4 = st.columns([3, 1, 2, 2])
+    with col1:
+        username = st.selectbox("Người dùng", usernames, key="admin_profile_user")
+    with col2:
+        reruns = st.number_input("Số lượt", 1, 20, 1, key="admin_profile_reruns")
+    with col3:
+        mode = st.selectbox("Chế độ", list(profiling.MODES), key="admin_profile_mode")
+    with col4:
+        st.write("")
+        if st.button("🔬 Bật profiling", key="admin_profile_arm", use_container_width=True):
+            profiling.arm(username, int(reruns), mode)
+    
+    for armed_user, (left, armed_mode) in profiling.armed().items():
+        col1, col2 = st.columns([4, 1])
+        with col1:
+            st.caption(f"⏳ {armed_user}: còn {left} lượt ({armed_mode})")
+        with col2:
+            if st.button("Tắt", key=f"admin_profile_disarm_{armed_user}"):
+                profiling.disarm(armed_user)
+                st.rerun()
+    
+    captures = profiling.list_profiles()
+    if not captures:
+        st.info(f"Chưa có profile nào trong thư mục {profiling.PROFILE_DIR}.")
+        return
+    for capture in captures[:10]:
+        col1, col2 = st.columns([4, 1])
+        with col1:
+            st.caption(f"{capture['name']} - {capture['bytes'] / 1024:.1f} KB")
+        with col2:
+            st.download_button("⬇️ Tải", data=profile_file(capture['path']), file_name=capture['name'],
+                               mime="text/plain", key=f"admin_profile_dl_{capture['name']}")
+
+def profile_file(path):
+    """Deferred file read for st.download_button"""
+    def read():
+        with open(path, 'rb') as f:
+            return f.read()
+    return read
+
+def calibration_view(report_to=None, tables=None):
+    """Score percentiles, rating distribution, score gaps and forced-curve simulation"""
+    import pandas as pd
+    import calibration
+    import snapshot
+    key = "mgr" if report_to else "admin"
+    if tables is not None:
+        years = snapshot.distinct(tables['evaluations'], 'year') or [REVIEW_YEAR]
+        year = st.selectbox("Năm đánh giá", years[::-1], key=f"calib_year_{key}")
+        df = calibration.scores_from_snapshot(tables, year, report_to=report_to)
+    else:
+        conn = get_db_connection()
+        evaluations = archive.history_tables(conn)['evaluations']
+        years = calibration.available_years(conn, evaluations) or [REVIEW_YEAR]
+        year = st.selectbox("Năm đánh giá", years[::-1], key=f"calib_year_{key}")
+        df = calibration.load_scores(conn, year, report_to=report_to, source=evaluations)
+        conn.close()
+    
+    if df.empty:
+        st.info("Chưa có đánh giá nào cho năm này.")
+        return
+    
+    departments = sorted(df['department'].unique())
+    selected = st.multiselect("Phòng ban", departments, default=departments, key=f"calib_depts_{key}")
+    df = df[df['department'].isin(selected)]
+    if df.empty:
+        return
+    
+    st.markdown("#### Phân vị điểm theo phòng ban")
+    pct = calibration.percentiles(df)
+    st.dataframe(pct.style.format("{:.1f}").format("{:d}", subset=['N']), use_container_width=True)
+    
+    st.markdown("#### Phân bố xếp loại")
+    col1, col2 = st.columns([1, 2])
+    with col1:
+        dist = calibration.distribution(df['rating'])
+        st.dataframe(dist.style.format({'share': "{:.0%}"}), use_container_width=True)
+    with col2:
+        st.bar_chart(calibration.distribution(df['rating'], by=df['department']).T)
+    
+    gaps = calibration.score_gaps(df)
+    st.markdown("#### Chênh lệch điểm quản lý - nhân viên")
+    if gaps.empty:
+        st.caption("Chưa có đánh giá nào được quản lý chấm điểm.")
+    else:
+        st.dataframe(gaps.style.format("{:.1f}", subset=['mean', 'median', 'min', 'max']),
+                     use_container_width=True)
+    
+    # Forced-distribution simulation
+    st.markdown("#### Mô phỏng phân phối bắt buộc")
+    curve_cols = st.columns(len(RATINGS))
+    curve = {}
+    for col, rating in zip(curve_cols, RATINGS):
+        with col:
+            curve[rating] = st.number_input(
+                f"{rating} (%)", min_value=0, max_value=100,
+                value=int(calibration.DEFAULT_CURVE[rating] * 100), step=5,
+                key=f"calib_curve_{key}_{rating}"
+            ) / 100
+    if abs(sum(curve.values()) - 1) > 1e-9:
+        st.warning(f"Tổng tỷ lệ đang là {sum(curve.values()):.0%}, sẽ được chuẩn hóa về 100%.")
+    per_dept = st.checkbox("Áp dụng riêng cho từng phòng ban", key=f"calib_per_dept_{key}")
+    
+    simulated = calibration.simulate(df, curve, by='department' if per_dept else None)
+    compare = pd.DataFrame({
+        'Hiện tại': calibration.distribution(simulated['rating'])['count'],
+        'Mô phỏng': calibration.distribution(simulated['forced_rating'])['count'],
+    })
+    st.dataframe(compare.T, use_container_width=True)
+    
+    changed = simulated[simulated['rating'] != simulated['forced_rating']]
+    st.caption(f"{len(changed)}/{len(simulated)} nhân viên thay đổi xếp loại")
+    if not changed.empty:
+        st.dataframe(
+            changed[['code', 'fullname', 'department', 'score', 'rating', 'forced_rating']]
+            .sort_values('score', ascending=False),
+            use_container_width=True, hide_index=True
+        )
+
+def catalogue_template():
+    """Deferred catalogue workbook for st.download_button"""
+    def build():
+        import catalogue
+        template = io.BytesIO()
+        conn = get_db_connection()
+        try:
+            catalogue.export_workbook(conn, template)
+        finally:
+            conn.close()
+        return template.getvalue()
+    return build
+
+def catalogue_tab():
+    """Import KRAs and competencies from an Excel workbook, with a dry-run diff"""
+    import pandas as pd
+    import catalogue
+    st.markdown("### 📚 Nhập danh mục KRA và năng lực từ Excel")
+    st.caption("Mỗi phòng ban một sheet (ô 'Phòng ban' trên dòng tiêu đề, nếu không có thì lấy tên sheet), cột: Nhóm | KRA | Mô tả | Trọng số | Tổng nhóm (tùy chọn). "
+               f"Sheet '{catalogue.COMPETENCY_SHEET}': Nhóm | Năng lực | Mô tả | Mức độ quan trọng | Level 1..5.")
+    
+    # Built on click, not on every rerun of the admin page
+    st.download_button(
+        label="⬇️ Tải danh mục hiện tại (mẫu)",
+        data=catalogue_template(),
+        file_name=f"EPR_Catalogue_{datetime.now().strftime('%Y%m%d')}.xlsx",
+        mime="application/vnd.openxmlformats-officedocument.spreadsheetml.sheet"
+    )
+    
+    uploaded = st.file_uploader("Chọn file danh mục (.xlsx)", type=['xlsx'], key='catalogue_upload')
+    if uploaded is None:
+        return
+    
+    criteria, competencies, errors = catalogue.read_workbook(io.BytesIO(uploaded.getvalue()))
+    conn = get_db_connection()
+    if not errors:
+        # Department totals count the KRAs the file leaves out
+        errors = catalogue.total_errors(conn, criteria)
+    if errors:
+        conn.close()
+        st.error(f"File có {len(errors)} lỗi, chưa thể nhập:")
+        for error in errors:
+            st.markdown(f"- {error}")
+        return
+    
+    diff = catalogue.diff_catalogue(conn, criteria, competencies)
+    conn.close()
+    
+    col1, col2, col3 = st.columns(3)
+    with col1:
+        st.metric("KRA trong file", len(criteria))
+    with col2:
+        st.metric("Năng lực trong file", len(competencies))
+    with col3:
+        st.metric("Thay đổi", sum(1 for change in diff if change['Thay đổi'] in ('Thêm mới', 'Cập nhật')))
+    
+    if not diff:
+        st.success("Danh mục trong file trùng với dữ liệu hiện tại.")
+        return
+    st.dataframe(pd.DataFrame(diff), use_container_width=True, hide_index=True)
+    
+    if st.button("✅ Áp dụng thay đổi", key='catalogue_apply'):
+        try:
+            written = catalogue.apply_catalogue(criteria, competencies, errors)
+            st.success(f"Đã cập nhật {written[0]} KRA và {written[1]} năng lực.")
+        except Exception as e:
+            st.error(f"Lỗi khi nhập danh mục: {str(e)}")
+
+def search_tab():
+    """Ranked full-text search over evaluation comments and evidence"""
+    import calibration
+    st.markdown("### 🔎 Tìm kiếm trong nhận xét và minh chứng")
+    conn = get_db_connection()
+    if storage.get_storage().dialect != 'sqlite' or not search.available(conn):
+        conn.close()
+        st.info("Tìm kiếm toàn văn cần SQLite có FTS5.")
+        return
+    
+    col1, col2 = st.columns([3, 1])
+    with col1:
+        query = st.text_input("Từ khóa (không cần gõ dấu)", key='search_query',
+                              placeholder="ví dụ: du an, khach hang, dao tao")
+    with col2:
+        years = calibration.available_years(conn)
+        year = st.selectbox("Năm", ['Tất cả'] + years, key='search_year')
+    if not query.strip():
+        conn.close()
+        return
+    
+    page = st.session_state.get('search_page', 1)
+    if st.session_state.get('search_key') != (query, year):
+        # New search: back to the first page
+        st.session_state.search_key = (query, year)
+        page = 1
+    hits, total = search.search(conn, query, page=page, year=None if year == 'Tất cả' else year)
+    conn.close()
+    
+    if not total:
+        st.info("Không tìm thấy kết quả.")
+        return
+    pages = (total + search.PAGE_SIZE - 1) // search.PAGE_SIZE
+    page = min(page, pages)
+    st.caption(f"{total} kết quả, sắp xếp theo mức độ liên quan – trang {page}/{pages}")
+    
+    for hit in hits:
+        who = f"{hit['fullname']} ({hit['code']}) – {hit['department']}" if hit['fullname'] else f"Đánh giá #{hit['evaluation_id']}"
+        st.markdown(f"**{who}** · năm {hit['year']} · {hit['field']}")
+        st.markdown(f"> {hit['excerpt']}")
+    
+    col1, col2, col3 = st.columns([1, 2, 1])
+    with col1:
+        if st.button("⬅️ Trước", disabled=page <= 1, key='search_prev'):
+            st.session_state.search_page = page - 1
+            st.rerun()
+    with col3:
+        if st.button("Sau ➡️", disabled=page >= pages, key='search_next'):
+            st.session_state.search_page = page + 1
+            st.rerun()
+    st.session_state.search_page = page
+
+@st.cache_resource
+def get_tracker(year):
+    """Submission tracker shared by all sessions of this process"""
+    return tracker.Tracker(year)
+
+@st.fragment(run_every="15s")
+def progress_counts(year):
+    """Completion counts, refreshed in place from the evaluations written since the last run"""
+    conn = get_db_connection()
+    counts = get_tracker(year).refresh(conn)
+    conn.close()
+    total = sum(counts.values())
+    cols = st.columns(4)
+    cols[0].metric("Cần tự đánh giá", total)
+    for col, state in zip(cols[1:], tracker.STATE_LABELS):
+        col.metric(tracker.STATE_LABELS[state], counts[state])
+    if total:
+        st.progress(counts[tracker.REVIEWED] / total,
+                    text=f"Hoàn tất {counts[tracker.REVIEWED] / total * 100:.0f}%")
+
+def progress_tab():
+    """Who has not submitted, and who is waiting for a manager review"""
+    import pandas as pd
+    st.markdown(f"### ✅ Tiến độ đánh giá năm {REVIEW_YEAR}")
+    progress_counts(REVIEW_YEAR)
+    
+    conn = get_db_connection()
+    rows = tracker.outstanding(conn, REVIEW_YEAR)
+    conn.close()
+    if not rows:
+        st.success("Tất cả nhân viên đã hoàn tất đánh giá.")
+        return
+    
+    group_by = st.radio("Nhóm theo", ["Phòng ban", "Quản lý trực tiếp"], horizontal=True, key='progress_group')
+    key = 'department' if group_by == "Phòng ban" else 'report_to'
+    groups = tracker.group_outstanding(rows, key)
+    summary = pd.DataFrame([
+        {group_by: name or '(không có)',
+         **{tracker.STATE_LABELS[state]: len(states.get(state, [])) for state in (tracker.NOT_SUBMITTED, tracker.AWAITING_REVIEW)}}
+        for name, states in groups.items()
+    ])
+    st.dataframe(summary, use_container_width=True, hide_index=True)
+    
+    for name, states in groups.items():
+        with st.expander(f"{name or '(không có)'} – {sum(len(users) for users in states.values())} người"):
+            for state, users in states.items():
+                st.markdown(f"**{tracker.STATE_LABELS[state]}:** " +
+                            ", ".join(f"{user['fullname']} ({user['code']})" for user in users))
+    
+    st.markdown("---")
+    if st.button("📧 Gửi email nhắc nhở", key='send_reminders'):
+        with st.spinner("Đang gửi email..."):
+            try:
+                report = tracker.remind(REVIEW_YEAR)
+            except Exception as e:
+                st.error(f"Lỗi khi gửi email: {str(e)}")
+            else:
+                st.success(f"Đã gửi {report['sent']} email ({report['batches']} đợt).")
+                if report['failed']:
+                    st.warning(f"{len(report['failed'])} email lỗi: " +
+                               ", ".join(f"{to} ({error})" for to, error in report['failed'][:10]))
+                if report['skipped']:
+                    st.info(f"{len(report['skipped'])} người chưa có email: " + ", ".join(report['skipped']))
+
+def trends_tab():
+    """Cross-year trends read from the precomputed rollup tables"""
+    import pandas as pd
+    st.markdown("### Xu hướng qua các năm")
+    
+    if storage.get_storage().dialect != 'sqlite':
+        st.info("Xu hướng theo năm cần bảng tổng hợp của SQLite, chưa hỗ trợ trên PostgreSQL.")
+        return
+    
+    conn = get_db_connection()
+    years = analytics.available_years(conn)
+    if not years:
+        conn.close()
+        st.info("Chưa có dữ liệu đánh giá.")
+        return
+    
+    col1, col2 = st.columns(2)
+    with col1:
+        dimension = st.selectbox(
+            "Phạm vi",
+            ['company', 'department', 'manager'],
+            format_func={'company': 'Toàn công ty', 'department': 'Phòng ban',
+                         'manager': 'Quản lý'}.get,
+            key="trend_dimension"
+        )
+    dim_key = ''
+    if dimension != 'company':
+        with col2:
+            dim_key = st.selectbox("Chọn", analytics.dimension_keys(conn, dimension), key="trend_key")
+    
+    # Rating distribution over years
+    st.markdown("#### Phân bố xếp loại theo năm")
+    dist = pd.DataFrame(analytics.rating_distribution(conn, dimension, dim_key or ''))
+    if not dist.empty:
+        pivot = dist.pivot_table(index='year', columns='rating', values='evaluations',
+                                 aggfunc='sum', fill_value=0)
+        pivot = pivot.reindex(columns=[r for r in RATINGS if r in pivot.columns])
+        pivot.index = pivot.index.astype(str)
+        st.bar_chart(pivot)
+    
+    # Average score per department/manager
+    if dimension != 'company':
+        st.markdown("#### Điểm trung bình theo năm")
+        avg = pd.DataFrame(analytics.average_score_trend(conn, dimension))
+        if not avg.empty:
+            avg_pivot = avg.pivot_table(index='year', columns='dim_key', values='avg_score')
+            avg_pivot.index = avg_pivot.index.astype(str)
+            st.line_chart(avg_pivot)
+    
+    # Average competency level
+    st.markdown("#### Cấp độ năng lực trung bình")
+    comp = pd.DataFrame(analytics.competency_trend(
+        conn, dim_key if dimension == 'department' else None))
+    conn.close()
+    if not comp.empty:
+        comp_pivot = comp.pivot_table(index='competency', columns='year', values='avg_level')
+        comp_pivot.columns = comp_pivot.columns.astype(str)
+        st.dataframe(comp_pivot.style.format("{:.2f}"), use_container_width=True)
+        if len(years) > 1:
+            st.line_chart(comp.pivot_table(index='year', columns='competency', values='avg_level'))
 
 # Main application logic
+def current_page():
+    """Page namespace of this run (see session_memory.PAGE_NAMESPACES)"""
+    if not st.session_state.logged_in:
+        return 'login'
+    if st.session_state.user['role_type'] == 'admin':
+        return 'admin'
+    return 'manager' if st.session_state.user.get('is_manager', 0) == 1 else 'employee'
+
 def main():
     """Main application"""
-    if not st.session_state.logged_in:
+    # Other pages' state is dropped when the session switches page
+    page = current_page()
+    session_memory.enter_page(st.session_state, page)
+    if page == 'login':
         login_page()
     else:
         # Sidebar
@@ -1044,20 +1601,38 @@ def main():
             st.markdown("---")
             
             if st.button("🚪 Đăng xuất", use_container_width=True):
+                sessions.revoke(st.session_state.get('session_token'))
+                # Nothing from the previous user stays in this browser session
+                session_memory.clear(st.session_state)
                 st.session_state.logged_in = False
                 st.session_state.user = None
+                st.session_state.session_token = None
+                write_session_cookie(None)
                 st.rerun()
         
         # Route to appropriate dashboard
-        role = st.session_state.user['role_type']
-        is_manager = st.session_state.user.get('is_manager', 0)
+        if page == 'admin':
+            dashboard = admin_dashboard
+        elif page == 'manager':
+            dashboard = manager_dashboard
+        else:
+            dashboard = employee_dashboard
         
-        if role == 'admin':
-            admin_dashboard()
-        elif is_manager == 1:
-            manager_dashboard()
+        # ?profile=1 in an admin's URL, or armed by an admin for this user; other
+        # users cannot switch profiling on (and fill the profile directory) themselves
+        username = st.session_state.user['username']
+        mode = None
+        if st.session_state.user['role_type'] == 'admin':
+            mode = profiling.requested_mode(st.query_params.get('profile'))
+        mode = mode or profiling.take_armed(username)
+        if mode:
+            path, seconds = profiling.profile_call(dashboard, page, username, mode)
+            st.caption(f"🔬 Đã ghi profile ({seconds * 1000:.0f} ms): {os.path.basename(path)}")
         else:
-            employee_dashboard()
+            dashboard()
+    
+    ctx = get_script_run_ctx()
+    session_memory.govern(st.session_state, ctx.session_id if ctx else 'local')
 
 if __name__ == "__main__":
     main()
@@ -0,0 +1,230 @@
+# -*- coding: utf-8 -*-
+"""
+Archive tier for closed review years of EPR System
+
+A closed year's evaluations, evaluation_details and competency_evaluations
+are moved out of epr_system.db into archive/epr_<year>.db, so the live
+database and its indexes only hold the open year(s). History views ATTACH the
+archive files read-only on demand and read the live and archived rows
+together through history_tables(). Trend reports keep working without the
+archives: the archived year's rollups are rebuilt from the archive file when
+it is moved out.
+
+Archived comments are not in the full-text search index.
+
+Usage:
+    python archive.py list
+    python archive.py archive <year>
+    python archive.py restore <year>
+"""
+import os
+import re
+import sys
+from pathlib import Path
+
+import analytics
+import database
+import storage
+from scoring import REVIEW_YEAR
+
+ARCHIVE_DIR = os.environ.get('EPR_ARCHIVE_DIR', 'archive')
+
+# Parents before children; deletes run in reverse
+TABLES = ('evaluations', 'evaluation_details', 'competency_evaluations')
+ARCHIVE_INDEXES = [
+    "CREATE INDEX IF NOT EXISTS {schema}.ix_evaluations_user ON evaluations (user_id)",
+    "CREATE INDEX IF NOT EXISTS {schema}.ix_evaluation_details_evaluation ON evaluation_details (evaluation_id)",
+    "CREATE INDEX IF NOT EXISTS {schema}.ix_competency_evaluations_evaluation "
+    "ON competency_evaluations (evaluation_id)",
+]
+# Rows of a year, per table
+YEAR_FILTERS = {
+    'evaluations': "year = ?",
+    'evaluation_details': "evaluation_id IN (SELECT id FROM {schema}.evaluations WHERE year = ?)",
+    'competency_evaluations': "evaluation_id IN (SELECT id FROM {schema}.evaluations WHERE year = ?)",
+}
+
+
+class ArchiveError(Exception):
+    """Year cannot be archived or restored"""
+
+
+def archive_path(year):
+    return os.path.join(ARCHIVE_DIR, f"epr_{year}.db")
+
+
+def archived_years():
+    """Years with an archive file"""
+    if not os.path.isdir(ARCHIVE_DIR):
+        return []
+    years = [re.fullmatch(r"epr_(\d{4})\.db", name) for name in os.listdir(ARCHIVE_DIR)]
+    return sorted(int(match.group(1)) for match in years if match)
+
+
+def schema_name(year):
+    return f"archive_{year}"
+
+
+def _read_only_uri(year):
+    return Path(archive_path(year)).resolve().as_uri() + "?mode=ro"
+
+
+def _columns(conn, schema, table):
+    return [row[1] for row in conn.execute(f"PRAGMA {schema}.table_info({table})")]
+
+
+def attach_archives(conn):
+    """ATTACH every archive file read-only (once per connection); returns their years"""
+    if storage.dialect_of(conn) != 'sqlite':
+        return []
+    attached = {row[1] for row in conn.execute("PRAGMA database_list")}
+    years = []
+    for year in archived_years():
+        if schema_name(year) not in attached:
+            conn.execute(f"ATTACH DATABASE ? AS {schema_name(year)}", (_read_only_uri(year),))
+        years.append(year)
+    return years
+
+
+def history_tables(conn):
+    """FROM-clause source per table covering live and archived rows, with an archived flag"""
+    years = attach_archives(conn)
+    if not years:
+        return {table: table for table in TABLES}
+    sources = {}
+    for table in TABLES:
+        columns = _columns(conn, 'main', table)
+        parts = [f"SELECT {', '.join(columns)}, 0 AS archived FROM main.{table}"]
+        for year in years:
+            # Archives keep the columns of the year they were written in
+            present = set(_columns(conn, schema_name(year), table))
+            selected = ', '.join(c if c in present else f"NULL AS {c}" for c in columns)
+            parts.append(f"SELECT {selected}, 1 AS archived FROM {schema_name(year)}.{table}")
+        sources[table] = f"({' UNION ALL '.join(parts)})"
+    return sources
+
+
+def table_for(conn, table, year, archived):
+    """Table holding one evaluation's rows: the live one, or its year's archive"""
+    if not archived:
+        return table
+    attach_archives(conn)
+    return f"{schema_name(year)}.{table}"
+
+
+def archive_year(year, db_path=None):
+    """Move one closed year into its archive file; returns rows moved per table"""
+    if year >= REVIEW_YEAR:
+        raise ArchiveError(f"Năm {year} chưa đóng (năm đánh giá hiện tại: {REVIEW_YEAR})")
+    conn = database.get_connection(db_path)
+    try:
+        # Rollup tables and triggers the move rebuilds
+        database.ensure_schema(conn)
+        counts = {table: conn.execute(
+            f"SELECT COUNT(*) FROM {table} WHERE {YEAR_FILTERS[table].format(schema='main')}",
+            (year,)).fetchone()[0] for table in TABLES}
+        if not counts['evaluations']:
+            raise ArchiveError(f"Không có đánh giá nào của năm {year} trong database")
+        os.makedirs(ARCHIVE_DIR, exist_ok=True)
+
+        # 1. Copy into the archive file; re-running after a failure replaces the same ids
+        conn.execute("ATTACH DATABASE ? AS archive_new", (archive_path(year),))
+        for table in TABLES:
+            sql = conn.execute("SELECT sql FROM main.sqlite_master WHERE type = 'table' AND name = ?",
+                               (table,)).fetchone()[0]
+            conn.execute(re.sub(r'^CREATE TABLE\s+"?\w+"?',
+                                f"CREATE TABLE IF NOT EXISTS archive_new.{table}", sql))
+        for index in ARCHIVE_INDEXES:
+            conn.execute(index.format(schema='archive_new'))
+        with conn:
+            for table in TABLES:
+                present = set(_columns(conn, 'archive_new', table))
+                columns = ', '.join(c for c in _columns(conn, 'main', table) if c in present)
+                conn.execute(f'''
+                    INSERT OR REPLACE INTO archive_new.{table} ({columns})
+                    SELECT {columns} FROM main.{table} WHERE {YEAR_FILTERS[table].format(schema='main')}
+                ''', (year,))
+        for table in TABLES:
+            copied = conn.execute(
+                f"SELECT COUNT(*) FROM archive_new.{table} WHERE {YEAR_FILTERS[table].format(schema='archive_new')}",
+                (year,)).fetchone()[0]
+            if copied != counts[table]:
+                raise ArchiveError(f"{table}: chép {copied}/{counts[table]} dòng, chưa xóa khỏi database")
+        conn.execute("DETACH DATABASE archive_new")
+
+        # 2. Drop the live rows and rebuild the year's rollups from the archive, atomically.
+        # ATTACH is not allowed inside a transaction, so this bypasses the write queue.
+        schema = schema_name(year)
+        attached = {row[1] for row in conn.execute("PRAGMA database_list")}
+        if schema not in attached:
+            conn.execute(f"ATTACH DATABASE ? AS {schema}", (_read_only_uri(year),))
+        conn.execute("BEGIN IMMEDIATE")
+        try:
+            for table in reversed(TABLES):
+                conn.execute(f"DELETE FROM main.{table} WHERE {YEAR_FILTERS[table].format(schema='main')}", (year,))
+            analytics.rebuild_rollups(conn, year, schema=schema, commit=False)
+            conn.commit()
+        except Exception:
+            conn.rollback()
+            raise
+        return counts
+    finally:
+        conn.close()
+
+
+def restore_year(year, db_path=None):
+    """Move an archived year back into the live database and remove its archive file"""
+    if year not in archived_years():
+        raise ArchiveError(f"Không có file lưu trữ cho năm {year}")
+    conn = database.get_connection(db_path)
+    try:
+        database.ensure_schema(conn)
+        schema = schema_name(year)
+        conn.execute(f"ATTACH DATABASE ? AS {schema}", (_read_only_uri(year),))
+        conn.execute("BEGIN IMMEDIATE")
+        try:
+            counts = {}
+            for table in TABLES:
+                present = set(_columns(conn, schema, table))
+                columns = ', '.join(c for c in _columns(conn, 'main', table) if c in present)
+                cursor = conn.execute(f'''
+                    INSERT OR REPLACE INTO main.{table} ({columns})
+                    SELECT {columns} FROM {schema}.{table}
+                ''')
+                counts[table] = cursor.rowcount
+            # Insert triggers added the rows on top of the archive-built rollups
+            analytics.rebuild_rollups(conn, year, commit=False)
+            conn.commit()
+        except Exception:
+            conn.rollback()
+            raise
+        conn.execute(f"DETACH DATABASE {schema}")
+    finally:
+        conn.close()
+    os.remove(archive_path(year))
+    return counts
+
+
+if __name__ == "__main__":
+    command = sys.argv[1] if len(sys.argv) > 1 else ''
+    try:
+        if command == 'list':
+            for year in archived_years():
+                size = os.path.getsize(archive_path(year)) / 2 ** 20
+                print(f"{year}  {archive_path(year)}  {size:.1f} MB")
+        elif command in ('archive', 'restore') and len(sys.argv) > 2:
+            year = int(sys.argv[2])
+            if command == 'archive':
+                counts = archive_year(year)
+                print(f"Archived {year} to {archive_path(year)}: "
+                      + ", ".join(f"{n} {table}" for table, n in counts.items()))
+                print("Run VACUUM (or wait for the maintenance job) to return the freed pages to the OS")
+            else:
+                counts = restore_year(year)
+                print(f"Restored {year}: " + ", ".join(f"{n} {table}" for table, n in counts.items()))
+        else:
+            print(__doc__)
+            sys.exit(1)
+    except ArchiveError as e:
+        print(f"❌ {e}")
+        sys.exit(1)
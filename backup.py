@@ -0,0 +1,162 @@
+# -*- coding: utf-8 -*-
+"""
+Online backup and restore for EPR System
+
+Backups use the sqlite3 backup API, copying a few pages per step and releasing
+the read lock in between, so the app keeps writing while a backup runs. Each
+backup is integrity-checked, gzip-compressed and old copies are rotated.
+
+Usage:
+    python backup.py create                 # take a backup now
+    python backup.py list                   # list available backups
+    python backup.py restore <backup.db.gz> # verify and swap it in (stop the app first)
+"""
+import os
+import sys
+import gzip
+import shutil
+import sqlite3
+import threading
+import time
+from datetime import datetime
+
+import database
+
+BACKUP_DIR = os.environ.get('EPR_BACKUP_DIR', 'backups')
+BACKUP_KEEP = int(os.environ.get('EPR_BACKUP_KEEP', 30))
+# Pages copied per step and pause between steps (lets writers in)
+BACKUP_STEP_PAGES = int(os.environ.get('EPR_BACKUP_STEP_PAGES', 64))
+BACKUP_STEP_SLEEP = float(os.environ.get('EPR_BACKUP_STEP_SLEEP', 0.01))
+
+BACKUP_PREFIX = 'epr_system_'
+BACKUP_SUFFIX = '.db.gz'
+
+
+class BackupError(Exception):
+    """Backup or restore could not be completed safely"""
+
+
+def integrity_check(path):
+    """Return the PRAGMA integrity_check result lines for a database file"""
+    conn = sqlite3.connect(f"file:{path}?mode=ro", uri=True)
+    try:
+        return [row[0] for row in conn.execute("PRAGMA integrity_check")]
+    except sqlite3.DatabaseError as e:
+        return [str(e)]
+    finally:
+        conn.close()
+
+
+def create_backup(db_path=None, backup_dir=None, keep=None):
+    """Copy the live database page by page, verify, compress and rotate"""
+    db_path = db_path or database.DB_PATH
+    backup_dir = backup_dir or BACKUP_DIR
+    os.makedirs(backup_dir, exist_ok=True)
+
+    name = f"{BACKUP_PREFIX}{datetime.now().strftime('%Y%m%d_%H%M%S_%f')}"
+    raw_path = os.path.join(backup_dir, name + '.db.tmp')
+    target = os.path.join(backup_dir, name + BACKUP_SUFFIX)
+
+    src = sqlite3.connect(db_path)
+    dst = sqlite3.connect(raw_path)
+    try:
+        # The read lock is only held while a step copies its pages; if another
+        # connection writes in between, SQLite restarts the copy from scratch
+        src.backup(dst, pages=BACKUP_STEP_PAGES, sleep=BACKUP_STEP_SLEEP)
+        # A copy of a WAL database is WAL too; store it as a single file
+        dst.execute("PRAGMA journal_mode=DELETE")
+    finally:
+        dst.close()
+        src.close()
+
+    try:
+        result = integrity_check(raw_path)
+        if result != ['ok']:
+            raise BackupError(f"Backup failed integrity_check: {result[:5]}")
+        with open(raw_path, 'rb') as f_in, gzip.open(target + '.tmp', 'wb', compresslevel=6) as f_out:
+            shutil.copyfileobj(f_in, f_out, length=1024 * 1024)
+        os.replace(target + '.tmp', target)
+    finally:
+        for leftover in (raw_path, raw_path + '-wal', raw_path + '-shm', target + '.tmp'):
+            if os.path.exists(leftover):
+                os.remove(leftover)
+
+    rotate_backups(backup_dir, keep if keep is not None else BACKUP_KEEP)
+    return target
+
+
+def list_backups(backup_dir=None):
+    """Backups in backup_dir, newest first"""
+    backup_dir = backup_dir or BACKUP_DIR
+    if not os.path.isdir(backup_dir):
+        return []
+    names = [n for n in os.listdir(backup_dir)
+             if n.startswith(BACKUP_PREFIX) and n.endswith(BACKUP_SUFFIX)]
+    return [os.path.join(backup_dir, n) for n in sorted(names, reverse=True)]
+
+
+def rotate_backups(backup_dir, keep):
+    """Delete all but the newest `keep` backups"""
+    for path in list_backups(backup_dir)[keep:] if keep > 0 else []:
+        os.remove(path)
+
+
+def restore_backup(backup_path, db_path=None):
+    """Decompress a backup, verify integrity_check, then swap it in for the live file
+
+    The current database (and any -wal/-shm/-journal files belonging to it) is
+    kept next to it with a .pre-restore suffix. Stop the app before restoring.
+    """
+    db_path = db_path or database.DB_PATH
+    staging = db_path + '.restore'
+    with gzip.open(backup_path, 'rb') as f_in, open(staging, 'wb') as f_out:
+        shutil.copyfileobj(f_in, f_out, length=1024 * 1024)
+
+    result = integrity_check(staging)
+    if result != ['ok']:
+        os.remove(staging)
+        raise BackupError(f"{backup_path} failed integrity_check: {result[:5]}")
+
+    stamp = datetime.now().strftime('%Y%m%d_%H%M%S')
+    if os.path.exists(db_path):
+        shutil.copy2(db_path, f"{db_path}.pre-restore-{stamp}")
+    # Side files of the old database must never be applied to the restored one
+    for suffix in ('-wal', '-shm', '-journal'):
+        if os.path.exists(db_path + suffix):
+            os.replace(db_path + suffix, f"{db_path}{suffix}.pre-restore-{stamp}")
+    os.replace(staging, db_path)
+    return db_path
+
+
+def start_scheduler(interval_hours, db_path=None, backup_dir=None):
+    """Take a backup every interval_hours on a daemon thread"""
+    def loop():
+        while True:
+            time.sleep(interval_hours * 3600)
+            try:
+                create_backup(db_path, backup_dir)
+            except Exception as e:
+                print(f"⚠ Backup failed: {e}")
+
+    thread = threading.Thread(target=loop, name='epr-backup', daemon=True)
+    thread.start()
+    return thread
+
+
+if __name__ == "__main__":
+    command = sys.argv[1] if len(sys.argv) > 1 else ''
+    if command == 'create':
+        print(f"Backup written to {create_backup()}")
+    elif command == 'list':
+        for path in list_backups():
+            print(f"{path}  {os.path.getsize(path) / 1024:.0f} KB")
+    elif command == 'restore' and len(sys.argv) > 2:
+        try:
+            restore_backup(sys.argv[2])
+        except BackupError as e:
+            print(f"❌ {e}")
+            sys.exit(1)
+        print(f"Restored {sys.argv[2]} -> {database.DB_PATH}")
+    else:
+        print(__doc__)
+        sys.exit(1)
@@ -0,0 +1,304 @@
+# -*- coding: utf-8 -*-
+"""
+Benchmarks for EPR System
+
+Usage:
+    python benchmarks.py passwords [--logins 64] [--sessions 16]
+    python benchmarks.py writer [--threads 32] [--submissions 10]
+    python benchmarks.py startup [--runs 5]
+    python benchmarks.py memory [--sessions 500]
+    python benchmarks.py pdf [--reports 50]
+"""
+import argparse
+import json
+import os
+import sqlite3
+import statistics
+import subprocess
+import sys
+import time
+import tracemalloc
+from concurrent.futures import ThreadPoolExecutor
+
+import database
+import passwords
+import records
+import writer
+from stress import scratch_copy, remove_scratch
+
+# Cost settings compared by the password benchmark
+PASSWORD_COSTS = [
+    ('scrypt', {'n': 2 ** 12}),
+    ('scrypt', {'n': 2 ** 14}),
+    ('scrypt', {'n': 2 ** 15}),
+    ('pbkdf2_sha256', {'iterations': 100000}),
+    ('pbkdf2_sha256', {'iterations': 300000}),
+    ('pbkdf2_sha256', {'iterations': 600000}),
+]
+
+
+def bench_passwords(args):
+    """Report logins/sec at each cost setting for a burst of concurrent logins"""
+    print(f"{'hasher':<16}{'params':<22}{'ms/hash':>10}{'logins/sec':>14}")
+    for algorithm, params in PASSWORD_COSTS:
+        hasher = passwords.get_hasher(algorithm, **params)
+        stored = passwords.hash_password('benchmark-password', hasher)
+
+        start = time.perf_counter()
+        passwords.verify_password('benchmark-password', stored)
+        single_ms = (time.perf_counter() - start) * 1000
+
+        # Each "session" thread blocks on the shared hashing pool like the app does
+        def login(_):
+            return passwords.verify_password_async('benchmark-password', stored).result()
+
+        start = time.perf_counter()
+        with ThreadPoolExecutor(max_workers=args.sessions) as sessions:
+            results = list(sessions.map(login, range(args.logins)))
+        elapsed = time.perf_counter() - start
+        assert all(results)
+
+        label = ','.join(f"{k}={v}" for k, v in hasher.params.items())
+        print(f"{algorithm:<16}{label:<22}{single_ms:>10.1f}{args.logins / elapsed:>14.1f}")
+    print(f"(hash workers: {passwords.HASH_WORKERS}, concurrent sessions: {args.sessions})")
+
+
+def _submission_args(db_path):
+    """Arguments for writer.submit_evaluation shaped like a real employee form"""
+    conn = database.get_connection(db_path)
+    user_id, department = conn.execute(
+        "SELECT id, department FROM users WHERE role_type != 'admin' LIMIT 1").fetchone()
+    criteria = [row[0] for row in conn.execute(
+        "SELECT id FROM evaluation_criteria WHERE department = ?", (department,))]
+    competencies = [row[0] for row in conn.execute("SELECT id FROM competencies")]
+    conn.close()
+    scores = {cid: 100.0 for cid in criteria}
+    levels = {cid: 3 for cid in competencies}
+    return (user_id, 1999, 100.0, 'benchmark', 'benchmark',
+            scores, {cid: 'evidence' for cid in criteria},
+            levels, {cid: 'example' for cid in competencies})
+
+
+def bench_writer(args):
+    """Concurrent submissions: one connection per submit vs the single-writer queue"""
+    total = args.threads * args.submissions
+    print(f"{'mode':<10}{'writes/sec':>12}{'lock errors':>14}{'commits':>10}")
+    for mode in ('direct', 'queue'):
+        path = scratch_copy(args.db)
+        submission = _submission_args(path)
+        errors = []
+        queue_writer = writer.WriteQueue(path) if mode == 'queue' else None
+
+        def worker(_):
+            for _ in range(args.submissions):
+                try:
+                    if queue_writer:
+                        queue_writer.run(writer.submit_evaluation, *submission)
+                    else:
+                        # What the app did before: a fresh connection per submission
+                        conn = sqlite3.connect(path, timeout=args.timeout)
+                        writer.submit_evaluation(conn, *submission)
+                        conn.commit()
+                        conn.close()
+                except sqlite3.OperationalError as e:
+                    errors.append(str(e))
+
+        start = time.perf_counter()
+        with ThreadPoolExecutor(max_workers=args.threads) as pool:
+            list(pool.map(worker, range(args.threads)))
+        elapsed = time.perf_counter() - start
+        commits = '-'
+        if queue_writer:
+            queue_writer.close()
+            commits = queue_writer.stats['commits']
+        lock_errors = sum(1 for e in errors if 'locked' in e)
+        print(f"{mode:<10}{(total - len(errors)) / elapsed:>12.1f}{lock_errors:>14}{commits:>10}")
+        remove_scratch(path)
+    print(f"({args.threads} threads x {args.submissions} submissions)")
+
+
+# Heavy modules whose loading the startup benchmark reports
+HEAVY_MODULES = ('pandas', 'numpy', 'pyarrow', 'openpyxl', 'reportlab')
+
+# Runs in a fresh interpreter: time from process start to the first full render
+STARTUP_PROBE = '''
+import json, os, sqlite3, sys, time
+start = time.perf_counter()
+username, mode, app_path = sys.argv[1:4]
+if mode == 'eager':
+    import pandas, pdf_generator  # what app.py imported at the top before
+from streamlit.testing.v1 import AppTest
+at = AppTest.from_file(app_path, default_timeout=120)
+if username:
+    conn = sqlite3.connect(os.environ['EPR_DB_PATH'])
+    conn.row_factory = sqlite3.Row
+    at.session_state.logged_in = True
+    at.session_state.user = dict(conn.execute(
+        "SELECT * FROM users WHERE username = ?", (username,)).fetchone())
+at.run()
+print(json.dumps({'seconds': time.perf_counter() - start, 'errors': len(at.exception),
+                  'loaded': [m for m in %r if m in sys.modules]}))
+''' % (HEAVY_MODULES,)
+
+
+def bench_startup(args):
+    """Time-to-first-render of a cold process, with lazy imports vs importing pandas/ReportLab up front"""
+    here = os.path.dirname(os.path.abspath(__file__))
+    path = scratch_copy(args.db)
+    conn = database.get_connection(path)
+    employee = conn.execute(
+        "SELECT username FROM users WHERE role_type != 'admin' AND COALESCE(is_manager, 0) = 0 LIMIT 1").fetchone()
+    admin = conn.execute("SELECT username FROM users WHERE role_type = 'admin' LIMIT 1").fetchone()
+    conn.close()
+    views = [('login', '')]
+    views += [('employee', employee[0])] if employee else []
+    views += [('admin', admin[0])] if admin else []
+
+    env = dict(os.environ, EPR_DB_PATH=path)
+    print(f"{'view':<10}{'imports':<8}{'ms (median)':>13}  loaded")
+    try:
+        for view, username in views:
+            for mode in ('lazy', 'eager'):
+                timings, loaded = [], []
+                for _ in range(args.runs):
+                    result = subprocess.run(
+                        [sys.executable, '-c', STARTUP_PROBE, username, mode, os.path.join(here, 'app.py')],
+                        cwd=here, env=env, capture_output=True, text=True, check=True)
+                    report = json.loads(result.stdout.strip().splitlines()[-1])
+                    if report['errors']:
+                        raise SystemExit(f"{view} page raised an exception during render")
+                    timings.append(report['seconds'] * 1000)
+                    loaded = report['loaded']
+                print(f"{view:<10}{mode:<8}{statistics.median(timings):>13.0f}  {', '.join(loaded) or '-'}")
+    finally:
+        remove_scratch(path)
+    print(f"({args.runs} cold processes per row)")
+
+
+# Per-session rows: (record type, query) as the employee pages load them
+SESSION_QUERIES = [
+    (records.User, "SELECT * FROM users WHERE id = ?", 'id'),
+    (records.Criterion, "SELECT * FROM evaluation_criteria WHERE department = ?", 'department'),
+    (records.Competency, "SELECT * FROM competencies", None),
+    (records.Evaluation, "SELECT * FROM evaluations WHERE user_id = ?", 'id'),
+]
+
+
+def _session_state(conn, user, as_records):
+    """Rows one logged-in session holds, as dicts or as records"""
+    state = []
+    for record_type, query, param in SESSION_QUERIES:
+        cursor = conn.execute(query, (user[param],) if param else ())
+        if as_records:
+            state.append(records.fetch_records(cursor, record_type))
+        else:
+            state.append([dict(row) for row in cursor.fetchall()])
+    return state
+
+
+def bench_memory(args):
+    """Resident size of per-session rows for many concurrent sessions: dict rows vs records"""
+    conn = database.get_connection(args.db)
+    users = [dict(row) for row in conn.execute("SELECT id, department FROM users WHERE role_type != 'admin'")]
+    if not users:
+        raise SystemExit("No users to simulate")
+    print(f"{'rows as':<10}{'total MB':>10}{'KB/session':>12}{'ms to load':>12}")
+    for label, as_records in (('dicts', False), ('records', True)):
+        tracemalloc.start()
+        start = time.perf_counter()
+        sessions = [_session_state(conn, users[i % len(users)], as_records) for i in range(args.sessions)]
+        elapsed = time.perf_counter() - start
+        size = tracemalloc.get_traced_memory()[0]
+        tracemalloc.stop()
+        print(f"{label:<10}{size / 2 ** 20:>10.2f}{size / 1024 / args.sessions:>12.1f}{elapsed * 1000:>12.0f}")
+        del sessions
+    conn.close()
+    print(f"({args.sessions} sessions over {len(users)} users)")
+
+
+def _sample_reports(conn, count):
+    """Synthetic reports over a real department's KRAs and the competency catalogue"""
+    department = conn.execute("SELECT department FROM evaluation_criteria LIMIT 1").fetchone()
+    if not department:
+        raise SystemExit("No criteria to build reports from")
+    criteria = conn.execute("SELECT kra_name, weight FROM evaluation_criteria WHERE department = ?",
+                            (department[0],)).fetchall()
+    competencies = conn.execute("SELECT name, importance_level FROM competencies").fetchall()
+    comment = "Hoàn thành đúng hạn, phối hợp tốt với các bộ phận liên quan trong quý."
+    for i in range(count):
+        user = {'fullname': f"Nguyễn Văn Thử {i}", 'code': f"T{i:04d}", 'department': department[0],
+                'role_type': 'Nhân viên', 'report_to': 'Trưởng phòng'}
+        kpi = [{'name': c['kra_name'], 'weight': c['weight'], 'result': 100, 'score': c['weight'] * 100,
+                'evidence': comment} for c in criteria]
+        comp = [{'name': c['name'], 'level': 3, 'percentage': 100, 'weight': c['importance_level'],
+                 'score': 100 * c['importance_level'], 'evidence': comment} for c in competencies]
+        yield user, {'kpi_items': kpi, 'kpi_total': 100, 'comp_items': comp, 'comp_total': 100,
+                     'final_score': 100, 'rating': 'A', 'comments': comment}
+
+
+def bench_pdf(args):
+    """Bytes per document and render time of the current PDF output vs the archival profile"""
+    import pdf_generator
+    conn = database.get_connection(args.db)
+    reports = list(_sample_reports(conn, args.reports))
+    conn.close()
+    font = pdf_generator.get_fonts()[0]
+    print(f"{'profile':<16}{'output':<8}{'KB/doc':>9}{'ms/doc':>9}")
+    for profile, pdfa in (('default', False), ('archival', False), ('archival', True)):
+        label = profile + (' pdfa' if pdfa else '')
+        try:
+            start = time.perf_counter()
+            size = sum(len(pdf_generator.generate_evaluation_pdf(user, data, profile, pdfa).getvalue())
+                       for user, data in reports)
+            single = time.perf_counter() - start
+            start = time.perf_counter()
+            batch_size = len(pdf_generator.generate_department_book(
+                "Benchmark", None, iter(reports), profile=profile, pdfa=pdfa).getvalue())
+            batch = time.perf_counter() - start
+        except pdf_generator.PdfProfileError as e:
+            print(f"{label:<16}skipped: {e}")
+            continue
+        for output, total, seconds in (('files', size, single), ('batch', batch_size, batch)):
+            print(f"{label:<16}{output:<8}{total / 1024 / len(reports):>9.1f}{seconds * 1000 / len(reports):>9.1f}")
+    print(f"({len(reports)} reports; font {font}"
+          + (", not embedded: set EPR_PDF_FONT_DIR to a folder with arial.ttf)" if font == 'Helvetica' else ")"))
+
+
+def main():
+    parser = argparse.ArgumentParser(description="EPR System benchmarks")
+    sub = parser.add_subparsers(dest='benchmark', required=True)
+
+    p = sub.add_parser('passwords', help="logins/sec at each password hashing cost")
+    p.add_argument('--logins', type=int, default=64)
+    p.add_argument('--sessions', type=int, default=16)
+    p.set_defaults(func=bench_passwords)
+
+    p = sub.add_parser('writer', help="concurrent submissions with and without the write queue")
+    p.add_argument('--db', default=database.DB_PATH)
+    p.add_argument('--threads', type=int, default=32)
+    p.add_argument('--submissions', type=int, default=10)
+    p.add_argument('--timeout', type=float, default=0.1,
+                   help="busy timeout (s) of direct connections")
+    p.set_defaults(func=bench_writer)
+
+    p = sub.add_parser('startup', help="time-to-first-render of a fresh process per role")
+    p.add_argument('--db', default=database.DB_PATH)
+    p.add_argument('--runs', type=int, default=5)
+    p.set_defaults(func=bench_startup)
+
+    p = sub.add_parser('memory', help="per-session memory of dict rows vs typed records")
+    p.add_argument('--db', default=database.DB_PATH)
+    p.add_argument('--sessions', type=int, default=500)
+    p.set_defaults(func=bench_memory)
+
+    p = sub.add_parser('pdf', help="bytes per document and render time of the PDF profiles")
+    p.add_argument('--db', default=database.DB_PATH)
+    p.add_argument('--reports', type=int, default=50)
+    p.set_defaults(func=bench_pdf)
+
+    args = parser.parse_args()
+    args.func(args)
+
+
+if __name__ == "__main__":
+    main()
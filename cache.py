@@ -0,0 +1,138 @@
+# -*- coding: utf-8 -*-
+"""
+Cross-process cache coherency for EPR System
+
+Several Streamlit processes may share one epr_system.db, so an in-process
+cache must notice writes made by the others. Triggers bump a per-namespace
+counter in cache_versions on every change to the underlying tables, and
+lookups first poll PRAGMA data_version on a long-lived connection: it only
+changes when some other connection has committed, so the common case costs
+one cheap PRAGMA. When it moves, cache_versions is read and only the
+namespaces whose counter changed are dropped.
+
+    criteria     evaluation_criteria
+    competencies competencies
+    users        users
+    evaluations  evaluations, evaluation_details, competency_evaluations
+"""
+import functools
+import sqlite3
+import threading
+
+import database
+import storage
+
+NAMESPACE_TABLES = {
+    'criteria': ('evaluation_criteria',),
+    'competencies': ('competencies',),
+    'users': ('users',),
+    'evaluations': ('evaluations', 'evaluation_details', 'competency_evaluations'),
+}
+
+
+def ensure_cache_versions(conn):
+    """Create the version table and its bump triggers (idempotent)"""
+    cursor = conn.cursor()
+    cursor.execute('''
+    CREATE TABLE IF NOT EXISTS cache_versions (
+        namespace TEXT PRIMARY KEY,
+        version INTEGER NOT NULL DEFAULT 0
+    ) WITHOUT ROWID
+    ''')
+    cursor.executemany(
+        "INSERT OR IGNORE INTO cache_versions (namespace, version) VALUES (?, 0)",
+        [(namespace,) for namespace in NAMESPACE_TABLES]
+    )
+    for namespace, tables in NAMESPACE_TABLES.items():
+        for table in tables:
+            for event in ('INSERT', 'UPDATE', 'DELETE'):
+                cursor.execute(f'''
+                CREATE TRIGGER IF NOT EXISTS trg_cache_{table}_{event.lower()}
+                AFTER {event} ON {table} BEGIN
+                    UPDATE cache_versions SET version = version + 1 WHERE namespace = '{namespace}';
+                END
+                ''')
+    conn.commit()
+
+
+class CoherentCache:
+    """Namespaced in-process cache invalidated by other connections' commits"""
+
+    def __init__(self, db_path=None):
+        self.db_path = db_path or database.DB_PATH
+        self._lock = threading.Lock()
+        self._conn = None
+        self._data_version = None
+        self._versions = {}
+        self._entries = {namespace: {} for namespace in NAMESPACE_TABLES}
+        self.stats = {'hits': 0, 'misses': 0, 'invalidations': 0}
+
+    def _poll(self):
+        """Drop namespaces changed since the last poll (caller holds the lock)"""
+        if self._conn is None:
+            self._conn = sqlite3.connect(self.db_path, check_same_thread=False,
+                                         timeout=database.BUSY_TIMEOUT)
+            self._conn.isolation_level = None
+        data_version = self._conn.execute("PRAGMA data_version").fetchone()[0]
+        if data_version == self._data_version:
+            return
+        self._data_version = data_version
+        versions = dict(self._conn.execute("SELECT namespace, version FROM cache_versions"))
+        for namespace, version in versions.items():
+            if self._versions.get(namespace) != version and self._entries.get(namespace):
+                self._entries[namespace].clear()
+                self.stats['invalidations'] += 1
+        self._versions = versions
+
+    def get(self, namespace, key, loader):
+        """Cached loader() for key in namespace; the value is shared, do not mutate it"""
+        with self._lock:
+            self._poll()
+            entries = self._entries[namespace]
+            if key in entries:
+                self.stats['hits'] += 1
+                return entries[key]
+            version = self._versions.get(namespace)
+        value = loader()
+        with self._lock:
+            self.stats['misses'] += 1
+            # Only keep it if nothing in the namespace changed while it was loading
+            self._poll()
+            if self._versions.get(namespace) == version:
+                self._entries[namespace][key] = value
+        return value
+
+    def clear(self, namespace=None):
+        """Drop one namespace, or everything"""
+        with self._lock:
+            for name in ([namespace] if namespace else list(self._entries)):
+                self._entries[name].clear()
+
+
+_cache = None
+_cache_lock = threading.Lock()
+
+
+def get_cache():
+    """Process-wide cache, or None when the backend has no data_version (PostgreSQL)"""
+    global _cache
+    with _cache_lock:
+        backend = storage.get_storage()
+        if backend.dialect != 'sqlite':
+            return None
+        if _cache is None:
+            _cache = CoherentCache(backend.path)
+        return _cache
+
+
+def cached(namespace):
+    """Cache a function's results in namespace, keyed by its arguments"""
+    def decorator(fn):
+        @functools.wraps(fn)
+        def wrapper(*args):
+            cache = get_cache()
+            if cache is None:
+                return fn(*args)
+            return cache.get(namespace, (fn.__name__,) + args, lambda: fn(*args))
+        return wrapper
+    return decorator
@@ -0,0 +1,148 @@
+# -*- coding: utf-8 -*-
+"""
+Rating calibration for EPR System
+
+Scores are loaded once as columnar arrays and every statistic (percentiles,
+rating distribution, employee-vs-manager gaps, forced-distribution simulation)
+is computed with vectorized NumPy/pandas operations, so recalculating for the
+whole company on each slider change stays instant.
+"""
+import numpy as np
+import pandas as pd
+
+import storage
+from scoring import RATING_THRESHOLDS, RATINGS
+
+QUANTILES = [0.1, 0.25, 0.5, 0.75, 0.9]
+
+# Default forced-distribution curve (share of employees per rating, best first)
+DEFAULT_CURVE = {'A++': 0.05, 'A+': 0.15, 'A': 0.50, 'B': 0.20, 'C': 0.10}
+
+# Ascending bounds for np.digitize: [80, 100, 120, 135] -> C, B, A, A+, A++
+_BOUNDS = np.array([threshold for threshold, _ in reversed(RATING_THRESHOLDS)], dtype=float)
+_BANDS = np.array(list(reversed(RATINGS)), dtype=object)
+
+
+def available_years(conn, source='evaluations'):
+    """Years that have evaluations; source may be archive.history_tables()['evaluations']"""
+    cursor = conn.cursor()
+    cursor.execute(f"SELECT DISTINCT year FROM {source} e ORDER BY year")
+    return [row[0] for row in cursor.fetchall()]
+
+
+def load_scores(conn, year, report_to=None, source='evaluations'):
+    """Load one row per evaluation as columnar arrays in a single query"""
+    query = f'''
+        SELECT e.id AS evaluation_id, u.code, u.fullname,
+               COALESCE(u.department, '') AS department,
+               COALESCE(u.report_to, '') AS report_to,
+               e.employee_score, e.manager_score, e.final_score
+        FROM {source} e
+        JOIN users u ON u.id = e.user_id
+        WHERE e.year = ?
+    '''
+    params = [year]
+    if report_to is not None:
+        query += " AND u.report_to = ?"
+        params.append(report_to)
+    return _prepare(storage.read_frame(conn, query, params))
+
+
+def scores_from_snapshot(tables, year, report_to=None):
+    """Same frame as load_scores, built from a snapshot.load_snapshot() result"""
+    import snapshot
+    # Only this year's score columns leave the memory-mapped tables
+    evals = snapshot.to_frame(tables['evaluations'],
+                              ['id', 'user_id', 'employee_score', 'manager_score', 'final_score'], year=year)
+    users = snapshot.to_frame(tables['users'], ['id', 'code', 'fullname', 'department', 'report_to'])
+    df = evals.merge(users, left_on='user_id', right_on='id', suffixes=('', '_user'))
+    df['department'] = df['department'].fillna('')
+    df['report_to'] = df['report_to'].fillna('')
+    if report_to is not None:
+        df = df[df['report_to'] == report_to]
+    df = df.rename(columns={'id': 'evaluation_id'})[[
+        'evaluation_id', 'code', 'fullname', 'department', 'report_to',
+        'employee_score', 'manager_score', 'final_score']]
+    return _prepare(df.reset_index(drop=True))
+
+
+def _prepare(df):
+    """Normalise score columns and derive the effective score and rating"""
+    for col in ('employee_score', 'manager_score', 'final_score'):
+        df[col] = pd.to_numeric(df[col], errors='coerce')
+    # Reviewed evaluations use the final score, the rest the self-assessment
+    df['score'] = df['final_score'].fillna(df['employee_score']).fillna(0.0)
+    df['rating'] = rating_bands(df['score'].to_numpy())
+    return df
+
+
+def rating_bands(scores):
+    """Vectorized scoring.rating_for over an array of scores"""
+    scores = np.nan_to_num(np.asarray(scores, dtype=float), nan=0.0)
+    return _BANDS[np.digitize(scores, _BOUNDS, right=False)]
+
+
+def percentiles(df, by='department', quantiles=QUANTILES):
+    """Score percentiles per group plus a company-wide row"""
+    if df.empty:
+        return pd.DataFrame()
+    grouped = df.groupby(by)['score'].quantile(quantiles).unstack()
+    overall = df['score'].quantile(quantiles).to_frame('Toàn công ty').T
+    table = pd.concat([grouped, overall])
+    table.columns = [f"P{int(q * 100)}" for q in quantiles]
+    table['N'] = pd.concat([df.groupby(by).size(), pd.Series({'Toàn công ty': len(df)})])
+    return table
+
+
+def distribution(ratings, by=None):
+    """Count and share of each rating, optionally per group"""
+    ratings = pd.Series(ratings, name='rating')
+    if by is None:
+        counts = ratings.value_counts().reindex(RATINGS, fill_value=0)
+        return pd.DataFrame({'count': counts, 'share': counts / max(len(ratings), 1)})
+    table = pd.crosstab(pd.Series(by, name='group').to_numpy(), ratings.to_numpy())
+    return table.reindex(columns=RATINGS, fill_value=0)
+
+
+def score_gaps(df, by='department'):
+    """Manager score minus self-assessment for reviewed evaluations"""
+    reviewed = df.dropna(subset=['manager_score', 'employee_score'])
+    if reviewed.empty:
+        return pd.DataFrame()
+    gap = reviewed['manager_score'] - reviewed['employee_score']
+    return gap.groupby(reviewed[by]).agg(['count', 'mean', 'median', 'min', 'max'])
+
+
+def forced_distribution(scores, curve=None):
+    """Assign ratings by rank so each rating receives its share of the curve
+
+    Ties keep input order (stable sort); shares are normalised to sum to 1.
+    """
+    curve = curve or DEFAULT_CURVE
+    scores = np.asarray(scores, dtype=float)
+    n = len(scores)
+    result = np.empty(n, dtype=object)
+    if n == 0:
+        return result
+    shares = np.array([curve.get(rating, 0.0) for rating in RATINGS], dtype=float)
+    total = shares.sum()
+    shares = shares / total if total > 0 else np.full(len(RATINGS), 1.0 / len(RATINGS))
+    # Rank 0 = highest score; cutoffs are the cumulative head counts per rating
+    order = np.argsort(-scores, kind='stable')
+    cutoffs = np.round(np.cumsum(shares) * n).astype(int)
+    rank_bands = np.searchsorted(cutoffs, np.arange(n), side='right')
+    result[order] = np.array(RATINGS, dtype=object)[np.minimum(rank_bands, len(RATINGS) - 1)]
+    return result
+
+
+def simulate(df, curve=None, by=None):
+    """Apply a forced curve company-wide or within each group"""
+    simulated = df.copy()
+    if by is None:
+        simulated['forced_rating'] = forced_distribution(df['score'].to_numpy(), curve)
+    else:
+        simulated['forced_rating'] = None
+        for _, idx in df.groupby(by).indices.items():
+            simulated.iloc[idx, simulated.columns.get_loc('forced_rating')] = \
+                forced_distribution(df['score'].to_numpy()[idx], curve)
+    return simulated
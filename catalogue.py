@@ -0,0 +1,404 @@
+# -*- coding: utf-8 -*-
+"""
+KRA and competency catalogue import for EPR System
+
+The catalogue lives in a workbook with one sheet per department plus a
+"Năng lực" sheet for competencies. The department is the "Phòng ban" cell above
+the header row, or the sheet title when there is none (sheet titles are capped
+at 31 characters and cannot hold []:*?/\\, so exports always write the cell).
+Workbooks are streamed with openpyxl in read-only mode, validated, compared
+with the database (dry run) and then upserted in one write transaction. The
+cache_versions triggers bump the criteria/competencies namespaces, so every
+process drops its cached catalogue.
+
+Department sheet columns:  Nhóm | KRA | Mô tả | Trọng số | Tổng nhóm (optional)
+"Năng lực" sheet columns:  Nhóm | Năng lực | Mô tả | Mức độ quan trọng | Level 1 .. Level 5
+
+When "Tổng nhóm" is filled in, the weights of that category must add up to it.
+Department totals are checked against the database too, counting the KRAs a
+file leaves out (they are kept): every department must add up to
+EPR_KRA_TOTAL_WEIGHT when it is set; otherwise a department keeps its current
+total (the KPI score is weighted by it) unless "Tổng nhóm" is given for all of
+its categories.
+
+Usage:
+    python catalogue.py export catalogue.xlsx          # current catalogue as a workbook
+    python catalogue.py import catalogue.xlsx          # dry run: show the diff
+    python catalogue.py import catalogue.xlsx --apply  # upsert
+"""
+import os
+import sys
+
+from openpyxl import Workbook, load_workbook
+
+import database
+import storage
+from detailed_export import sheet_title
+import writer
+
+COMPETENCY_SHEET = 'Năng lực'
+DEPARTMENT_LABEL = 'Phòng ban'
+# Header row is searched for in the first rows of each sheet (titles may come first)
+HEADER_SCAN_ROWS = 10
+WEIGHT_TOLERANCE = 0.01
+# Required KRA weight total of every department; unset keeps each department's current total
+KRA_TOTAL_WEIGHT = float(os.environ.get('EPR_KRA_TOTAL_WEIGHT', 0)) or None
+
+CRITERIA_COLUMNS = {
+    'category': 'Nhóm',
+    'kra_name': 'KRA',
+    'description': 'Mô tả',
+    'weight': 'Trọng số',
+    'category_total': 'Tổng nhóm',
+}
+CRITERIA_REQUIRED = ('category', 'kra_name', 'weight')
+CRITERIA_KEY = ('department', 'kra_name')
+CRITERIA_FIELDS = ('description', 'weight', 'category')
+
+COMPETENCY_COLUMNS = {
+    'category': 'Nhóm',
+    'name': 'Năng lực',
+    'description': 'Mô tả',
+    'importance_level': 'Mức độ quan trọng',
+    'level_1': 'Level 1',
+    'level_2': 'Level 2',
+    'level_3': 'Level 3',
+    'level_4': 'Level 4',
+    'level_5': 'Level 5',
+}
+COMPETENCY_REQUIRED = ('name',)
+COMPETENCY_KEY = ('name',)
+COMPETENCY_FIELDS = ('description', 'importance_level', 'category',
+                     'level_1', 'level_2', 'level_3', 'level_4', 'level_5')
+
+
+class CatalogueError(Exception):
+    """Workbook failed validation"""
+
+
+def _text(value):
+    if value is None:
+        return None
+    text = str(value).strip()
+    return text or None
+
+
+def _number(value):
+    if isinstance(value, (int, float)):
+        return float(value)
+    try:
+        return float(str(value).replace(',', '.'))
+    except (TypeError, ValueError):
+        return None
+
+
+def _read_sheet(title, rows, columns, required, errors, preamble=None):
+    """Rows of one sheet as dicts keyed by field, with their Excel row numbers
+
+    Rows above the header are collected into preamble when a list is given.
+    """
+    labels = {label.lower(): field for field, label in columns.items()}
+    index = None
+    for row_number, row in enumerate(rows, start=1):
+        cells = [(_text(value) or '').lower() for value in row]
+        if index is None:
+            found = {labels[cell]: i for i, cell in enumerate(cells) if cell in labels}
+            if all(field in found for field in required):
+                index = found
+            elif row_number >= HEADER_SCAN_ROWS:
+                break
+            elif preamble is not None:
+                preamble.append(row)
+            continue
+        record = {field: row[i] if i < len(row) else None for field, i in index.items()}
+        if all(value is None or _text(value) is None for value in record.values()):
+            continue
+        yield row_number, record
+    if index is None:
+        missing = ', '.join(columns[field] for field in required)
+        errors.append(f"[{title}] không tìm thấy dòng tiêu đề (cần các cột: {missing})")
+
+
+def _sheet_department(title, preamble):
+    """Department from the "Phòng ban" cell above the header, else the sheet title"""
+    for row in preamble:
+        cells = [_text(value) for value in row]
+        if len(cells) > 1 and (cells[0] or '').lower() == DEPARTMENT_LABEL.lower() and cells[1]:
+            return cells[1]
+    return title.strip()
+
+
+def _read_criteria(title, rows, errors):
+    department = None
+    criteria = []
+    totals = {}
+    seen = set()
+    preamble = []
+    for row_number, record in _read_sheet(title, rows, CRITERIA_COLUMNS, CRITERIA_REQUIRED, errors, preamble):
+        if department is None:
+            department = _sheet_department(title, preamble)
+        where = f"[{title}] dòng {row_number}"
+        kra_name = _text(record.get('kra_name'))
+        category = _text(record.get('category'))
+        weight = _number(record.get('weight'))
+        if not kra_name or not category:
+            errors.append(f"{where}: thiếu KRA hoặc Nhóm")
+            continue
+        if weight is None or weight <= 0:
+            errors.append(f"{where}: trọng số không hợp lệ ({record.get('weight')!r})")
+            continue
+        if kra_name in seen:
+            errors.append(f"{where}: KRA trùng lặp '{kra_name}'")
+            continue
+        seen.add(kra_name)
+        total = _number(record.get('category_total'))
+        if total is not None:
+            if totals.setdefault(category, total) != total:
+                errors.append(f"{where}: Tổng nhóm của '{category}' không thống nhất")
+        criteria.append({'department': department, 'kra_name': kra_name,
+                         'description': _text(record.get('description')),
+                         'weight': weight, 'category': category, 'category_total': total})
+
+    if not criteria and not any(e.startswith(f"[{title}]") for e in errors):
+        errors.append(f"[{title}] không có KRA nào")
+    for category, total in totals.items():
+        actual = sum(c['weight'] for c in criteria if c['category'] == category)
+        if abs(actual - total) > WEIGHT_TOLERANCE:
+            errors.append(f"[{title}] nhóm '{category}': tổng trọng số {actual:g} khác Tổng nhóm {total:g}")
+    return criteria
+
+
+def _read_competencies(title, rows, errors):
+    competencies = []
+    seen = set()
+    for row_number, record in _read_sheet(title, rows, COMPETENCY_COLUMNS, COMPETENCY_REQUIRED, errors):
+        where = f"[{title}] dòng {row_number}"
+        name = _text(record.get('name'))
+        if not name:
+            errors.append(f"{where}: thiếu tên năng lực")
+            continue
+        if name in seen:
+            errors.append(f"{where}: năng lực trùng lặp '{name}'")
+            continue
+        seen.add(name)
+        importance = _number(record.get('importance_level'))
+        if record.get('importance_level') is not None and (importance is None or importance < 1):
+            errors.append(f"{where}: mức độ quan trọng không hợp lệ ({record.get('importance_level')!r})")
+            continue
+        competency = {'name': name, 'importance_level': int(importance) if importance else 2}
+        for field in ('category', 'description', 'level_1', 'level_2', 'level_3', 'level_4', 'level_5'):
+            competency[field] = _text(record.get(field))
+        competencies.append(competency)
+    return competencies
+
+
+def read_workbook(source):
+    """Stream and validate a catalogue workbook; returns (criteria, competencies, errors)"""
+    criteria, competencies, errors = [], [], []
+    workbook = load_workbook(source, read_only=True, data_only=True)
+    try:
+        for sheet in workbook.worksheets:
+            title = sheet.title.strip()
+            if title.startswith('_'):
+                continue
+            rows = sheet.iter_rows(values_only=True)
+            if title == COMPETENCY_SHEET:
+                competencies.extend(_read_competencies(title, rows, errors))
+            else:
+                criteria.extend(_read_criteria(title, rows, errors))
+    finally:
+        workbook.close()
+    return criteria, competencies, errors
+
+
+def _same(current, new):
+    if isinstance(current, (int, float)) and isinstance(new, (int, float)):
+        return abs(current - new) <= WEIGHT_TOLERANCE
+    return current == new
+
+
+def _key(row, key_fields):
+    """Natural key ignoring surrounding whitespace, so re-imports match stored rows"""
+    return tuple((row[field] or '').strip() for field in key_fields)
+
+
+def _changes(existing, incoming, key_fields, fields):
+    """Rows to insert and rows to update, with a field-level description of each update"""
+    existing = {_key(row, key_fields): row for row in existing}
+    added, changed = [], []
+    for row in incoming:
+        current = existing.get(_key(row, key_fields))
+        if current is None:
+            added.append(row)
+            continue
+        details = [f"{field}: {current[field]!r} → {row[field]!r}" for field in fields
+                   if not _same(current[field], row[field])]
+        if details:
+            # Update the stored row under its exact key
+            changed.append((dict(row, **{field: current[field] for field in key_fields}), details))
+    return added, changed
+
+
+def _plan(conn, criteria, competencies):
+    """Compare a parsed workbook with the database"""
+    cursor = conn.cursor()
+    cursor.execute("SELECT department, kra_name, description, weight, category FROM evaluation_criteria")
+    current_criteria = [dict(row) for row in cursor.fetchall()]
+    cursor.execute(f"SELECT name, {', '.join(COMPETENCY_FIELDS)} FROM competencies")
+    current_competencies = [dict(row) for row in cursor.fetchall()]
+    return (current_criteria,
+            _changes(current_criteria, criteria, CRITERIA_KEY, CRITERIA_FIELDS),
+            _changes(current_competencies, competencies, COMPETENCY_KEY, COMPETENCY_FIELDS))
+
+
+def total_errors(conn, criteria):
+    """Departments whose KRA weights would not add up once criteria are upserted"""
+    departments = sorted({_key(c, ('department',))[0] for c in criteria})
+    if not departments:
+        return []
+    cursor = conn.cursor()
+    cursor.execute(
+        "SELECT department, kra_name, category, weight FROM evaluation_criteria "
+        f"WHERE TRIM(department) IN ({', '.join('?' * len(departments))})", departments)
+    merged = {_key(row, CRITERIA_KEY): (row['category'], row['weight']) for row in cursor.fetchall()}
+    current = {}
+    for (department, _), (_, weight) in merged.items():
+        current[department] = current.get(department, 0) + weight
+    declared = {}
+    for c in criteria:
+        merged[_key(c, CRITERIA_KEY)] = (c['category'], c['weight'])
+        if c.get('category_total') is not None:
+            declared.setdefault((_key(c, ('department',))[0], c['category']), c['category_total'])
+
+    errors = []
+    for department in departments:
+        categories = {}
+        for (dept, _), (category, weight) in merged.items():
+            if dept == department:
+                categories[category] = categories.get(category, 0) + weight
+        total = sum(categories.values())
+        for category, actual in categories.items():
+            expected = declared.get((department, category))
+            if expected is not None and abs(actual - expected) > WEIGHT_TOLERANCE:
+                errors.append(f"[{department}] nhóm '{category}': tổng trọng số {actual:g} (tính cả KRA giữ nguyên) "
+                              f"khác Tổng nhóm {expected:g}")
+        if KRA_TOTAL_WEIGHT is not None:
+            if abs(total - KRA_TOTAL_WEIGHT) > WEIGHT_TOLERANCE:
+                errors.append(f"[{department}] tổng trọng số {total:g} khác {KRA_TOTAL_WEIGHT:g} (EPR_KRA_TOTAL_WEIGHT)")
+        elif (department in current and abs(total - current[department]) > WEIGHT_TOLERANCE
+              and not all((department, category) in declared for category in categories)):
+            errors.append(f"[{department}] tổng trọng số đổi từ {current[department]:g} thành {total:g}; "
+                          "điền Tổng nhóm cho mọi nhóm để xác nhận tổng mới")
+    return errors
+
+
+def diff_catalogue(conn, criteria, competencies):
+    """Dry run: what an import would change, as rows for display"""
+    current_criteria, (added, changed), (comp_added, comp_changed) = _plan(conn, criteria, competencies)
+    diff = [{'Loại': 'KRA', 'Phòng ban': c['department'], 'Tên': c['kra_name'],
+             'Thay đổi': 'Thêm mới', 'Chi tiết': f"trọng số {c['weight']:g}, {c['category']}"}
+            for c in added]
+    diff += [{'Loại': 'KRA', 'Phòng ban': c['department'], 'Tên': c['kra_name'],
+              'Thay đổi': 'Cập nhật', 'Chi tiết': '; '.join(details)} for c, details in changed]
+    # Rows missing from the workbook are kept: past evaluations still reference them
+    departments = {c['department'] for c in criteria}
+    incoming = {_key(c, CRITERIA_KEY) for c in criteria}
+    diff += [{'Loại': 'KRA', 'Phòng ban': c['department'], 'Tên': c['kra_name'],
+              'Thay đổi': 'Không có trong file (giữ nguyên)', 'Chi tiết': ''}
+             for c in current_criteria
+             if c['department'] in departments and _key(c, CRITERIA_KEY) not in incoming]
+    diff += [{'Loại': 'Năng lực', 'Phòng ban': '', 'Tên': c['name'],
+              'Thay đổi': 'Thêm mới', 'Chi tiết': c['category'] or ''} for c in comp_added]
+    diff += [{'Loại': 'Năng lực', 'Phòng ban': '', 'Tên': c['name'],
+              'Thay đổi': 'Cập nhật', 'Chi tiết': '; '.join(details)} for c, details in comp_changed]
+    return diff
+
+
+def _upsert_catalogue(conn, criteria, competencies):
+    """Write transaction: upsert on the natural keys"""
+    conn.executemany('''
+    INSERT INTO evaluation_criteria (department, kra_name, description, weight, category)
+    VALUES (?, ?, ?, ?, ?)
+    ON CONFLICT (department, kra_name) DO UPDATE SET
+        description = excluded.description, weight = excluded.weight, category = excluded.category
+    ''', [(c['department'], c['kra_name'], c['description'], c['weight'], c['category'])
+          for c in criteria])
+    conn.executemany(f'''
+    INSERT INTO competencies (name, {', '.join(COMPETENCY_FIELDS)})
+    VALUES ({', '.join('?' * (len(COMPETENCY_FIELDS) + 1))})
+    ON CONFLICT (name) DO UPDATE SET
+        {', '.join(f"{field} = excluded.{field}" for field in COMPETENCY_FIELDS)}
+    ''', [(c['name'],) + tuple(c[field] for field in COMPETENCY_FIELDS) for c in competencies])
+
+
+def apply_catalogue(criteria, competencies, errors=()):
+    """Upsert the new and changed rows in one transaction; returns (criteria, competencies) written"""
+    if errors:
+        raise CatalogueError(f"{len(errors)} lỗi trong file, không thể nhập")
+    with storage.get_storage().connection() as conn:
+        errors = total_errors(conn, criteria)
+        if errors:
+            raise CatalogueError("; ".join(errors))
+        _, (added, changed), (comp_added, comp_changed) = _plan(conn, criteria, competencies)
+    # Unchanged rows are skipped so cached catalogues only refresh when needed
+    criteria = added + [c for c, _ in changed]
+    competencies = comp_added + [c for c, _ in comp_changed]
+    if criteria or competencies:
+        writer.run(_upsert_catalogue, criteria, competencies)
+    return len(criteria), len(competencies)
+
+
+def export_workbook(conn, target):
+    """Write the current catalogue in the import format (streamed, write-only)"""
+    workbook = Workbook(write_only=True)
+    # A department called "Năng lực" must not be read back as the competency sheet
+    used = {COMPETENCY_SHEET.lower()}
+    cursor = conn.cursor()
+    cursor.execute("SELECT DISTINCT department FROM evaluation_criteria ORDER BY department")
+    for (department,) in cursor.fetchall():
+        # Sheets starting with "_" are skipped on import
+        sheet = workbook.create_sheet(sheet_title(department.lstrip('_'), used))
+        sheet.append([DEPARTMENT_LABEL, department])
+        sheet.append([CRITERIA_COLUMNS[field] for field in ('category', 'kra_name', 'description', 'weight')])
+        cursor.execute(
+            "SELECT category, kra_name, description, weight FROM evaluation_criteria "
+            "WHERE department = ? ORDER BY category, kra_name", (department,))
+        for row in cursor.fetchall():
+            sheet.append(list(row))
+    sheet = workbook.create_sheet(COMPETENCY_SHEET)
+    sheet.append(list(COMPETENCY_COLUMNS.values()))
+    cursor.execute(f"SELECT {', '.join(COMPETENCY_COLUMNS)} FROM competencies ORDER BY category, id")
+    for row in cursor.fetchall():
+        sheet.append(list(row))
+    workbook.save(target)
+
+
+if __name__ == "__main__":
+    command = sys.argv[1] if len(sys.argv) > 1 else ''
+    if command == 'export' and len(sys.argv) > 2:
+        with storage.get_storage().connection() as conn:
+            export_workbook(conn, sys.argv[2])
+        print(f"Catalogue written to {sys.argv[2]}")
+    elif command == 'import' and len(sys.argv) > 2:
+        with storage.get_storage().connection() as conn:
+            # The upserts need the natural-key constraints
+            database.ensure_schema(conn)
+        criteria, competencies, errors = read_workbook(sys.argv[2])
+        if not errors:
+            with storage.get_storage().connection() as conn:
+                errors = total_errors(conn, criteria)
+        for error in errors:
+            print(f"❌ {error}")
+        if errors:
+            sys.exit(1)
+        with storage.get_storage().connection() as conn:
+            for change in diff_catalogue(conn, criteria, competencies):
+                print(f"{change['Thay đổi']:<32} {change['Loại']:<9} {change['Phòng ban']:<28} {change['Tên']!r}  {change['Chi tiết']}")
+        if '--apply' in sys.argv:
+            written = apply_catalogue(criteria, competencies)
+            print(f"Upserted {written[0]} KRAs and {written[1]} competencies")
+        else:
+            print("Dry run only; add --apply to write these changes")
+    else:
+        print(__doc__)
+        sys.exit(1)
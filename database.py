@@ -1,22 +1,150 @@
 """
 Database schema and initialization for EPR System
 """
+import os
 import sqlite3
 import json
-import hashlib
 from datetime import datetime
+import passwords
+import analytics
+import storage
+import cache
+import search
+import sessions
+
+# Database file, overridable for scratch copies and deployments
+DB_PATH = os.environ.get('EPR_DB_PATH', 'epr_system.db')
+# Seconds a connection waits for a lock before raising "database is locked"
+BUSY_TIMEOUT = float(os.environ.get('EPR_BUSY_TIMEOUT', 30))
+# WAL lets readers keep going while the writer commits
+JOURNAL_MODE = os.environ.get('EPR_JOURNAL_MODE', 'wal')
 
 def hash_password(password):
-    """Hash password using SHA256"""
-    return hashlib.sha256(password.encode()).hexdigest()
+    """Hash password with the configured salted hasher"""
+    return passwords.hash_password(password)
+
+def get_connection(path=None):
+    """Open a connection returning sqlite3.Row rows"""
+    # uri=True so archive files can be ATTACHed read-only (file:...?mode=ro)
+    conn = sqlite3.connect(path or DB_PATH, timeout=BUSY_TIMEOUT, uri=True)
+    conn.row_factory = sqlite3.Row
+    return conn
+
+# Natural keys of the catalogue tables; seeding and imports upsert on these
+CATALOGUE_INDEXES = [
+    "CREATE UNIQUE INDEX IF NOT EXISTS ux_criteria_department_kra ON evaluation_criteria (department, kra_name)",
+    "CREATE UNIQUE INDEX IF NOT EXISTS ux_competencies_name ON competencies (name)",
+]
+
+def _dedupe(cursor, table, key_columns, child_table, child_column):
+    """Keep the lowest id per natural key, re-pointing child rows at it"""
+    match = ' AND '.join(f"k.{col} = c.{col}" for col in key_columns)
+    keys = ', '.join(key_columns)
+    cursor.execute(f'''
+    UPDATE {child_table}
+    SET {child_column} = (
+        SELECT MIN(k.id) FROM {table} k JOIN {table} c ON {match}
+        WHERE c.id = {child_table}.{child_column}
+    )
+    WHERE {child_column} IN (
+        SELECT c.id FROM {table} c
+        WHERE c.id > (SELECT MIN(k.id) FROM {table} k WHERE {match})
+    )
+    ''')
+    repointed = cursor.rowcount
+    # An evaluation that scored both copies keeps its first row
+    cursor.execute(f'''
+    DELETE FROM {child_table} WHERE id NOT IN (
+        SELECT MIN(id) FROM {child_table} GROUP BY evaluation_id, {child_column}
+    )
+    ''')
+    cursor.execute(f"DELETE FROM {table} WHERE id NOT IN (SELECT MIN(id) FROM {table} GROUP BY {keys})")
+    print(f"{table}: removed {cursor.rowcount} duplicates, re-pointed {repointed} {child_table} rows")
+
+def _dedupe_catalogue(conn):
+    """Migration 1: remove duplicate seed rows and add the natural-key unique indexes"""
+    cursor = conn.cursor()
+    _dedupe(cursor, 'evaluation_criteria', ('department', 'kra_name'), 'evaluation_details', 'criterion_id')
+    _dedupe(cursor, 'competencies', ('name',), 'competency_evaluations', 'competency_id')
+    for sql in CATALOGUE_INDEXES:
+        cursor.execute(sql)
+
+def _incremental_auto_vacuum(conn):
+    """Migration 2: ask for auto_vacuum = INCREMENTAL so maintenance can return free pages"""
+    conn.execute("PRAGMA auto_vacuum = INCREMENTAL")
+    # An existing file only switches after a full VACUUM, which is too slow and
+    # lock-heavy for startup; it is left to 'python maintenance.py vacuum'
+    if conn.execute("PRAGMA auto_vacuum").fetchone()[0] != 2:
+        print("⚠ auto_vacuum is not INCREMENTAL yet; run 'python maintenance.py vacuum' once during downtime")
+
+def _repair_rollups(conn):
+    """Migration 3: rebuild live years' rollups left stale by department/manager changes"""
+    if conn.execute("SELECT 1 FROM sqlite_master WHERE type = 'table' AND name = 'rollup_ratings'").fetchone():
+        # Archived years are rebuilt from their archive files, not from main
+        for (year,) in conn.execute("SELECT DISTINCT year FROM evaluations").fetchall():
+            analytics.rebuild_rollups(conn, year, commit=False)
+
+def _drop_session_profile(conn):
+    """Migration 4: drop the unused profile copy from sessions (resolve reads users)"""
+    if 'profile' in {row[1] for row in conn.execute("PRAGMA table_info(sessions)")}:
+        conn.execute("ALTER TABLE sessions DROP COLUMN profile")
+
+# Applied in order; PRAGMA user_version records how many have run
+MIGRATIONS = [
+    _dedupe_catalogue,
+    _incremental_auto_vacuum,
+    _repair_rollups,
+    _drop_session_profile,
+]
+
+def migrate(conn):
+    """Apply pending migrations, each in its own write transaction"""
+    if storage.dialect_of(conn) != 'sqlite':
+        # Server databases are created fresh with the constraints in place
+        for sql in CATALOGUE_INDEXES:
+            conn.execute(sql)
+        conn.execute("ALTER TABLE sessions DROP COLUMN IF EXISTS profile")
+        conn.commit()
+        return
+    for number, migration in enumerate(MIGRATIONS, start=1):
+        if conn.execute("PRAGMA user_version").fetchone()[0] >= number:
+            continue
+        conn.execute("BEGIN IMMEDIATE")
+        try:
+            # Another process may have applied it while we waited for the lock
+            if conn.execute("PRAGMA user_version").fetchone()[0] < number:
+                migration(conn)
+                conn.execute(f"PRAGMA user_version = {number}")
+            conn.commit()
+        except Exception:
+            conn.rollback()
+            raise
+
+def ensure_schema(conn):
+    """Create derived tables and triggers on top of the core schema (idempotent)"""
+    sessions.ensure_sessions(conn)
+    migrate(conn)
+    # Rollup triggers and the other extensions are SQLite-only
+    if storage.dialect_of(conn) != 'sqlite':
+        return
+    analytics.ensure_rollups(conn)
+    cache.ensure_cache_versions(conn)
+    search.ensure_search(conn)
 
 def init_database():
     """Initialize the database with all necessary tables"""
-    conn = sqlite3.connect('epr_system.db')
+    backend = storage.get_storage()
+    conn = backend.connect()
     cursor = conn.cursor()
+    if backend.dialect == 'sqlite':
+        # Takes effect on a new, empty file; existing files need maintenance.py vacuum
+        cursor.execute("PRAGMA auto_vacuum = INCREMENTAL")
+    
+    def create_table(sql):
+        cursor.execute(storage.portable_ddl(sql, backend.dialect))
     
     # Users table
-    cursor.execute('''
+    create_table('''
     CREATE TABLE IF NOT EXISTS users (
         id INTEGER PRIMARY KEY AUTOINCREMENT,
         code TEXT UNIQUE NOT NULL,
@@ -29,13 +157,14 @@ def init_database():
         area TEXT,
         report_to TEXT,
         emp_type TEXT,
+        is_manager INTEGER DEFAULT 0,
         created_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP,
         updated_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP
     )
     ''')
     
     # Evaluation criteria table
-    cursor.execute('''
+    create_table('''
     CREATE TABLE IF NOT EXISTS evaluation_criteria (
         id INTEGER PRIMARY KEY AUTOINCREMENT,
         department TEXT NOT NULL,
@@ -48,7 +177,7 @@ def init_database():
     ''')
     
     # Evaluations table
-    cursor.execute('''
+    create_table('''
     CREATE TABLE IF NOT EXISTS evaluations (
         id INTEGER PRIMARY KEY AUTOINCREMENT,
         user_id INTEGER NOT NULL,
@@ -71,7 +200,7 @@ def init_database():
     ''')
     
     # Evaluation details table (for each criterion)
-    cursor.execute('''
+    create_table('''
     CREATE TABLE IF NOT EXISTS evaluation_details (
         id INTEGER PRIMARY KEY AUTOINCREMENT,
         evaluation_id INTEGER NOT NULL,
@@ -88,7 +217,7 @@ def init_database():
     ''')
     
     # Competencies table
-    cursor.execute('''
+    create_table('''
     CREATE TABLE IF NOT EXISTS competencies (
         id INTEGER PRIMARY KEY AUTOINCREMENT,
         name TEXT NOT NULL,
@@ -105,7 +234,7 @@ def init_database():
     ''')
     
     # Competency evaluations table
-    cursor.execute('''
+    create_table('''
     CREATE TABLE IF NOT EXISTS competency_evaluations (
         id INTEGER PRIMARY KEY AUTOINCREMENT,
         evaluation_id INTEGER NOT NULL,
@@ -123,6 +252,9 @@ def init_database():
     
     conn.commit()
     
+    # Constraints must exist before the upserts below
+    ensure_schema(conn)
+    
     # Insert default admin user
     try:
         cursor.execute('''
@@ -147,7 +279,8 @@ def init_database():
         print("  Admin: username='admin', password='admin123'")
         print("  Manager: username='manager', password='manager123'")
         print("  Employee: username='employee', password='employee123'")
-    except sqlite3.IntegrityError:
+    except storage.IntegrityError:
+        conn.rollback()
         print("Default users already exist")
     
     # Insert sample evaluation criteria
@@ -162,15 +295,18 @@ def init_database():
         ('Office', 'Hoàn thành công việc được giao', 'Đảm bảo tiến độ và chất lượng công việc', 30, 'KPI'),
     ]
     
-    try:
-        cursor.executemany('''
+    # Upsert on the natural key: re-running never duplicates, and existing rows
+    # (possibly edited by an admin) are left alone
+    inserted = 0
+    for row in criteria_data:
+        cursor.execute('''
         INSERT INTO evaluation_criteria (department, kra_name, description, weight, category)
         VALUES (?, ?, ?, ?, ?)
-        ''', criteria_data)
-        conn.commit()
-        print(f"Inserted {len(criteria_data)} evaluation criteria")
-    except sqlite3.IntegrityError:
-        print("Evaluation criteria already exist")
+        ON CONFLICT (department, kra_name) DO NOTHING
+        ''', row)
+        inserted += cursor.rowcount
+    conn.commit()
+    print(f"Inserted {inserted} evaluation criteria ({len(criteria_data) - inserted} already present)")
     
     # Insert competencies
     competencies_data = [
@@ -185,15 +321,16 @@ def init_database():
          'Tạo trải nghiệm tốt', 'Là chuyên gia dịch vụ'),
     ]
     
-    try:
-        cursor.executemany('''
+    inserted = 0
+    for row in competencies_data:
+        cursor.execute('''
         INSERT INTO competencies (name, description, level_1, level_2, level_3, level_4, level_5)
         VALUES (?, ?, ?, ?, ?, ?, ?)
-        ''', competencies_data)
-        conn.commit()
-        print(f"Inserted {len(competencies_data)} competencies")
-    except sqlite3.IntegrityError:
-        print("Competencies already exist")
+        ON CONFLICT (name) DO NOTHING
+        ''', row)
+        inserted += cursor.rowcount
+    conn.commit()
+    print(f"Inserted {inserted} competencies ({len(competencies_data) - inserted} already present)")
     
     conn.close()
     print("\nDatabase initialized successfully!")
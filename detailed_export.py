@@ -0,0 +1,158 @@
+# -*- coding: utf-8 -*-
+"""
+Detailed evaluation export for EPR System
+
+One row per employee and year with a column per KRA (self-assessed %) and per
+competency (level), next to the evaluation-level scores. An employee who
+submitted several times in a year is reported with the latest matching
+evaluation (highest id), as the earlier ones were superseded. Each department gets
+its own sheet, since departments have different KRAs; the columns are the
+KRAs and competencies that department's evaluations actually scored.
+
+The pivot is a single conditional-aggregation query per sheet: details are
+grouped per evaluation in SQLite (MAX(CASE WHEN criterion_id = ? ...)), so
+Python only sees finished rows, which are streamed into a write-only workbook.
+
+Usage:
+    python detailed_export.py report.xlsx [--year 2025] [--department "IT"] [--status submitted]
+"""
+import argparse
+import re
+
+from openpyxl import Workbook
+
+import records
+import storage
+
+EVALUATION_COLUMNS = [
+    ('u.code', 'Mã NV'),
+    ('u.fullname', 'Họ và tên'),
+    ('u.department', 'Phòng ban'),
+    ('e.year', 'Năm'),
+    ('e.status', 'Trạng thái'),
+    ('e.employee_score', 'Điểm tự đánh giá'),
+    ('e.manager_score', 'Điểm quản lý'),
+    ('e.final_score', 'Điểm cuối'),
+    ('e.rating', 'Xếp loại'),
+]
+# Characters Excel does not allow in sheet titles
+_SHEET_TITLE_INVALID = re.compile(r'[\[\]:*?/\\]')
+
+
+def _filters(year=None, department=None, status=None):
+    """WHERE clause on evaluations e JOIN users u, with its parameters"""
+    clauses, params = [], []
+    for column, value in (('e.year', year), ('u.department', department), ('e.status', status)):
+        if value is not None:
+            clauses.append(f"{column} = ?")
+            params.append(value)
+    return ' AND '.join(clauses) or '1 = 1', params
+
+
+def departments(conn, year=None, department=None, status=None):
+    """Departments with at least one matching evaluation"""
+    where, params = _filters(year, department, status)
+    cursor = conn.cursor()
+    cursor.execute(f'''
+        SELECT DISTINCT COALESCE(u.department, '') FROM evaluations e JOIN users u ON e.user_id = u.id
+        WHERE {where} ORDER BY 1
+    ''', params)
+    return [row[0] for row in cursor.fetchall()]
+
+
+def detail_columns(conn, department, year=None, status=None):
+    """KRAs (id, name) and competencies (id, name) scored by a department's evaluations"""
+    where, params = _filters(year, None, status)
+    # Latest matching evaluation per employee and year
+    scope = f'''
+        SELECT MAX(e.id) FROM evaluations e JOIN users u ON e.user_id = u.id
+        WHERE {where} AND COALESCE(u.department, '') = ?
+        GROUP BY e.user_id, e.year
+    '''
+    params = params + [department]
+    cursor = conn.cursor()
+    cursor.execute(f'''
+        SELECT DISTINCT ec.id, ec.kra_name, ec.category FROM evaluation_details ed
+        JOIN evaluation_criteria ec ON ed.criterion_id = ec.id
+        WHERE ed.evaluation_id IN ({scope}) ORDER BY ec.category, ec.kra_name
+    ''', params)
+    criteria = [(row[0], row[1]) for row in cursor.fetchall()]
+    cursor.execute(f'''
+        SELECT DISTINCT c.id, c.name, c.category FROM competency_evaluations ce
+        JOIN competencies c ON ce.competency_id = c.id
+        WHERE ce.evaluation_id IN ({scope}) ORDER BY c.category, c.id
+    ''', params)
+    competencies = [(row[0], row[1]) for row in cursor.fetchall()]
+    return criteria, competencies, scope, params
+
+
+def pivot_query(criteria, competencies, scope):
+    """SELECT of one row per scoped evaluation with a column per KRA and per competency"""
+    # Each detail table is grouped on its own, so KRAs and competencies never multiply
+    kra_columns = ''.join(f", MAX(CASE WHEN criterion_id = {criterion_id} THEN employee_score END) AS k{i}"
+                          for i, (criterion_id, _) in enumerate(criteria))
+    level_columns = ''.join(f", MAX(CASE WHEN competency_id = {competency_id} THEN employee_level END) AS c{i}"
+                            for i, (competency_id, _) in enumerate(competencies))
+    selected = ', '.join(column for column, _ in EVALUATION_COLUMNS)
+    selected += ''.join(f", k.k{i}" for i in range(len(criteria)))
+    selected += ''.join(f", c.c{i}" for i in range(len(competencies)))
+    return f'''
+        SELECT {selected}
+        FROM evaluations e
+        JOIN users u ON e.user_id = u.id
+        LEFT JOIN (SELECT evaluation_id{kra_columns} FROM evaluation_details
+                   WHERE evaluation_id IN ({scope}) GROUP BY evaluation_id) k ON k.evaluation_id = e.id
+        LEFT JOIN (SELECT evaluation_id{level_columns} FROM competency_evaluations
+                   WHERE evaluation_id IN ({scope}) GROUP BY evaluation_id) c ON c.evaluation_id = e.id
+        WHERE e.id IN ({scope})
+        ORDER BY u.code, e.year, e.id
+    '''
+
+
+def sheet_title(department, used):
+    """Valid, unique sheet title of at most 31 characters"""
+    base = _SHEET_TITLE_INVALID.sub('-', department or 'Chưa có phòng ban')[:31]
+    title, n = base, 1
+    while title.lower() in used:
+        n += 1
+        title = f"{base[:31 - len(str(n)) - 1]}~{n}"
+    used.add(title.lower())
+    return title
+
+
+def export_workbook(conn, target, year=None, department=None, status=None):
+    """Write the detailed report, one sheet per department; returns employee rows written"""
+    workbook = Workbook(write_only=True)
+    used, written = set(), 0
+    for name in departments(conn, year, department, status):
+        criteria, competencies, scope, params = detail_columns(conn, name, year, status)
+        sheet = workbook.create_sheet(sheet_title(name, used))
+        sheet.append([label for _, label in EVALUATION_COLUMNS]
+                     + [f"{kra_name} (%)" for _, kra_name in criteria]
+                     + [f"{competency} (mức)" for _, competency in competencies])
+        cursor = conn.cursor()
+        # The scope subquery appears three times in the pivot
+        cursor.execute(pivot_query(criteria, competencies, scope), params * 3)
+        while True:
+            rows = cursor.fetchmany(records.FETCH_SIZE)
+            if not rows:
+                break
+            for row in rows:
+                sheet.append(list(row))
+            written += len(rows)
+    if not used:
+        workbook.create_sheet('Trống').append(['Không có đánh giá phù hợp'])
+    workbook.save(target)
+    return written
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Detailed per-KRA and per-competency export")
+    parser.add_argument('target')
+    parser.add_argument('--year', type=int)
+    parser.add_argument('--department')
+    parser.add_argument('--status')
+    args = parser.parse_args()
+    with storage.get_storage().connection() as conn:
+        rows = export_workbook(conn, args.target, args.year, args.department, args.status)
+    print(f"Wrote {rows} employee rows to {args.target}")
@@ -0,0 +1,216 @@
+# -*- coding: utf-8 -*-
+"""
+Database maintenance for EPR System
+
+Keeps epr_system.db healthy between review peaks:
+- PRAGMA quick_check first; nothing else runs on a damaged file
+- ANALYZE (first run) or PRAGMA optimize, so the planner has sqlite_stat1
+- PRAGMA incremental_vacuum returns free pages left by deletes and archiving
+  (needs auto_vacuum = INCREMENTAL: new databases are created with it, an
+  existing file is converted once with 'python maintenance.py vacuum')
+- WAL checkpoint (TRUNCATE) so the -wal file does not keep growing
+
+Each run logs page counts before and after, and the query plans of the hot
+queries that changed. The scheduler only runs in an idle window: when the
+database and its WAL have not been written for EPR_MAINTENANCE_IDLE_MINUTES.
+
+Usage:
+    python maintenance.py run      # run now
+    python maintenance.py plans    # print the query plans of the hot queries
+    python maintenance.py vacuum   # one-off VACUUM to switch to incremental auto_vacuum
+"""
+import os
+import sqlite3
+import sys
+import threading
+import time
+
+import database
+
+MAINTENANCE_INTERVAL_HOURS = float(os.environ.get('EPR_MAINTENANCE_INTERVAL_HOURS', 0))
+MAINTENANCE_IDLE_MINUTES = float(os.environ.get('EPR_MAINTENANCE_IDLE_MINUTES', 10))
+# Free pages returned per run (0 = all of them)
+VACUUM_PAGES = int(os.environ.get('EPR_MAINTENANCE_VACUUM_PAGES', 0))
+# Rows sampled per index by PRAGMA optimize
+ANALYSIS_LIMIT = 1000
+# How often the scheduler looks for an idle window
+POLL_SECONDS = 60
+
+# Queries the pages run on every rerun; their plans are compared across a run
+PLAN_QUERIES = {
+    'login': "SELECT * FROM users WHERE LOWER(username) = LOWER(?)",
+    'history': "SELECT * FROM evaluations WHERE user_id = ? ORDER BY created_at DESC",
+    'kpi_details': '''
+        SELECT ec.kra_name, ed.employee_score FROM evaluation_details ed
+        JOIN evaluation_criteria ec ON ed.criterion_id = ec.id WHERE ed.evaluation_id = ?''',
+    'competency_details': '''
+        SELECT c.name, ce.employee_level FROM competency_evaluations ce
+        JOIN competencies c ON ce.competency_id = c.id WHERE ce.evaluation_id = ?''',
+    'team': '''
+        SELECT e.* FROM evaluations e JOIN users u ON e.user_id = u.id
+        WHERE u.report_to = ? AND e.year = ?''',
+}
+
+
+class MaintenanceError(Exception):
+    """Maintenance stopped because the database failed its check"""
+
+
+def page_stats(conn, db_path):
+    """Page counts of the database and the size of its WAL"""
+    wal = db_path + '-wal'
+    return {
+        'page_size': conn.execute("PRAGMA page_size").fetchone()[0],
+        'pages': conn.execute("PRAGMA page_count").fetchone()[0],
+        'free_pages': conn.execute("PRAGMA freelist_count").fetchone()[0],
+        'wal_bytes': os.path.getsize(wal) if os.path.exists(wal) else 0,
+    }
+
+
+def query_plans(conn):
+    """EXPLAIN QUERY PLAN of each hot query, as one line per step"""
+    plans = {}
+    for name, sql in PLAN_QUERIES.items():
+        params = [None] * sql.count('?')
+        try:
+            rows = conn.execute(f"EXPLAIN QUERY PLAN {sql}", params).fetchall()
+        except sqlite3.OperationalError as e:
+            plans[name] = [f"error: {e}"]
+            continue
+        plans[name] = [row[3] for row in rows]
+    return plans
+
+
+def idle_seconds(db_path=None):
+    """Seconds since any process last wrote the database or its WAL"""
+    db_path = db_path or database.DB_PATH
+    mtimes = [os.path.getmtime(path) for path in (db_path, db_path + '-wal') if os.path.exists(path)]
+    return time.time() - max(mtimes) if mtimes else float('inf')
+
+
+def run_maintenance(db_path=None, log=print):
+    """Check, analyze, vacuum and checkpoint the database; returns a report"""
+    db_path = db_path or database.DB_PATH
+    conn = database.get_connection(db_path)
+    # Autocommit: incremental_vacuum and wal_checkpoint must run outside a transaction
+    conn.isolation_level = None
+    started = time.perf_counter()
+    try:
+        before = page_stats(conn, db_path)
+        plans_before = query_plans(conn)
+
+        check = [row[0] for row in conn.execute("PRAGMA quick_check")]
+        if check != ['ok']:
+            raise MaintenanceError(f"quick_check failed: {check[:5]}")
+
+        if conn.execute("SELECT 1 FROM sqlite_master WHERE name = 'sqlite_stat1'").fetchone():
+            conn.execute(f"PRAGMA analysis_limit = {ANALYSIS_LIMIT}")
+            conn.execute("PRAGMA optimize")
+        else:
+            conn.execute("ANALYZE")
+
+        auto_vacuum = conn.execute("PRAGMA auto_vacuum").fetchone()[0]
+        if auto_vacuum == 2:
+            # The pragma frees one page per step; executescript steps it to completion
+            conn.executescript(f"PRAGMA incremental_vacuum({VACUUM_PAGES});")
+        elif before['free_pages']:
+            log("⚠ auto_vacuum is not INCREMENTAL; run 'python maintenance.py vacuum' to reclaim free pages")
+
+        busy, wal_pages, checkpointed = conn.execute("PRAGMA wal_checkpoint(TRUNCATE)").fetchone()
+
+        after = page_stats(conn, db_path)
+        plans_after = query_plans(conn)
+    finally:
+        conn.close()
+
+    changed = {name: (plans_before[name], plans_after[name])
+               for name in PLAN_QUERIES if plans_before[name] != plans_after[name]}
+    report = {
+        'before': before,
+        'after': after,
+        'plan_changes': changed,
+        'checkpoint': {'busy': busy, 'wal_pages': wal_pages, 'checkpointed': checkpointed},
+        'seconds': time.perf_counter() - started,
+    }
+
+    log(f"Maintenance of {db_path} in {report['seconds']:.2f}s: "
+        f"pages {before['pages']} -> {after['pages']}, "
+        f"free {before['free_pages']} -> {after['free_pages']}, "
+        f"WAL {before['wal_bytes'] // 1024} KB -> {after['wal_bytes'] // 1024} KB")
+    if busy:
+        log("⚠ WAL checkpoint was blocked by a reader; it completes on a later run")
+    for name, (old, new) in changed.items():
+        log(f"Query plan changed for {name}:\n  before: {'; '.join(old)}\n  after:  {'; '.join(new)}")
+    return report
+
+
+def enable_incremental_vacuum(db_path=None, log=print):
+    """Switch an existing file to auto_vacuum = INCREMENTAL with a full VACUUM
+
+    The VACUUM rewrites the whole file under an exclusive lock, so it is run
+    by hand while the app is stopped, never from startup or the scheduler.
+    """
+    db_path = db_path or database.DB_PATH
+    conn = database.get_connection(db_path)
+    conn.isolation_level = None
+    try:
+        if conn.execute("PRAGMA auto_vacuum").fetchone()[0] == 2:
+            log(f"{db_path} already uses incremental auto_vacuum")
+            return False
+        started = time.perf_counter()
+        conn.execute("PRAGMA auto_vacuum = INCREMENTAL")
+        conn.execute("VACUUM")
+        if conn.execute("PRAGMA auto_vacuum").fetchone()[0] != 2:
+            raise MaintenanceError("VACUUM did not switch auto_vacuum to INCREMENTAL")
+    finally:
+        conn.close()
+    log(f"Switched {db_path} to incremental auto_vacuum in {time.perf_counter() - started:.2f}s")
+    return True
+
+
+def start_scheduler(interval_hours, db_path=None, idle_minutes=None, stop=None):
+    """Run maintenance every interval_hours, waiting for an idle window, on a daemon thread
+
+    Setting the optional stop event ends the thread at its next poll.
+    """
+    idle = (idle_minutes if idle_minutes is not None else MAINTENANCE_IDLE_MINUTES) * 60
+    stop = stop or threading.Event()
+
+    def loop():
+        last_run = time.monotonic()
+        while not stop.wait(POLL_SECONDS):
+            if time.monotonic() - last_run < interval_hours * 3600 or idle_seconds(db_path) < idle:
+                continue
+            last_run = time.monotonic()
+            try:
+                run_maintenance(db_path)
+            except Exception as e:
+                print(f"⚠ Database maintenance failed: {e}")
+
+    thread = threading.Thread(target=loop, name='epr-maintenance', daemon=True)
+    thread.start()
+    return thread
+
+
+if __name__ == "__main__":
+    command = sys.argv[1] if len(sys.argv) > 1 else ''
+    if command == 'run':
+        try:
+            run_maintenance()
+        except MaintenanceError as e:
+            print(f"❌ {e}")
+            sys.exit(1)
+    elif command == 'vacuum':
+        try:
+            enable_incremental_vacuum()
+        except (MaintenanceError, sqlite3.OperationalError) as e:
+            print(f"❌ {e}")
+            sys.exit(1)
+    elif command == 'plans':
+        conn = database.get_connection()
+        for name, steps in query_plans(conn).items():
+            print(f"{name}: {'; '.join(steps)}")
+        conn.close()
+    else:
+        print(__doc__)
+        sys.exit(1)
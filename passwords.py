@@ -0,0 +1,156 @@
+# -*- coding: utf-8 -*-
+"""
+Password hashing for EPR System
+
+Hashes are stored in a versioned format so the work factor can be raised later
+without breaking existing accounts:
+
+    scrypt$1$n=16384,r=8,p=1$<salt>$<digest>
+    pbkdf2_sha256$1$i=600000$<salt>$<digest>
+
+Legacy accounts still hold a bare SHA-256 hex digest; they are verified as-is
+and upgraded to the configured hasher on the next successful login.
+"""
+import os
+import hmac
+import base64
+import hashlib
+from concurrent.futures import ThreadPoolExecutor
+
+FORMAT_VERSION = '1'
+SALT_BYTES = 16
+
+# Work factors can be tuned per deployment through environment variables
+DEFAULT_ALGORITHM = os.environ.get('EPR_PASSWORD_HASHER', 'scrypt')
+SCRYPT_N = int(os.environ.get('EPR_SCRYPT_N', 2 ** 14))
+SCRYPT_R = int(os.environ.get('EPR_SCRYPT_R', 8))
+SCRYPT_P = int(os.environ.get('EPR_SCRYPT_P', 1))
+PBKDF2_ITERATIONS = int(os.environ.get('EPR_PBKDF2_ITERATIONS', 600000))
+HASH_WORKERS = int(os.environ.get('EPR_HASH_WORKERS', 4))
+
+# Small pool so a burst of logins runs in parallel (hashlib releases the GIL)
+# without letting every session thread burn a CPU core at once
+_executor = ThreadPoolExecutor(max_workers=HASH_WORKERS, thread_name_prefix='epr-hash')
+
+
+def _b64encode(raw):
+    return base64.b64encode(raw).decode('ascii').rstrip('=')
+
+
+def _b64decode(text):
+    return base64.b64decode(text + '=' * (-len(text) % 4))
+
+
+def _format_params(params):
+    return ','.join(f"{key}={value}" for key, value in params.items())
+
+
+def _parse_params(text):
+    return {key: int(value) for key, value in (item.split('=', 1) for item in text.split(','))}
+
+
+class ScryptHasher:
+    """scrypt from hashlib (memory-hard)"""
+    algorithm = 'scrypt'
+
+    def __init__(self, n=SCRYPT_N, r=SCRYPT_R, p=SCRYPT_P):
+        self.params = {'n': n, 'r': r, 'p': p}
+
+    def derive(self, password, salt, params):
+        n, r, p = params['n'], params['r'], params['p']
+        # Default maxmem (32 MiB) is too small for n >= 2**15
+        return hashlib.scrypt(password.encode(), salt=salt, n=n, r=r, p=p,
+                              maxmem=256 * n * r + 1024 * 1024, dklen=32)
+
+
+class Pbkdf2Hasher:
+    """PBKDF2-HMAC-SHA256 from hashlib"""
+    algorithm = 'pbkdf2_sha256'
+
+    def __init__(self, iterations=PBKDF2_ITERATIONS):
+        self.params = {'i': iterations}
+
+    def derive(self, password, salt, params):
+        return hashlib.pbkdf2_hmac('sha256', password.encode(), salt, params['i'], dklen=32)
+
+
+HASHERS = {
+    ScryptHasher.algorithm: ScryptHasher,
+    Pbkdf2Hasher.algorithm: Pbkdf2Hasher,
+}
+
+
+def get_hasher(algorithm=None, **params):
+    """Return a hasher instance, defaulting to the configured algorithm"""
+    algorithm = algorithm or DEFAULT_ALGORITHM
+    if algorithm not in HASHERS:
+        raise ValueError(f"Unknown password hasher: {algorithm}")
+    return HASHERS[algorithm](**params)
+
+
+def is_legacy_hash(stored):
+    """Bare unsalted SHA-256 hex digest from the original schema"""
+    return len(stored) == 64 and '$' not in stored
+
+
+def hash_password(password, hasher=None):
+    """Hash password with a random salt in the versioned format"""
+    hasher = hasher or get_hasher()
+    salt = os.urandom(SALT_BYTES)
+    digest = hasher.derive(password, salt, hasher.params)
+    return '$'.join([hasher.algorithm, FORMAT_VERSION, _format_params(hasher.params),
+                     _b64encode(salt), _b64encode(digest)])
+
+
+def verify_password(password, stored):
+    """Check password against a stored hash (versioned or legacy SHA-256)"""
+    if not stored:
+        return False
+    if is_legacy_hash(stored):
+        candidate = hashlib.sha256(password.encode()).hexdigest()
+        return hmac.compare_digest(candidate, stored)
+    try:
+        algorithm, version, params, salt, digest = stored.split('$')
+        if version != FORMAT_VERSION or algorithm not in HASHERS:
+            return False
+        params = _parse_params(params)
+        candidate = HASHERS[algorithm]().derive(password, _b64decode(salt), params)
+    except (ValueError, KeyError):
+        return False
+    return hmac.compare_digest(candidate, _b64decode(digest))
+
+
+def needs_rehash(stored, hasher=None):
+    """True if the stored hash is legacy or uses other settings than the current hasher"""
+    if is_legacy_hash(stored):
+        return True
+    hasher = hasher or get_hasher()
+    parts = stored.split('$')
+    if len(parts) != 5:
+        return True
+    algorithm, version, params = parts[0], parts[1], parts[2]
+    return (algorithm != hasher.algorithm or version != FORMAT_VERSION
+            or params != _format_params(hasher.params))
+
+
+def hash_password_async(password, hasher=None):
+    """Hash on the worker pool, returns a Future"""
+    return _executor.submit(hash_password, password, hasher)
+
+
+def verify_password_async(password, stored):
+    """Verify on the worker pool, returns a Future"""
+    return _executor.submit(verify_password, password, stored)
+
+
+def check_password(password, stored):
+    """Verify on the worker pool and return (ok, new_hash_or_None)
+
+    new_hash is set when the login succeeded but the stored hash should be
+    upgraded to the current hasher settings.
+    """
+    if not verify_password_async(password, stored).result():
+        return False, None
+    if needs_rehash(stored):
+        return True, hash_password_async(password).result()
+    return True, None
@@ -4,56 +4,92 @@ PDF Generator for EPR System
 """
 import io
 import os
+import threading
 from datetime import datetime
 from reportlab.lib.pagesizes import A4
 from reportlab.lib import colors
 from reportlab.lib.styles import getSampleStyleSheet, ParagraphStyle
 from reportlab.lib.units import mm
 from reportlab.platypus import SimpleDocTemplate, Table, TableStyle, Paragraph, Spacer
-from reportlab.pdfbase import pdfmetrics
+from reportlab.platypus import BaseDocTemplate, PageTemplate, Frame, PageBreak, Flowable
+from reportlab.pdfbase import pdfdoc, pdfmetrics
 from reportlab.pdfbase.ttfonts import TTFont
+from reportlab.pdfgen.canvas import Canvas
 
-# Register Arial font for Vietnamese support (Working solution from test_full_vietnamese.pdf)
-try:
-    arial_path = os.path.join(r"C:\Windows\Fonts", "arial.ttf")
-    arialbd_path = os.path.join(r"C:\Windows\Fonts", "arialbd.ttf")
-    
-    # Register Arial (regular)
-    if os.path.exists(arial_path):
-        pdfmetrics.registerFont(TTFont('VietnameseFont', arial_path))
-        print("✓ Registered Arial font for Vietnamese")
-    else:
-        raise Exception("Arial font not found")
-    
-    # Register Arial Bold if available
-    if os.path.exists(arialbd_path):
-        pdfmetrics.registerFont(TTFont('VietnameseFontBold', arialbd_path))
-    else:
-        # Use regular as fallback for bold
-        pdfmetrics.registerFont(TTFont('VietnameseFontBold', arial_path))
-    
-    font_name = 'VietnameseFont'
-    font_name_bold = 'VietnameseFontBold'
-    
-except Exception as e:
-    print(f"⚠ Font registration error: {e}")
-    print("⚠ Falling back to Helvetica")
-    font_name = 'Helvetica'
-    font_name_bold = 'Helvetica-Bold'
-
-def generate_evaluation_pdf(user_info, evaluation_data):
-    """Generate PDF report for evaluation"""
-    buffer = io.BytesIO()
-    doc = SimpleDocTemplate(buffer, pagesize=A4, rightMargin=20*mm, leftMargin=20*mm, 
-                           topMargin=20*mm, bottomMargin=20*mm)
-    
-    # Container for PDF elements
-    elements = []
+# Arial covers Vietnamese; registered on the first PDF rather than at import
+FONT_DIR = os.environ.get('EPR_PDF_FONT_DIR', r"C:\Windows\Fonts")
+_fonts = None
+_fonts_lock = threading.Lock()
+
+
+class PdfProfileError(Exception):
+    """Output profile cannot be honoured on this server"""
+
+
+class ArchivalCanvas(Canvas):
+    """Canvas writing Flate-only page streams; ASCII85 adds a quarter to every page"""
+
+    def __init__(self, *args, **kwargs):
+        super().__init__(*args, **kwargs)
+        self._add_doc_page = self._doc.addPage
+        self._doc.addPage = self._add_page
+
+    def _add_page(self, page):
+        # A page without Contents gets its filters from the process-wide
+        # rl_config.useA85 when the file is written; set them on this page instead
+        if page.compression and not page.Contents:
+            contents = pdfdoc.PDFStream(content=page.stream, filters=[pdfdoc.PDFZCompress])
+            contents.__Comment__ = "page stream"
+            page.Contents = contents
+        self._add_doc_page(page)
+
+# Output profiles. TrueType fonts are always embedded as subsets of the glyphs used;
+# 'archival' also drops ASCII85 and records document metadata.
+PROFILES = {
+    'default': Canvas,
+    'archival': ArchivalCanvas,
+}
+
+
+def get_fonts():
+    """Register the Vietnamese fonts once; returns (regular, bold) font names"""
+    global _fonts
+    with _fonts_lock:
+        if _fonts is None:
+            arial_path = os.path.join(FONT_DIR, "arial.ttf")
+            arialbd_path = os.path.join(FONT_DIR, "arialbd.ttf")
+            try:
+                pdfmetrics.registerFont(TTFont('VietnameseFont', arial_path))
+                # Use regular as fallback for bold
+                bold_path = arialbd_path if os.path.exists(arialbd_path) else arial_path
+                pdfmetrics.registerFont(TTFont('VietnameseFontBold', bold_path))
+                _fonts = ('VietnameseFont', 'VietnameseFontBold')
+            except Exception:
+                # Helvetica lacks Vietnamese glyphs but keeps the PDF usable
+                _fonts = ('Helvetica', 'Helvetica-Bold')
+        return _fonts
+
+def profile_options(profile, title, pdfa=False):
+    """(canvasmaker, document template options) of an output profile"""
+    if profile not in PROFILES:
+        raise PdfProfileError(f"Unknown PDF profile {profile!r}")
+    options = {}
+    if profile == 'archival':
+        options = {'title': title, 'author': 'EPR System', 'subject': title, 'pageCompression': 1}
+    if pdfa:
+        # PDF/A needs every font embedded: no Helvetica, not even as the canvas default
+        base_font, _ = get_fonts()
+        if base_font == 'Helvetica':
+            raise PdfProfileError(f"PDF/A needs the Vietnamese TrueType fonts; none found in {FONT_DIR}")
+        options.update(initialFontName=base_font, lang='vi')
+    return PROFILES[profile], options
+
+def get_styles():
+    """Fonts and paragraph styles shared by the reports"""
     styles = getSampleStyleSheet()
     
     # Use Vietnamese font if available
-    base_font = font_name
-    base_font_bold = font_name_bold
+    base_font, base_font_bold = get_fonts()
     
     # Custom styles with encoding support
     title_style = ParagraphStyle(
@@ -84,6 +120,14 @@ def generate_evaluation_pdf(user_info, evaluation_data):
         fontSize=9,
         wordWrap='CJK'
     )
+    return {'font': base_font, 'font_bold': base_font_bold, 'title': title_style,
+            'heading': heading_style, 'normal': normal_style}
+
+def evaluation_elements(user_info, evaluation_data, styles):
+    """Flowables of one evaluation report"""
+    elements = []
+    base_font, base_font_bold = styles['font'], styles['font_bold']
+    title_style, heading_style, normal_style = styles['title'], styles['heading'], styles['normal']
     
     # Title - ensure text is unicode
     title_text = "PHIẾU ĐÁNH GIÁ HIỆU QUẢ CÔNG VIỆC 2025"
@@ -133,6 +177,7 @@ def generate_evaluation_pdf(user_info, evaluation_data):
     
     kpi_table = Table(kpi_data, colWidths=[10*mm, 50*mm, 15*mm, 18*mm, 18*mm, 64*mm])
     kpi_table.setStyle(TableStyle([
+        ('FONTNAME', (0, 0), (-1, -1), base_font),
         ('FONTNAME', (0, 0), (-1, 0), base_font_bold),
         ('FONTSIZE', (0, 0), (-1, -1), 8),
         ('BACKGROUND', (0, 0), (-1, 0), colors.HexColor('#1f4788')),
@@ -168,6 +213,7 @@ def generate_evaluation_pdf(user_info, evaluation_data):
     
     comp_table = Table(comp_data, colWidths=[10*mm, 40*mm, 15*mm, 16*mm, 16*mm, 18*mm, 60*mm])
     comp_table.setStyle(TableStyle([
+        ('FONTNAME', (0, 0), (-1, -1), base_font),
         ('FONTNAME', (0, 0), (-1, 0), base_font_bold),
         ('FONTSIZE', (0, 0), (-1, -1), 8),
         ('BACKGROUND', (0, 0), (-1, 0), colors.HexColor('#1f4788')),
@@ -221,14 +267,130 @@ def generate_evaluation_pdf(user_info, evaluation_data):
     
     sig_table = Table(sig_data, colWidths=[60*mm, 55*mm, 55*mm])
     sig_table.setStyle(TableStyle([
+        ('FONTNAME', (0, 0), (-1, -1), base_font),
         ('FONTNAME', (0, 0), (-1, 0), base_font_bold),
         ('FONTSIZE', (0, 0), (-1, -1), 9),
         ('ALIGN', (0, 0), (-1, 0), 'CENTER'),
         ('VALIGN', (0, 0), (-1, -1), 'TOP'),
     ]))
     elements.append(sig_table)
+    return elements
+
+def generate_evaluation_pdf(user_info, evaluation_data, profile='default', pdfa=False):
+    """Generate PDF report for evaluation"""
+    buffer = io.BytesIO()
+    canvasmaker, options = profile_options(profile, f"EPR {user_info.get('code') or ''} {user_info['fullname']}", pdfa)
+    doc = SimpleDocTemplate(buffer, pagesize=A4, rightMargin=20*mm, leftMargin=20*mm, 
+                           topMargin=20*mm, bottomMargin=20*mm, **options)
     
     # Build PDF
-    doc.build(elements)
+    doc.build(evaluation_elements(user_info, evaluation_data, get_styles()), canvasmaker=canvasmaker)
     buffer.seek(0)
     return buffer
+
+class Bookmark(Flowable):
+    """Zero-size marker adding an outline entry for the page it lands on"""
+
+    def __init__(self, key, title, level=0):
+        super().__init__()
+        self.key = key
+        self.title = title
+        self.level = level
+
+    def wrap(self, available_width, available_height):
+        return 0, 0
+
+    def draw(self):
+        self.canv.bookmarkPage(self.key)
+        self.canv.addOutlineEntry(self.title, self.key, level=self.level)
+
+def _score(value):
+    return f"{value:.2f}" if value is not None else "-"
+
+def summary_elements(title, summary_rows, styles):
+    """First pages of a department book: scores and ratings of every employee"""
+    elements = [Bookmark('summary', 'Tổng hợp'), Paragraph(title, styles['title']),
+                Paragraph(f"{len(summary_rows)} nhân viên - Ngày xuất: {datetime.now().strftime('%d/%m/%Y')}",
+                          styles['normal']),
+                Spacer(1, 12)]
+    data = [['STT', 'Mã NV', 'Họ và tên', 'Tự đánh giá', 'Quản lý', 'Điểm cuối', 'Xếp loại', 'Trạng thái']]
+    for i, row in enumerate(summary_rows, 1):
+        data.append([str(i), row.get('code') or '', Paragraph(row.get('fullname') or '', styles['normal']),
+                     _score(row.get('employee_score')), _score(row.get('manager_score')),
+                     _score(row.get('final_score')), row.get('rating') or '-', row.get('status') or ''])
+    # Header row repeats on every page of a long team
+    table = Table(data, colWidths=[10*mm, 20*mm, 50*mm, 20*mm, 18*mm, 18*mm, 16*mm, 18*mm], repeatRows=1)
+    table.setStyle(TableStyle([
+        ('FONTNAME', (0, 0), (-1, -1), styles['font']),
+        ('FONTNAME', (0, 0), (-1, 0), styles['font_bold']),
+        ('FONTSIZE', (0, 0), (-1, -1), 8),
+        ('BACKGROUND', (0, 0), (-1, 0), colors.HexColor('#1f4788')),
+        ('TEXTCOLOR', (0, 0), (-1, 0), colors.whitesmoke),
+        ('GRID', (0, 0), (-1, -1), 0.5, colors.grey),
+        ('VALIGN', (0, 0), (-1, -1), 'MIDDLE'),
+        ('ALIGN', (3, 0), (-1, -1), 'CENTER'),
+    ]))
+    elements.append(table)
+    return elements
+
+def _build_streaming(doc, chunks, canvasmaker=Canvas):
+    """doc.build() over an iterable of flowable lists, laid out one list at a time
+
+    build() needs every flowable up front; this runs the same steps per chunk,
+    so only the report being laid out is held as flowables. Finished pages stay
+    in the canvas until save, as compact page streams, so memory still grows
+    with the page count (about a third of a single build()).
+
+    These are BaseDocTemplate internals, not public API: requirements.txt pins
+    the ReportLab release this was written against, and
+    tests/test_pdf_generator.py builds a book to catch a changed internal.
+    """
+    doc._startBuild(canvasmaker=canvasmaker)
+    doc.canv._doctemplate = doc
+    try:
+        for chunk in chunks:
+            flowables = list(chunk)
+            while flowables:
+                doc.clean_hanging()
+                doc.handle_flowable(flowables)
+    finally:
+        del doc.canv._doctemplate
+    doc._endBuild()
+
+def generate_department_book(title, summary_rows, reports, output=None, profile='default', pdfa=False):
+    """One PDF for a team: summary table, then each employee's report from a new page
+
+    reports yields (user_info, evaluation_data) pairs and is consumed lazily,
+    so callers can read each evaluation from the database as it is needed.
+    Without summary_rows this is a plain batch of reports sharing one copy of
+    the embedded fonts.
+    """
+    output = output or io.BytesIO()
+    canvasmaker, options = profile_options(profile, title, pdfa)
+    styles = get_styles()
+
+    def footer(canvas, doc):
+        canvas.saveState()
+        canvas.setFont(styles['font'], 8)
+        canvas.drawRightString(A4[0] - 20*mm, 10*mm, f"{title} - Trang {doc.page}")
+        canvas.restoreState()
+
+    doc = BaseDocTemplate(output, pagesize=A4, rightMargin=20*mm, leftMargin=20*mm,
+                          topMargin=20*mm, bottomMargin=20*mm, **dict({'title': title}, **options))
+    frame = Frame(doc.leftMargin, doc.bottomMargin, doc.width, doc.height, id='normal')
+    doc.addPageTemplates([PageTemplate(id='book', frames=[frame], onPage=footer)])
+
+    def chunks():
+        # Open the viewer's bookmark pane
+        doc.canv.showOutline()
+        if summary_rows is not None:
+            yield summary_elements(title, summary_rows, styles)
+        for i, (user_info, evaluation_data) in enumerate(reports, 1):
+            label = f"{user_info.get('code') or ''} - {user_info['fullname']}"
+            page_break = [PageBreak()] if i > 1 or summary_rows is not None else []
+            yield page_break + [Bookmark(f"report_{i}", label)] + \
+                evaluation_elements(user_info, evaluation_data, styles)
+
+    _build_streaming(doc, chunks(), canvasmaker)
+    output.seek(0)
+    return output
@@ -0,0 +1,167 @@
+# -*- coding: utf-8 -*-
+"""
+Page rerun profiling for EPR System
+
+Captures one full rerun of a dashboard when a user reports a slow page:
+- 'sampling': a helper thread samples the script thread's stack every
+  EPR_PROFILE_INTERVAL_MS and writes collapsed stacks (".collapsed", one
+  "frame;frame;frame count" line per stack) for flamegraph.pl or speedscope
+- 'cprofile': cProfile around the rerun, dumped as ".pstats"
+  (python -m pstats, snakeviz)
+
+A rerun is profiled when an admin's URL has ?profile=1 (or ?profile=cprofile),
+or when an admin armed profiling for that username in the admin overview. Files
+go to EPR_PROFILE_DIR; the newest EPR_PROFILE_KEEP are kept.
+"""
+import cProfile
+import os
+import re
+import sys
+import threading
+import time
+from collections import Counter
+from datetime import datetime
+
+PROFILE_DIR = os.environ.get('EPR_PROFILE_DIR', 'profiles')
+PROFILE_KEEP = int(os.environ.get('EPR_PROFILE_KEEP', 50))
+PROFILE_MODE = os.environ.get('EPR_PROFILE_MODE', 'sampling')
+SAMPLE_INTERVAL = float(os.environ.get('EPR_PROFILE_INTERVAL_MS', 5)) / 1000
+
+MODES = {'sampling': '.collapsed', 'cprofile': '.pstats'}
+
+# username -> reruns still to profile, armed from the admin overview
+_armed = {}
+_armed_lock = threading.Lock()
+
+
+def requested_mode(query_value):
+    """Mode asked for by a ?profile= value, or None"""
+    if not query_value or query_value in ('0', 'false'):
+        return None
+    return query_value if query_value in MODES else PROFILE_MODE
+
+
+def arm(username, reruns=1, mode=None):
+    """Profile the next reruns of a user's page, in any session of this process"""
+    with _armed_lock:
+        _armed[username] = (reruns, mode or PROFILE_MODE)
+
+
+def disarm(username):
+    with _armed_lock:
+        _armed.pop(username, None)
+
+
+def armed():
+    """username -> (reruns left, mode)"""
+    with _armed_lock:
+        return dict(_armed)
+
+
+def take_armed(username):
+    """Mode for this rerun if profiling is armed for the user (counts it down), else None"""
+    with _armed_lock:
+        if username not in _armed:
+            return None
+        reruns, mode = _armed[username]
+        if reruns <= 1:
+            del _armed[username]
+        else:
+            _armed[username] = (reruns - 1, mode)
+        return mode
+
+
+def _frame_name(code):
+    # ';' separates frames in the collapsed format
+    return f"{code.co_name} ({os.path.basename(code.co_filename)}:{code.co_firstlineno})".replace(';', ':')
+
+
+class Sampler:
+    """Samples one thread's stack at a fixed interval on a helper thread"""
+
+    def __init__(self, thread_id, root_code, interval=SAMPLE_INTERVAL):
+        self.thread_id = thread_id
+        # Frames above the profiled function (Streamlit's runner) are left out
+        self.root_code = root_code
+        self.interval = interval
+        self.stacks = Counter()
+        self._stop = threading.Event()
+        self._thread = threading.Thread(target=self._run, name='epr-profiler', daemon=True)
+
+    def start(self):
+        self._thread.start()
+
+    def stop(self):
+        self._stop.set()
+        self._thread.join()
+        return self.stacks
+
+    def _run(self):
+        while not self._stop.wait(self.interval):
+            frame = sys._current_frames().get(self.thread_id)
+            stack = []
+            while frame is not None:
+                stack.append(_frame_name(frame.f_code))
+                if frame.f_code is self.root_code:
+                    self.stacks[';'.join(reversed(stack))] += 1
+                    break
+                frame = frame.f_back
+
+
+def _target(page, username, mode):
+    os.makedirs(PROFILE_DIR, exist_ok=True)
+    user = re.sub(r'[^\w.-]', '_', username or 'anonymous')
+    name = f"{datetime.now().strftime('%Y%m%d_%H%M%S_%f')}_{page}_{user}{MODES[mode]}"
+    return os.path.join(PROFILE_DIR, name)
+
+
+def profile_call(fn, page, username, mode=None):
+    """Run fn() under the profiler and save the capture; returns (path, seconds)
+
+    Exceptions from fn (including Streamlit's rerun/stop signals) propagate
+    after the capture is written.
+    """
+    mode = mode if mode in MODES else PROFILE_MODE
+    path = _target(page, username, mode)
+    started = time.perf_counter()
+    if mode == 'cprofile':
+        profiler = cProfile.Profile()
+        profiler.enable()
+        try:
+            fn()
+        finally:
+            profiler.disable()
+            profiler.dump_stats(path)
+            rotate()
+    else:
+        sampler = Sampler(threading.get_ident(), fn.__code__)
+        sampler.start()
+        try:
+            fn()
+        finally:
+            stacks = sampler.stop()
+            with open(path, 'w', encoding='utf-8') as f:
+                for stack, count in stacks.most_common():
+                    f.write(f"{stack} {count}\n")
+            rotate()
+    return path, time.perf_counter() - started
+
+
+def list_profiles():
+    """Captured files, newest first: dicts with name, path, bytes, created"""
+    if not os.path.isdir(PROFILE_DIR):
+        return []
+    names = [name for name in os.listdir(PROFILE_DIR) if name.endswith(tuple(MODES.values()))]
+    profiles = []
+    for name in sorted(names, reverse=True):
+        path = os.path.join(PROFILE_DIR, name)
+        profiles.append({'name': name, 'path': path, 'bytes': os.path.getsize(path),
+                         'created': datetime.fromtimestamp(os.path.getmtime(path))})
+    return profiles
+
+
+def rotate(keep=None):
+    """Delete all but the newest `keep` captures"""
+    keep = PROFILE_KEEP if keep is None else keep
+    for profile in list_profiles()[keep:] if keep > 0 else []:
+        os.remove(profile['path'])
@@ -0,0 +1,137 @@
+# -*- coding: utf-8 -*-
+"""
+Typed records for EPR System
+
+Rows that live in caches and st.session_state are kept as slotted, frozen
+dataclasses instead of dicts: no per-row __dict__, only the columns the app
+reads, and safe to share between sessions. Records still answer record['x']
+and record.get('x'), so code written against dict rows keeps working.
+"""
+from dataclasses import dataclass, fields
+
+# Rows fetched per round trip while building records
+FETCH_SIZE = 256
+
+
+class RecordMixin:
+    """Dict-style read access for record dataclasses"""
+    __slots__ = ()
+
+    def __getitem__(self, key):
+        try:
+            return getattr(self, key)
+        except AttributeError:
+            raise KeyError(key)
+
+    def __contains__(self, key):
+        return key in self.keys()
+
+    def get(self, key, default=None):
+        return getattr(self, key, default)
+
+    def keys(self):
+        return [field.name for field in fields(self)]
+
+    def to_dict(self):
+        return {name: getattr(self, name) for name in self.keys()}
+
+    @classmethod
+    def from_mapping(cls, mapping):
+        """Record from a dict or row, ignoring columns the record does not keep"""
+        names = set(mapping.keys())
+        return cls(**{field.name: mapping[field.name] for field in fields(cls) if field.name in names})
+
+
+@dataclass(slots=True, frozen=True)
+class User(RecordMixin):
+    id: int
+    code: str = None
+    fullname: str = None
+    username: str = None
+    email: str = None
+    department: str = None
+    role_type: str = None
+    area: str = None
+    report_to: str = None
+    emp_type: str = None
+    is_manager: int = 0
+
+
+@dataclass(slots=True, frozen=True)
+class Criterion(RecordMixin):
+    id: int
+    department: str = None
+    kra_name: str = None
+    description: str = None
+    weight: float = 0.0
+    category: str = None
+
+
+@dataclass(slots=True, frozen=True)
+class Competency(RecordMixin):
+    id: int
+    name: str = None
+    description: str = None
+    importance_level: int = 2
+    category: str = None
+    level_1: str = None
+    level_2: str = None
+    level_3: str = None
+    level_4: str = None
+    level_5: str = None
+
+
+@dataclass(slots=True, frozen=True)
+class Evaluation(RecordMixin):
+    id: int
+    user_id: int = None
+    year: int = None
+    period: str = None
+    status: str = None
+    employee_score: float = None
+    employee_comment: str = None
+    development_areas: str = None
+    employee_submitted_at: str = None
+    manager_score: float = None
+    manager_comment: str = None
+    manager_submitted_at: str = None
+    final_score: float = None
+    rating: str = None
+    archived: bool = False
+
+
+@dataclass(slots=True, frozen=True)
+class EvaluationDetail(RecordMixin):
+    """One KRA line of an evaluation, joined with its criterion"""
+    category: str = None
+    kra_name: str = None
+    description: str = None
+    weight: float = 0.0
+    employee_score: float = None
+    employee_comment: str = None
+
+
+@dataclass(slots=True, frozen=True)
+class CompetencyDetail(RecordMixin):
+    """One competency line of an evaluation, joined with its competency"""
+    category: str = None
+    name: str = None
+    description: str = None
+    importance_level: int = 2
+    employee_level: int = None
+    employee_comment: str = None
+
+
+def fetch_records(cursor, record_type, size=FETCH_SIZE):
+    """Records for the cursor's result set, read in fetchmany batches"""
+    columns = [column[0] for column in cursor.description]
+    # Positional arguments in field order; fields the query did not select keep their default
+    plan = [(columns.index(field.name), None) if field.name in columns else (None, field.default)
+            for field in fields(record_type)]
+    records = []
+    while True:
+        rows = cursor.fetchmany(size)
+        if not rows:
+            return records
+        records.extend(record_type(*[row[index] if index is not None else default for index, default in plan])
+                       for row in rows)
@@ -0,0 +1,81 @@
+# -*- coding: utf-8 -*-
+"""
+Score and rating rules for EPR System
+"""
+
+# Review year used for new evaluations
+REVIEW_YEAR = 2025
+
+# Final score = KPI Thành tích * 90% + KPI Năng lực * 10%
+KPI_WEIGHT = 0.9
+COMPETENCY_WEIGHT = 0.1
+
+# Map level to percentage: 1->50%, 2->80%, 3->100%, 4->120%, 5->150%
+LEVEL_PERCENTAGES = {1: 50, 2: 80, 3: 100, 4: 120, 5: 150}
+
+# Lower bound of each rating band, best first; anything below is "C"
+RATING_THRESHOLDS = [(135, 'A++'), (120, 'A+'), (100, 'A'), (80, 'B')]
+RATINGS = [rating for _, rating in RATING_THRESHOLDS] + ['C']
+
+
+def rating_for(score):
+    """Return the rating band for a final score"""
+    score = score or 0
+    for threshold, rating in RATING_THRESHOLDS:
+        if score >= threshold:
+            return rating
+    return 'C'
+
+
+def rating_case_sql(expr):
+    """SQL CASE expression computing the rating band of expr"""
+    whens = ' '.join(f"WHEN ({expr}) >= {threshold} THEN '{rating}'"
+                     for threshold, rating in RATING_THRESHOLDS)
+    return f"CASE {whens} ELSE 'C' END"
+
+
+class ScoreAccumulator:
+    """Running KPI and competency sums of the evaluation form, updated one term at a time"""
+
+    def __init__(self, criteria, competencies):
+        self.kpi_weights = {c['id']: c['weight'] for c in criteria}
+        self.comp_weights = {c['id']: c.get('importance_level', 2) for c in competencies}
+        self.kpi_total_weight = sum(self.kpi_weights.values())
+        self.comp_total_weight = sum(w * 100 for w in self.comp_weights.values())
+        self.kpi_terms = {}
+        self.comp_terms = {}
+        self.kpi_sum = 0.0
+        self.comp_sum = 0.0
+        # Form defaults: 100% on every KRA, level 3 on every competency
+        for criterion_id in self.kpi_weights:
+            self.set_kpi(criterion_id, 100.0)
+        for competency_id in self.comp_weights:
+            self.set_level(competency_id, 3)
+
+    def set_kpi(self, criterion_id, result):
+        """Replace one KRA's weighted term"""
+        term = (result or 0) * self.kpi_weights[criterion_id]
+        self.kpi_sum += term - self.kpi_terms.get(criterion_id, 0)
+        self.kpi_terms[criterion_id] = term
+
+    def set_level(self, competency_id, level):
+        """Replace one competency's weighted term"""
+        term = LEVEL_PERCENTAGES[level] * self.comp_weights[competency_id]
+        self.comp_sum += term - self.comp_terms.get(competency_id, 0)
+        self.comp_terms[competency_id] = term
+
+    @property
+    def kpi_result(self):
+        return self.kpi_sum / self.kpi_total_weight if self.kpi_total_weight > 0 else 0
+
+    @property
+    def comp_result(self):
+        return self.comp_sum / self.comp_total_weight * 100 if self.comp_total_weight > 0 else 0
+
+    @property
+    def final_score(self):
+        return self.kpi_result * KPI_WEIGHT + self.comp_result * COMPETENCY_WEIGHT
+
+    @property
+    def rating(self):
+        return rating_for(self.final_score)
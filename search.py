@@ -0,0 +1,197 @@
+# -*- coding: utf-8 -*-
+"""
+Full-text search over evaluation comments for EPR System
+
+An FTS5 table indexes every free-text field of an evaluation: the employee's
+comment and development areas, the manager's comment, and the per-criterion
+and per-competency evidence. Triggers keep it in sync with the source rows.
+
+Vietnamese text is folded for matching: the unicode61 tokenizer removes
+diacritics (remove_diacritics 2), and since it treats đ as a letter of its
+own, đ/Đ are replaced by d/D before indexing and in queries. "danh gia" thus
+finds "Đánh giá". Results are ranked with bm25 and shown with the original,
+unfolded text.
+"""
+import re
+import unicodedata
+
+TABLE = 'evaluation_search'
+PAGE_SIZE = 20
+
+# FTS rowid = source row id * 8 + source code, so triggers can address each text
+SOURCES = {
+    0: ('evaluations', 'employee_comment', 'Nhận xét của nhân viên'),
+    1: ('evaluations', 'development_areas', 'Lĩnh vực cần phát triển'),
+    2: ('evaluations', 'manager_comment', 'Nhận xét của quản lý'),
+    3: ('evaluation_details', 'employee_comment', 'Minh chứng KPI'),
+    4: ('competency_evaluations', 'employee_comment', 'Minh chứng năng lực'),
+}
+ROWID_STRIDE = 8
+
+
+def _fold_sql(expr):
+    return f"REPLACE(REPLACE({expr}, 'đ', 'd'), 'Đ', 'D')"
+
+
+def _evaluation_id_sql(table, row):
+    return f"{row}.id" if table == 'evaluations' else f"{row}.evaluation_id"
+
+
+def _insert_sql(code, row):
+    table, column, _ = SOURCES[code]
+    return f'''
+        INSERT INTO {TABLE} (rowid, body, evaluation_id, source)
+        SELECT {row}.id * {ROWID_STRIDE} + {code}, {_fold_sql(f"{row}.{column}")},
+               {_evaluation_id_sql(table, row)}, {code}
+        WHERE TRIM(COALESCE({row}.{column}, '')) != '';
+    '''
+
+
+def _delete_sql(code, row):
+    return f"DELETE FROM {TABLE} WHERE rowid = {row}.id * {ROWID_STRIDE} + {code};"
+
+
+def available(conn):
+    """True when SQLite was built with FTS5"""
+    try:
+        conn.execute("CREATE VIRTUAL TABLE temp._fts5_probe USING fts5(x)")
+        conn.execute("DROP TABLE temp._fts5_probe")
+        return True
+    except Exception:
+        return False
+
+
+def ensure_search(conn):
+    """Create the FTS5 index and its triggers, backfilling on first run"""
+    if not available(conn):
+        return
+    cursor = conn.cursor()
+    cursor.execute("SELECT 1 FROM sqlite_master WHERE name = ?", (TABLE,))
+    existed = cursor.fetchone() is not None
+    cursor.execute(f'''
+    CREATE VIRTUAL TABLE IF NOT EXISTS {TABLE} USING fts5(
+        body, evaluation_id UNINDEXED, source UNINDEXED,
+        tokenize = 'unicode61 remove_diacritics 2'
+    )
+    ''')
+
+    for table in ('evaluations', 'evaluation_details', 'competency_evaluations'):
+        codes = [code for code, source in SOURCES.items() if source[0] == table]
+        columns = ', '.join(SOURCES[code][1] for code in codes)
+        inserts = ' '.join(_insert_sql(code, 'NEW') for code in codes)
+        deletes = ' '.join(_delete_sql(code, 'OLD') for code in codes)
+        cursor.execute(f"CREATE TRIGGER IF NOT EXISTS trg_search_{table}_insert "
+                       f"AFTER INSERT ON {table} BEGIN {inserts} END")
+        cursor.execute(f"CREATE TRIGGER IF NOT EXISTS trg_search_{table}_delete "
+                       f"AFTER DELETE ON {table} BEGIN {deletes} END")
+        cursor.execute(f"CREATE TRIGGER IF NOT EXISTS trg_search_{table}_update "
+                       f"AFTER UPDATE OF {columns} ON {table} BEGIN {deletes} {inserts} END")
+
+    if not existed:
+        rebuild_search(conn, commit=False)
+    conn.commit()
+
+
+def rebuild_search(conn, commit=True):
+    """Re-index every comment from the source tables"""
+    cursor = conn.cursor()
+    cursor.execute(f"DELETE FROM {TABLE}")
+    for code, (table, column, _) in SOURCES.items():
+        cursor.execute(f'''
+            INSERT INTO {TABLE} (rowid, body, evaluation_id, source)
+            SELECT t.id * {ROWID_STRIDE} + {code}, {_fold_sql(f"t.{column}")},
+                   {_evaluation_id_sql(table, 't')}, {code}
+            FROM {table} t
+            WHERE TRIM(COALESCE(t.{column}, '')) != ''
+        ''')
+    if commit:
+        conn.commit()
+
+
+def _fold_char(ch):
+    """One character without diacritics, lower-cased (length-preserving)"""
+    if ch in 'đĐ':
+        return 'd'
+    return unicodedata.normalize('NFD', ch)[0].lower()
+
+
+def fold(text):
+    return ''.join(_fold_char(ch) for ch in text)
+
+
+def terms(query):
+    """Folded search terms of a user query"""
+    return re.findall(r"\w+", fold(query or ''))
+
+
+def match_query(query):
+    """FTS5 MATCH expression: all terms must appear, each quoted so input cannot inject syntax"""
+    return ' '.join(f'"{term}"' for term in terms(query))
+
+
+def excerpt(text, query_terms, width=160):
+    """Original text around the first match, with matched words in bold (Markdown)"""
+    folded = fold(text)
+    spans = []
+    for term in query_terms:
+        for match in re.finditer(rf"\b{re.escape(term)}\b", folded):
+            spans.append((match.start(), match.end()))
+    spans.sort()
+    start = max(0, spans[0][0] - width // 3) if spans else 0
+    end = min(len(text), start + width)
+    parts, cursor = [], start
+    for span_start, span_end in spans:
+        if span_start < cursor or span_end > end:
+            continue
+        parts.append(text[cursor:span_start])
+        parts.append(f"**{text[span_start:span_end]}**")
+        cursor = span_end
+    parts.append(text[cursor:end])
+    return ('…' if start > 0 else '') + ''.join(parts).replace('\n', ' ') + ('…' if end < len(text) else '')
+
+
+def search(conn, query, page=1, page_size=PAGE_SIZE, year=None):
+    """One page of ranked matches and the total number of matches"""
+    expression = match_query(query)
+    if not expression:
+        return [], 0
+    year_filter = "AND e.year = ?" if year is not None else ""
+    params = [expression] + ([year] if year is not None else [])
+    base = f'''
+        FROM {TABLE} s
+        JOIN evaluations e ON e.id = s.evaluation_id
+        LEFT JOIN users u ON u.id = e.user_id
+        WHERE {TABLE} MATCH ? {year_filter}
+    '''
+    cursor = conn.cursor()
+    cursor.execute(f"SELECT COUNT(*) {base}", params)
+    total = cursor.fetchone()[0]
+    cursor.execute(f'''
+        SELECT s.rowid, s.source, e.id AS evaluation_id, e.year, e.status,
+               u.fullname, u.code, u.department
+        {base}
+        ORDER BY bm25({TABLE})
+        LIMIT ? OFFSET ?
+    ''', params + [page_size, (page - 1) * page_size])
+    hits = [dict(row) for row in cursor.fetchall()]
+
+    # Show the stored text, not the folded copy in the index
+    query_terms = terms(query)
+    for hit in hits:
+        table, column, label = SOURCES[hit['source']]
+        source_id = hit['rowid'] // ROWID_STRIDE
+        row = conn.execute(f"SELECT {column} FROM {table} WHERE id = ?", (source_id,)).fetchone()
+        hit['field'] = label
+        hit['text'] = row[0] if row else ''
+        hit['excerpt'] = excerpt(hit['text'], query_terms)
+        if table == 'evaluation_details':
+            name = conn.execute(
+                "SELECT c.kra_name FROM evaluation_details d JOIN evaluation_criteria c ON c.id = d.criterion_id "
+                "WHERE d.id = ?", (source_id,)).fetchone()
+            hit['field'] += f" – {name[0]}" if name else ''
+        elif table == 'competency_evaluations':
+            name = conn.execute(
+                "SELECT c.name FROM competency_evaluations ce JOIN competencies c ON c.id = ce.competency_id "
+                "WHERE ce.id = ?", (source_id,)).fetchone()
+            hit['field'] += f" – {name[0].splitlines()[0]}" if name else ''
+    return hits, total
@@ -0,0 +1,154 @@
+# -*- coding: utf-8 -*-
+"""
+Session state governor for EPR System
+
+st.session_state keys belong to page namespaces, declared by key prefix
+(employee widgets are score_*, comment_*, comp_*; manager ones mgr_*, ...).
+When a session moves to another page, or logs out, the other pages' keys are
+dropped, so a browser tab does not carry every form it has ever shown.
+
+After each run the session's state is measured and recorded in a
+process-wide registry; totals() reports it for the admin overview during peak
+review days. This is a size report with a threshold, not a hard cap: page data
+(criteria, competencies, evaluations) lives in the shared cache.cached store,
+so what a session holds is its widget values, i.e. what the user has typed,
+which is never dropped. Above the threshold the only derived value
+(EVICTABLE, rebuilt on the next run) is dropped, and the session is flagged
+and logged once so the page holding the state can be found.
+"""
+import os
+import sys
+import threading
+import time
+
+# Survive page changes; cleared only on logout
+CORE_KEYS = ('logged_in', 'user', 'session_token')
+
+PAGE_NAMESPACES = {
+    'login': ('username', 'password'),
+    'employee': ('score_', 'comment_', 'comp_', 'pdf_btn_'),
+    'manager': ('mgr_', 'calib_'),
+    'admin': ('admin_', 'calib_', 'trend_', 'catalogue_', 'progress_', 'search_', 'send_reminders'),
+}
+
+# Derived values the pages rebuild when missing
+EVICTABLE = ('score_accumulator',)
+
+# Sessions above this are reported; EPR_SESSION_STATE_MAX_KB is the older name
+WARN_SESSION_BYTES = int(os.environ.get('EPR_SESSION_STATE_WARN_KB',
+                                        os.environ.get('EPR_SESSION_STATE_MAX_KB', 1024))) * 1024
+# Sessions not seen for this long are dropped from the registry
+IDLE_SECONDS = float(os.environ.get('EPR_SESSION_STATE_IDLE_MINUTES', 30)) * 60
+
+PAGE_KEY = '_page'
+
+_registry = {}
+_registry_lock = threading.Lock()
+
+
+def owners(key):
+    """Pages whose namespace contains key"""
+    return {page for page, prefixes in PAGE_NAMESPACES.items() if key.startswith(prefixes)}
+
+
+def enter_page(state, page):
+    """Drop other pages' keys when the session moves to page"""
+    if state.get(PAGE_KEY) == page:
+        return
+    for key in list(state.keys()):
+        pages = owners(key)
+        if pages and page not in pages:
+            del state[key]
+    state[PAGE_KEY] = page
+
+
+def clear(state):
+    """Drop everything the session holds (logout)"""
+    for key in list(state.keys()):
+        del state[key]
+
+
+def sizeof(value, seen=None):
+    """Approximate deep size of a value in bytes"""
+    seen = set() if seen is None else seen
+    if id(value) in seen or isinstance(value, type) or callable(value):
+        return 0
+    seen.add(id(value))
+    size = sys.getsizeof(value)
+    if isinstance(value, dict):
+        size += sum(sizeof(k, seen) + sizeof(v, seen) for k, v in value.items())
+    elif isinstance(value, (list, tuple, set, frozenset)):
+        size += sum(sizeof(item, seen) for item in value)
+    elif hasattr(value, 'getbuffer'):
+        # Uploaded files and other in-memory buffers
+        size += value.getbuffer().nbytes
+    else:
+        for name in getattr(type(value), '__slots__', ()):
+            size += sizeof(getattr(value, name, None), seen)
+        if hasattr(value, '__dict__'):
+            size += sizeof(vars(value), seen)
+    return size
+
+
+def measure(state):
+    """Bytes held per key"""
+    return {key: sizeof(state[key]) for key in list(state.keys())}
+
+
+def govern(state, session_id):
+    """Record one session's size, trimming derived state above the threshold; returns the bytes it holds"""
+    sizes = measure(state)
+    total = sum(sizes.values())
+    evicted = 0
+    if total > WARN_SESSION_BYTES:
+        for key in sorted((k for k in sizes if k in EVICTABLE), key=sizes.get, reverse=True):
+            del state[key]
+            total -= sizes.pop(key)
+            evicted += 1
+            if total <= WARN_SESSION_BYTES:
+                break
+    over = total > WARN_SESSION_BYTES
+    largest = max(sizes, key=sizes.get) if sizes else None
+    now = time.time()
+    with _registry_lock:
+        previous = _registry.get(session_id, {})
+        if over and not previous.get('over_threshold'):
+            print(f"⚠ Session state {total // 1024} KB on page {state.get(PAGE_KEY)} "
+                  f"(largest key {largest!r}, {sizes[largest] // 1024} KB)")
+        _registry[session_id] = {
+            'page': state.get(PAGE_KEY),
+            'bytes': total,
+            'keys': len(sizes),
+            'largest': largest,
+            'over_threshold': over,
+            'evictions': previous.get('evictions', 0) + evicted,
+            'seen_at': now,
+        }
+        for stale in [sid for sid, entry in _registry.items() if now - entry['seen_at'] > IDLE_SECONDS]:
+            del _registry[stale]
+    return total
+
+
+def forget(session_id):
+    """Remove a session from the registry"""
+    with _registry_lock:
+        _registry.pop(session_id, None)
+
+
+def totals():
+    """State held across live sessions of this process, overall and per page"""
+    with _registry_lock:
+        entries = list(_registry.values())
+    by_page = {}
+    for entry in entries:
+        page = by_page.setdefault(entry['page'] or '-', {'sessions': 0, 'bytes': 0})
+        page['sessions'] += 1
+        page['bytes'] += entry['bytes']
+    return {
+        'sessions': len(entries),
+        'bytes': sum(entry['bytes'] for entry in entries),
+        'max_bytes': max((entry['bytes'] for entry in entries), default=0),
+        'over_threshold': sum(1 for entry in entries if entry['over_threshold']),
+        'evictions': sum(entry['evictions'] for entry in entries),
+        'by_page': by_page,
+    }
@@ -0,0 +1,208 @@
+# -*- coding: utf-8 -*-
+"""
+Server-side login sessions for EPR System
+
+A login creates a row in the sessions table with the user id and an expiry
+time, and hands the browser a signed token, kept in the epr_session cookie
+(SameSite=Strict and never in the URL, so it does not leak through history,
+shared links or Referer headers). Any Streamlit process sharing the database
+resolves the token with one primary-key lookup joined to its users row, so
+restarts and load-balanced workers keep users logged in. Nothing about the
+user is stored in the session: the user row is read on every resolve, so role
+and department changes apply at once; changing a password or a user's
+privileges also revokes their sessions. Tokens with a bad signature are
+rejected without touching the database; expired rows are purged by a
+background thread.
+
+The cookie is written by a script in the page (Streamlit cannot send
+Set-Cookie headers), so it cannot be HttpOnly: any script running in the app
+page can read it. Tokens are restricted to TOKEN_PATTERN before they are put
+into that script.
+"""
+import base64
+import hashlib
+import hmac
+import os
+import re
+import secrets
+import threading
+import time
+
+import storage
+import writer
+
+SESSION_TTL_HOURS = float(os.environ.get('EPR_SESSION_TTL_HOURS', 12))
+SESSION_PURGE_MINUTES = float(os.environ.get('EPR_SESSION_PURGE_MINUTES', 15))
+# Shared by all workers; generated and stored in the database when unset
+SESSION_SECRET = os.environ.get('EPR_SESSION_SECRET', '')
+COOKIE_NAME = 'epr_session'
+# <session id>.<signature>, both URL-safe base64
+TOKEN_PATTERN = re.compile(r'[A-Za-z0-9_-]+\.[A-Za-z0-9_-]+')
+
+# Profile fields never cached in a session
+PRIVATE_FIELDS = ('password',)
+
+
+def ensure_sessions(conn):
+    """Create the sessions tables (portable DDL, idempotent)"""
+    cursor = conn.cursor()
+    cursor.execute('''
+    CREATE TABLE IF NOT EXISTS sessions (
+        session_id TEXT PRIMARY KEY,
+        user_id INTEGER NOT NULL,
+        created_at REAL NOT NULL,
+        expires_at REAL NOT NULL
+    )
+    ''')
+    cursor.execute("CREATE INDEX IF NOT EXISTS idx_sessions_expires ON sessions(expires_at)")
+    cursor.execute('''
+    CREATE TABLE IF NOT EXISTS session_keys (
+        name TEXT PRIMARY KEY,
+        value TEXT NOT NULL
+    )
+    ''')
+    conn.commit()
+
+
+# Write transactions for the writer queue
+
+def _insert_session(conn, session_id, user_id, created_at, expires_at):
+    conn.execute(
+        "INSERT INTO sessions (session_id, user_id, created_at, expires_at) VALUES (?, ?, ?, ?)",
+        (session_id, user_id, created_at, expires_at)
+    )
+
+
+def _delete_session(conn, session_id):
+    conn.execute("DELETE FROM sessions WHERE session_id = ?", (session_id,))
+
+
+def delete_user_sessions(conn, user_id):
+    """Revoke every session of a user, inside the caller's write transaction"""
+    return conn.execute("DELETE FROM sessions WHERE user_id = ?", (user_id,)).rowcount
+
+
+def _extend_session(conn, session_id, expires_at):
+    conn.execute("UPDATE sessions SET expires_at = ? WHERE session_id = ?", (expires_at, session_id))
+
+
+def _delete_expired(conn, now):
+    return conn.execute("DELETE FROM sessions WHERE expires_at <= ?", (now,)).rowcount
+
+
+def _store_secret(conn, value):
+    conn.execute(
+        "INSERT INTO session_keys (name, value) VALUES ('signing', ?) ON CONFLICT (name) DO NOTHING",
+        (value,)
+    )
+
+
+_secret = None
+_secret_lock = threading.Lock()
+
+
+def _signing_key():
+    """HMAC key: EPR_SESSION_SECRET, or one generated once and shared through the database"""
+    global _secret
+    with _secret_lock:
+        if _secret is None:
+            if SESSION_SECRET:
+                _secret = SESSION_SECRET.encode()
+            else:
+                # The first worker to get here wins; the others read its key back
+                writer.run(_store_secret, secrets.token_hex(32))
+                with storage.get_storage().connection() as conn:
+                    row = conn.execute("SELECT value FROM session_keys WHERE name = 'signing'").fetchone()
+                _secret = row[0].encode()
+        return _secret
+
+
+def _sign(session_id):
+    digest = hmac.new(_signing_key(), session_id.encode(), hashlib.sha256).digest()
+    return base64.urlsafe_b64encode(digest[:18]).decode()
+
+
+def _session_id(token):
+    """Session id from a token, or None if it is malformed or the signature is wrong"""
+    if not is_token(token):
+        return None
+    session_id, _, signature = token.partition('.')
+    if not hmac.compare_digest(signature, _sign(session_id)):
+        return None
+    return session_id
+
+
+def is_token(token):
+    """Whether token has the shape of a session token (safe to put in a script)"""
+    return isinstance(token, str) and TOKEN_PATTERN.fullmatch(token) is not None
+
+
+def public_profile(user):
+    """User dict without the fields that must not be cached"""
+    return {key: value for key, value in dict(user).items() if key not in PRIVATE_FIELDS}
+
+
+def create_session(user, ttl_hours=None):
+    """Start a session for an authenticated user and return its signed token"""
+    now = time.time()
+    ttl = (ttl_hours or SESSION_TTL_HOURS) * 3600
+    session_id = secrets.token_urlsafe(24)
+    writer.run(_insert_session, session_id, user['id'], now, now + ttl)
+    return f"{session_id}.{_sign(session_id)}"
+
+
+def resolve(token):
+    """Current user row (without password) for a valid, unexpired token, else None"""
+    session_id = _session_id(token)
+    if session_id is None:
+        return None
+    with storage.get_storage().connection() as conn:
+        # Roles and departments can change under a session, so the user row is always read
+        row = conn.execute('''
+            SELECT s.expires_at AS session_expires_at, u.* FROM sessions s
+            JOIN users u ON u.id = s.user_id WHERE s.session_id = ?
+        ''', (session_id,)).fetchone()
+    now = time.time()
+    if row is None or row['session_expires_at'] <= now:
+        return None
+    user = public_profile(row)
+    expires_at = user.pop('session_expires_at')
+    # Sliding expiry, written at most once per half TTL
+    ttl = SESSION_TTL_HOURS * 3600
+    if expires_at - now < ttl / 2:
+        writer.get_writer().submit(_extend_session, session_id, now + ttl)
+    return user
+
+
+def revoke(token):
+    """End the session behind a token (logout)"""
+    session_id = _session_id(token)
+    if session_id is not None:
+        writer.run(_delete_session, session_id)
+
+
+def revoke_user(user_id):
+    """End every session of a user"""
+    return writer.run(delete_user_sessions, user_id)
+
+
+def purge_expired():
+    """Delete expired sessions and return how many were removed"""
+    return writer.run(_delete_expired, time.time())
+
+
+def start_purger(interval_minutes=None):
+    """Purge expired sessions every interval_minutes on a daemon thread"""
+    interval = (interval_minutes or SESSION_PURGE_MINUTES) * 60
+
+    def loop():
+        while True:
+            time.sleep(interval)
+            try:
+                purge_expired()
+            except Exception as e:
+                print(f"⚠ Session purge failed: {e}")
+
+    thread = threading.Thread(target=loop, name='epr-session-purge', daemon=True)
+    thread.start()
+    return thread
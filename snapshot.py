@@ -0,0 +1,200 @@
+# -*- coding: utf-8 -*-
+"""
+Read-only analytics snapshots for EPR System
+
+Exports users, evaluations, evaluation_details and competency_evaluations to
+uncompressed Arrow IPC files so heavy admin reports and analytics can run on
+memory-mapped columnar data instead of holding read locks on the live
+database. Rows are read through the configured storage backend and
+archive.history_tables(), so archived years are in the snapshot just as they
+are in the live views.
+
+Loaded tables are pyarrow Tables whose buffers point into the mapped files
+(no copy, pages are shared by every session and process). Readers filter and
+select with to_frame() and only the rows and columns they need become pandas
+memory.
+
+Layout:
+    snapshots/<YYYYMMDD_HHMMSS_ffffff>/<table>.arrow
+    snapshots/LATEST            # name of the newest complete snapshot
+
+Usage:
+    python snapshot.py export   # take a snapshot now
+    python snapshot.py info     # show the latest snapshot
+"""
+import os
+import sys
+import shutil
+import threading
+import time
+from datetime import datetime
+
+import pandas as pd
+import pyarrow as pa
+import pyarrow.compute as pc
+import pyarrow.feather as feather
+
+import archive
+import storage
+
+SNAPSHOT_DIR = os.environ.get('EPR_SNAPSHOT_DIR', 'snapshots')
+SNAPSHOT_KEEP = int(os.environ.get('EPR_SNAPSHOT_KEEP', 5))
+
+# Tables exported per snapshot; password hashes are never copied out
+SNAPSHOT_TABLES = {
+    'users': "SELECT id, code, fullname, username, email, department, role_type, area, "
+             "report_to, emp_type, is_manager, created_at, updated_at FROM users",
+    'evaluations': "SELECT * FROM {evaluations} e",
+    'evaluation_details': "SELECT * FROM {evaluation_details} d",
+    'competency_evaluations': "SELECT * FROM {competency_evaluations} c",
+}
+
+_cache_lock = threading.Lock()
+_cache = {}
+
+
+def export_snapshot(db_path=None, snapshot_dir=None, keep=None):
+    """Dump the snapshot tables to Parquet and publish them as LATEST"""
+    snapshot_dir = snapshot_dir or SNAPSHOT_DIR
+    name = datetime.now().strftime('%Y%m%d_%H%M%S_%f')
+    target = os.path.join(snapshot_dir, name)
+    tmp = target + '.tmp'
+    os.makedirs(tmp, exist_ok=True)
+
+    # An explicit path targets that SQLite file, otherwise the configured backend
+    backend = storage.SQLiteStorage(db_path) if db_path else storage.get_storage()
+    with backend.connection() as conn:
+        # Live and archived rows, as the history views read them (ATTACH must
+        # happen outside the read transaction)
+        sources = archive.history_tables(conn)
+        # Older databases may not have the is_manager column yet
+        cursor = conn.cursor()
+        cursor.execute("SELECT * FROM users WHERE 1 = 0")
+        user_columns = {column[0] for column in cursor.description}
+        conn.commit()
+        # One read transaction so all tables come from the same point in time;
+        # it is released as soon as the rows are in memory
+        conn.execute(backend.begin_read_sql)
+        frames = {}
+        for table, query in SNAPSHOT_TABLES.items():
+            if table == 'users' and 'is_manager' not in user_columns:
+                query = query.replace("is_manager, ", "")
+            frames[table] = pd.read_sql_query(query.format(**sources), conn)
+        conn.commit()
+
+    for table, df in frames.items():
+        # Uncompressed so readers can map the columns without decoding them
+        feather.write_feather(df.reset_index(drop=True), os.path.join(tmp, f"{table}.arrow"),
+                              compression='uncompressed')
+    os.replace(tmp, target)
+
+    # Publish atomically so readers never see a half-written snapshot
+    latest_tmp = os.path.join(snapshot_dir, 'LATEST.tmp')
+    with open(latest_tmp, 'w') as f:
+        f.write(name)
+    os.replace(latest_tmp, os.path.join(snapshot_dir, 'LATEST'))
+
+    _rotate(snapshot_dir, keep if keep is not None else SNAPSHOT_KEEP)
+    return target
+
+
+def _rotate(snapshot_dir, keep):
+    """Delete all but the newest `keep` snapshots"""
+    names = sorted(d for d in os.listdir(snapshot_dir)
+                   if os.path.isdir(os.path.join(snapshot_dir, d)) and not d.endswith('.tmp'))
+    for name in names[:-keep] if keep > 0 else []:
+        shutil.rmtree(os.path.join(snapshot_dir, name), ignore_errors=True)
+
+
+def latest_snapshot(snapshot_dir=None):
+    """Return (name, path) of the newest snapshot or None"""
+    snapshot_dir = snapshot_dir or SNAPSHOT_DIR
+    try:
+        with open(os.path.join(snapshot_dir, 'LATEST')) as f:
+            name = f.read().strip()
+    except FileNotFoundError:
+        return None
+    path = os.path.join(snapshot_dir, name)
+    return (name, path) if os.path.isdir(path) else None
+
+
+def _table_path(path, table):
+    return os.path.join(path, f"{table}.arrow")
+
+
+def load_snapshot(snapshot_dir=None):
+    """Map the latest snapshot as {table: pyarrow.Table} (zero-copy), or None
+
+    Tables are cached per snapshot name, so every session shares one mapping.
+    """
+    latest = latest_snapshot(snapshot_dir)
+    if latest is None:
+        return None
+    name, path = latest
+    with _cache_lock:
+        if _cache.get('name') == name:
+            return _cache['tables']
+    if not all(os.path.exists(_table_path(path, table)) for table in SNAPSHOT_TABLES):
+        # Written by an older version (Parquet); the next export replaces it
+        return None
+    tables = {
+        table: pa.ipc.open_file(pa.memory_map(_table_path(path, table))).read_all()
+        for table in SNAPSHOT_TABLES
+    }
+    with _cache_lock:
+        _cache.clear()
+        _cache.update(name=name, tables=tables)
+    return tables
+
+
+def to_frame(table, columns=None, **equal):
+    """pandas copy of only the given columns of the rows where column == value"""
+    for column, value in equal.items():
+        table = table.filter(pc.equal(table[column], value))
+    if columns is not None:
+        table = table.select(columns)
+    return table.to_pandas()
+
+
+def distinct(table, column):
+    """Sorted distinct non-null values of one column"""
+    return sorted(value for value in pc.unique(table[column]).to_pylist() if value is not None)
+
+
+def snapshot_time(name):
+    """Parse a snapshot name back into a datetime"""
+    return datetime.strptime(name, '%Y%m%d_%H%M%S_%f')
+
+
+def start_scheduler(interval_minutes, db_path=None, snapshot_dir=None):
+    """Take a snapshot every interval_minutes on a daemon thread"""
+    def loop():
+        while True:
+            try:
+                export_snapshot(db_path, snapshot_dir)
+            except Exception as e:
+                print(f"⚠ Snapshot failed: {e}")
+            time.sleep(interval_minutes * 60)
+
+    thread = threading.Thread(target=loop, name='epr-snapshot', daemon=True)
+    thread.start()
+    return thread
+
+
+if __name__ == "__main__":
+    command = sys.argv[1] if len(sys.argv) > 1 else 'export'
+    if command == 'export':
+        print(f"Snapshot written to {export_snapshot()}")
+    elif command == 'info':
+        latest = latest_snapshot()
+        if latest is None:
+            print("No snapshot yet")
+        else:
+            name, path = latest
+            for table in SNAPSHOT_TABLES:
+                with pa.memory_map(_table_path(path, table)) as source:
+                    rows = pa.ipc.open_file(source).read_all().num_rows
+                print(f"{name}  {table:<24}{rows:>8} rows")
+    else:
+        print(__doc__)
+        sys.exit(1)
@@ -0,0 +1,257 @@
+# -*- coding: utf-8 -*-
+"""
+Concurrent-submission stress harness for EPR System
+
+Replays the write sequences the app performs (employee submission: evaluation
+INSERT + per-criterion + per-competency INSERTs; manager review UPDATE) from
+many threads in many processes against a scratch copy of the database.
+
+Usage:
+    python stress.py --processes 4 --threads 8 --ops 20
+    python stress.py --mode queue --journal wal --review-ratio 0.3
+
+Modes:
+    direct  one connection per operation, like the app before the write queue
+    queue   one writer.WriteQueue per process (what the app does now)
+"""
+import argparse
+import multiprocessing
+import os
+import random
+import sqlite3
+import tempfile
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
+
+import database
+import writer
+
+
+def scratch_copy(db_path, journal_mode=None):
+    """Copy db_path with the backup API into a temporary file ready for writes"""
+    fd, path = tempfile.mkstemp(suffix='.db', prefix='epr_stress_')
+    os.close(fd)
+    src = sqlite3.connect(db_path)
+    dst = sqlite3.connect(path)
+    src.backup(dst)
+    dst.close()
+    src.close()
+    conn = database.get_connection(path)
+    database.ensure_schema(conn)
+    if journal_mode:
+        conn.execute(f"PRAGMA journal_mode = {journal_mode}")
+    conn.close()
+    return path
+
+
+def remove_scratch(path):
+    """Delete a scratch database and its side files"""
+    for suffix in ('', '-wal', '-shm', '-journal'):
+        if os.path.exists(path + suffix):
+            os.remove(path + suffix)
+
+
+def load_workload(db_path):
+    """Users with their department's criteria, plus the competency list"""
+    conn = database.get_connection(db_path)
+    criteria = {}
+    for row in conn.execute("SELECT id, department FROM evaluation_criteria"):
+        criteria.setdefault(row['department'], []).append(row['id'])
+    users = [(row['id'], criteria[row['department']]) for row in conn.execute(
+        "SELECT id, department FROM users WHERE role_type != 'admin'")
+        if row['department'] in criteria]
+    competencies = [row[0] for row in conn.execute("SELECT id FROM competencies")]
+    conn.close()
+    return users, competencies
+
+
+def _submission(user, competencies, rng):
+    """Arguments for writer.submit_evaluation as an employee form would send them"""
+    user_id, criteria = user
+    scores = {cid: float(rng.randint(60, 150)) for cid in criteria}
+    levels = {cid: rng.randint(1, 5) for cid in competencies}
+    return (user_id, 2099, sum(scores.values()) / max(len(scores), 1),
+            'stress comment', 'stress development areas',
+            scores, {cid: 'evidence ' * 5 for cid in criteria},
+            levels, {cid: 'example ' * 5 for cid in competencies})
+
+
+def _is_busy(error):
+    return isinstance(error, sqlite3.OperationalError) and (
+        'locked' in str(error) or 'busy' in str(error))
+
+
+def _connect(path, busy_timeout, journal):
+    """Connection in the run's journal mode (DELETE/TRUNCATE are per connection)"""
+    conn = sqlite3.connect(path, timeout=busy_timeout)
+    conn.execute(f"PRAGMA journal_mode = {journal}")
+    return conn
+
+
+def _direct(path, busy_timeout, journal, fn, args, max_retries, count):
+    """Run one write transaction on a fresh connection, retrying lock errors"""
+    for attempt in range(max_retries + 1):
+        conn = _connect(path, busy_timeout, journal)
+        try:
+            result = fn(conn, *args)
+            conn.commit()
+            return result
+        except sqlite3.OperationalError as e:
+            conn.rollback()
+            if not _is_busy(e) or attempt == max_retries:
+                raise
+            count('retries')
+            time.sleep(0.001 * 2 ** min(attempt, 6))
+        finally:
+            conn.close()
+
+
+def run_process(config):
+    """One worker process: a thread pool replaying submissions and reviews"""
+    users, competencies = load_workload(config['path'])
+    # The mode SQLite actually switches to; it can refuse (e.g. leaving WAL while others are open)
+    probe = _connect(config['path'], config['busy_timeout'], config['journal'])
+    journal_used = probe.execute("PRAGMA journal_mode").fetchone()[0]
+    probe.close()
+    queue_writer = (writer.WriteQueue(config['path'], journal_mode=config['journal'])
+                    if config['mode'] == 'queue' else None)
+    counters = {'retries': 0, 'busy_errors': 0, 'other_errors': 0,
+                'submissions': 0, 'reviews': 0}
+    latencies = []
+    submitted = []
+    lock = threading.Lock()
+
+    def count(key):
+        with lock:
+            counters[key] += 1
+
+    def apply(fn, args):
+        if queue_writer:
+            return queue_writer.run(fn, *args)
+        return _direct(config['path'], config['busy_timeout'], config['journal'], fn, args,
+                       config['max_retries'], count)
+
+    def worker(worker_id):
+        local_rng = random.Random(config['seed'] * 1000 + worker_id)
+        for _ in range(config['ops']):
+            review = submitted and local_rng.random() < config['review_ratio']
+            if review:
+                fn, args = writer.save_manager_review, (
+                    local_rng.choice(submitted), 100.0, local_rng.randint(50, 100), 'stress review')
+            else:
+                fn, args = writer.submit_evaluation, _submission(
+                    local_rng.choice(users), competencies, local_rng)
+            start = time.perf_counter()
+            try:
+                result = apply(fn, args)
+            except Exception as e:
+                count('busy_errors' if _is_busy(e) else 'other_errors')
+                continue
+            latencies.append(time.perf_counter() - start)
+            if review:
+                count('reviews')
+            else:
+                count('submissions')
+                submitted.append(result)
+
+    with ThreadPoolExecutor(max_workers=config['threads']) as pool:
+        list(pool.map(worker, range(config['threads'])))
+    if queue_writer:
+        queue_writer.close()
+        counters['commits'] = queue_writer.stats['commits']
+    return counters, latencies, journal_used
+
+
+def _percentile(sorted_values, q):
+    if not sorted_values:
+        return 0.0
+    index = min(len(sorted_values) - 1, int(round(q * (len(sorted_values) - 1))))
+    return sorted_values[index]
+
+
+def run_stress(db_path, mode='direct', processes=2, threads=8, ops=20, review_ratio=0.2,
+               journal=None, busy_timeout=5.0, max_retries=5, keep=False):
+    """Run the workload and return a summary dict"""
+    path = scratch_copy(db_path, journal)
+    if not journal:
+        # As in the source: the copy's mode, which every connection then keeps
+        conn = sqlite3.connect(path)
+        journal = conn.execute("PRAGMA journal_mode").fetchone()[0]
+        conn.close()
+    configs = [{'path': path, 'mode': mode, 'journal': journal, 'threads': threads, 'ops': ops,
+                'review_ratio': review_ratio, 'busy_timeout': busy_timeout,
+                'max_retries': max_retries, 'seed': seed + 1}
+               for seed in range(processes)]
+    start = time.perf_counter()
+    if processes == 1:
+        outputs = [run_process(configs[0])]
+    else:
+        with multiprocessing.get_context('spawn').Pool(processes) as pool:
+            outputs = pool.map(run_process, configs)
+    elapsed = time.perf_counter() - start
+
+    totals = {}
+    latencies = []
+    journals_used = set()
+    for counters, lat, journal_used in outputs:
+        for key, value in counters.items():
+            totals[key] = totals.get(key, 0) + value
+        latencies.extend(lat)
+        journals_used.add(journal_used)
+    latencies.sort()
+
+    if keep:
+        print(f"Scratch database kept at {path}")
+    else:
+        remove_scratch(path)
+
+    done = totals.get('submissions', 0) + totals.get('reviews', 0)
+    return dict(totals, mode=mode, journal=','.join(sorted(journals_used)), journal_requested=journal.lower(),
+                processes=processes, threads=threads,
+                elapsed=elapsed, throughput=done / elapsed if elapsed else 0.0,
+                p50_ms=_percentile(latencies, 0.50) * 1000,
+                p99_ms=_percentile(latencies, 0.99) * 1000)
+
+
+def print_summary(summary):
+    print(f"mode={summary['mode']} journal={summary['journal']} "
+          f"processes={summary['processes']} threads/process={summary['threads']}")
+    if summary['journal'] != summary['journal_requested']:
+        print(f"⚠ journal={summary['journal_requested']} was requested but SQLite ran with {summary['journal']}")
+    print(f"  submissions   {summary.get('submissions', 0):>8}")
+    print(f"  reviews       {summary.get('reviews', 0):>8}")
+    print(f"  throughput    {summary['throughput']:>8.1f} tx/s")
+    print(f"  latency p50   {summary['p50_ms']:>8.1f} ms")
+    print(f"  latency p99   {summary['p99_ms']:>8.1f} ms")
+    print(f"  lock retries  {summary.get('retries', 0):>8}")
+    print(f"  busy errors   {summary.get('busy_errors', 0):>8}")
+    print(f"  other errors  {summary.get('other_errors', 0):>8}")
+    if 'commits' in summary:
+        print(f"  group commits {summary['commits']:>8}")
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Concurrent-submission stress harness")
+    parser.add_argument('--db', default=database.DB_PATH, help="source database (copied, never modified)")
+    parser.add_argument('--mode', choices=['direct', 'queue'], default='direct')
+    parser.add_argument('--processes', type=int, default=2)
+    parser.add_argument('--threads', type=int, default=8, help="threads per process")
+    parser.add_argument('--ops', type=int, default=20, help="operations per thread")
+    parser.add_argument('--review-ratio', type=float, default=0.2,
+                        help="share of operations that are manager reviews")
+    parser.add_argument('--journal', choices=['delete', 'wal', 'truncate'], default=None,
+                        help="journal mode of the scratch copy (default: as in the source)")
+    parser.add_argument('--busy-timeout', type=float, default=5.0)
+    parser.add_argument('--max-retries', type=int, default=5,
+                        help="lock retries per operation in direct mode")
+    parser.add_argument('--keep', action='store_true', help="keep the scratch database")
+    args = parser.parse_args()
+
+    print_summary(run_stress(args.db, args.mode, args.processes, args.threads, args.ops,
+                             args.review_ratio, args.journal, args.busy_timeout,
+                             args.max_retries, args.keep))
+
+
+if __name__ == "__main__":
+    main()
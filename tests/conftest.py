@@ -0,0 +1,57 @@
+# -*- coding: utf-8 -*-
+"""
+Shared test fixtures for EPR System
+
+Settings are read from EPR_* variables at import time, so they are set here,
+before any app module is imported: a scratch database instead of
+epr_system.db, a cheap scrypt work factor and a fixed session secret.
+"""
+import os
+import sqlite3
+import tempfile
+
+import pytest
+
+SCRATCH_DIR = tempfile.mkdtemp(prefix='epr-tests-')
+os.environ['EPR_DB_PATH'] = os.path.join(SCRATCH_DIR, 'epr_system.db')
+os.environ['EPR_SCRYPT_N'] = '1024'
+os.environ['EPR_SESSION_SECRET'] = 'test-secret'
+os.environ.pop('EPR_DATABASE_URL', None)
+
+
+@pytest.fixture(scope='session')
+def epr_db():
+    """Path of the scratch database, created once with the seed data"""
+    import database
+    database.init_database()
+    return database.DB_PATH
+
+
+@pytest.fixture
+def conn(epr_db):
+    """Connection to the scratch database"""
+    import database
+    connection = database.get_connection(epr_db)
+    yield connection
+    connection.close()
+
+
+@pytest.fixture
+def memory_conn():
+    """Empty in-memory SQLite database returning sqlite3.Row rows"""
+    connection = sqlite3.connect(':memory:')
+    connection.row_factory = sqlite3.Row
+    yield connection
+    connection.close()
+
+
+@pytest.fixture
+def scratch_conn(epr_db, tmp_path):
+    """Connection to a private copy of the scratch database, for tests that write"""
+    import database
+    source = database.get_connection(epr_db)
+    connection = database.get_connection(str(tmp_path / 'copy.db'))
+    source.backup(connection)
+    source.close()
+    yield connection
+    connection.close()
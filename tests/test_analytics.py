@@ -0,0 +1,80 @@
+# -*- coding: utf-8 -*-
+import analytics
+
+
+def _rollups(conn):
+    ratings = conn.execute(
+        "SELECT year, dimension, dim_key, rating, evaluations, ROUND(score_sum, 6) FROM rollup_ratings "
+        "ORDER BY 1, 2, 3, 4").fetchall()
+    competencies = conn.execute(
+        "SELECT year, department, competency_id, evaluations, ROUND(level_sum, 6) FROM rollup_competencies "
+        "ORDER BY 1, 2, 3").fetchall()
+    return [tuple(row) for row in ratings], [tuple(row) for row in competencies]
+
+
+def _add_evaluation(conn, user_id, year, employee_score, levels):
+    cursor = conn.execute(
+        "INSERT INTO evaluations (user_id, year, status, employee_score) VALUES (?, ?, 'submitted', ?)",
+        (user_id, year, employee_score))
+    for competency_id, level in levels.items():
+        conn.execute(
+            "INSERT INTO competency_evaluations (evaluation_id, competency_id, employee_level) VALUES (?, ?, ?)",
+            (cursor.lastrowid, competency_id, level))
+    return cursor.lastrowid
+
+
+def test_triggers_match_a_rebuild(scratch_conn):
+    conn = scratch_conn
+    users = [row[0] for row in conn.execute("SELECT id FROM users ORDER BY id")]
+    competencies = [row[0] for row in conn.execute("SELECT id FROM competencies ORDER BY id")]
+    first = _add_evaluation(conn, users[-1], 2024, 85, {competencies[0]: 3, competencies[1]: 4})
+    second = _add_evaluation(conn, users[-1], 2025, 125, {competencies[0]: 5})
+    _add_evaluation(conn, users[0], 2025, 60, {competencies[1]: 2})
+    conn.execute("UPDATE evaluations SET final_score = 140 WHERE id = ?", (first,))
+    conn.execute("UPDATE competency_evaluations SET manager_level = 1 WHERE evaluation_id = ?", (first,))
+    conn.execute("DELETE FROM competency_evaluations WHERE evaluation_id = ?", (second,))
+    conn.execute("DELETE FROM evaluations WHERE id = ?", (second,))
+    conn.commit()
+
+    incremental = _rollups(conn)
+    analytics.rebuild_rollups(conn)
+    assert incremental == _rollups(conn)
+
+
+def test_trend_queries(scratch_conn):
+    conn = scratch_conn
+    analytics.rebuild_rollups(conn)
+    user_id = conn.execute("SELECT id FROM users WHERE username = 'employee'").fetchone()[0]
+    _add_evaluation(conn, user_id, 2023, 100, {})
+    _add_evaluation(conn, user_id, 2023, 80, {})
+    conn.commit()
+
+    assert 2023 in analytics.available_years(conn)
+    trend = {(row['year'], row['dim_key']): row for row in analytics.average_score_trend(conn, 'department')}
+    assert trend[(2023, 'Sales')]['evaluations'] == 2
+    assert trend[(2023, 'Sales')]['avg_score'] == 90
+    ratings = {row['rating']: row['evaluations'] for row in analytics.rating_distribution(conn, 'manager', 'MGR001')
+               if row['year'] == 2023}
+    assert ratings == {'A': 1, 'B': 1}
+
+
+def test_moving_a_user_moves_their_rollups(scratch_conn):
+    conn = scratch_conn
+    user_id = conn.execute("SELECT id FROM users WHERE username = 'employee'").fetchone()[0]
+    competency_id = conn.execute("SELECT MIN(id) FROM competencies").fetchone()[0]
+    evaluation_id = _add_evaluation(conn, user_id, 2024, 95, {competency_id: 4})
+    _add_evaluation(conn, user_id, 2025, 130, {competency_id: 2})
+    conn.commit()
+
+    conn.execute("UPDATE users SET department = 'Marketing', report_to = 'MGR999' WHERE id = ?", (user_id,))
+    conn.execute("UPDATE users SET report_to = NULL WHERE id = ?", (user_id,))
+    conn.execute("UPDATE evaluations SET final_score = 70 WHERE id = ?", (evaluation_id,))
+    conn.execute("UPDATE competency_evaluations SET final_level = 5 WHERE evaluation_id = ?", (evaluation_id,))
+    conn.execute("DELETE FROM competency_evaluations WHERE evaluation_id = ?", (evaluation_id,))
+    conn.execute("DELETE FROM evaluations WHERE id = ?", (evaluation_id,))
+    conn.commit()
+
+    incremental = _rollups(conn)
+    assert all(row[4] > 0 for row in incremental[0]) and all(row[3] > 0 for row in incremental[1])
+    analytics.rebuild_rollups(conn)
+    assert incremental == _rollups(conn)
@@ -0,0 +1,66 @@
+# -*- coding: utf-8 -*-
+import pytest
+
+import api
+import archive
+
+
+@pytest.mark.parametrize('items, index, error', [
+    ([{'code': 'X1', 'fullname': 'A', 'username': 'a', 'role_type': 'employee', 'password': 'p'}, 'X2'],
+     1, "item must be a JSON object"),
+    ([{'code': ['X1']}], 0, "wrong type for code"),
+    ([{'code': {'a': 1}}], 0, "wrong type for code"),
+    ([{'code': 7}], 0, "wrong type for code"),
+    ([{'code': 'X1', 'department': 12}], 0, "wrong type for department"),
+    ([{'code': 'X1', 'is_manager': 'yes'}], 0, "wrong type for is_manager"),
+    ([{'fullname': 'No code'}], 0, "missing 'code'"),
+])
+def test_bulk_users_rejects_bad_items(conn, items, index, error):
+    with pytest.raises(api.ApiError) as raised:
+        api.bulk_users(conn, items)
+    assert raised.value.status == 400
+    assert {'index': index, 'error': error} in raised.value.details
+
+
+@pytest.mark.parametrize('item, error', [
+    (['Sales', 'KRA', 10], "item must be a JSON object"),
+    ({'department': ['Sales'], 'kra_name': 'KRA', 'category': 'KPI', 'weight': 10}, "wrong type for department"),
+    ({'department': 'Sales', 'kra_name': 'KRA', 'category': 'KPI', 'weight': True}, "wrong type for weight"),
+    ({'department': 'Sales', 'kra_name': 'KRA', 'category': 'KPI', 'weight': '10'}, "wrong type for weight"),
+    ({'department': 'Sales', 'kra_name': 'KRA', 'category': 'KPI', 'weight': 0},
+     "needs department, kra_name, category and a positive weight"),
+])
+def test_bulk_criteria_rejects_bad_items(conn, item, error):
+    with pytest.raises(api.ApiError) as raised:
+        api.bulk_criteria(conn, [item])
+    assert raised.value.status == 400
+    assert raised.value.details == [{'index': 0, 'error': error}]
+
+
+def test_evaluations_include_archived_years(scratch_conn, tmp_path, monkeypatch):
+    conn = scratch_conn
+    monkeypatch.setattr(archive, 'ARCHIVE_DIR', str(tmp_path / 'archive'))
+    user_id = conn.execute("SELECT id FROM users WHERE username = 'employee'").fetchone()[0]
+    for year, score in ((2020, 90), (2020, 95), (2024, 110)):
+        conn.execute("INSERT INTO evaluations (user_id, year, employee_score, final_score) VALUES (?, ?, ?, ?)",
+                     (user_id, year, score, score))
+    conn.commit()
+    db_path = conn.execute("PRAGMA database_list").fetchone()[2]
+    archive.archive_year(2020, db_path)
+
+    page = api.list_evaluations(conn, {'limit': ['2']})
+    assert [(item['year'], item['archived']) for item in page['items']] == [(2020, True), (2020, True)]
+    page = api.list_evaluations(conn, {'after': [str(page['next_after'])]})
+    assert [(item['year'], item['archived'], item['rating']) for item in page['items']] == [(2024, False, 'A')]
+    assert page['next_after'] is None
+    assert len(api.list_evaluations(conn, {'year': ['2020']})['items']) == 2
+
+
+def test_bulk_criteria_checks_department_totals(conn):
+    kra = {'department': 'Sales', 'kra_name': 'KRA ngoài danh mục', 'category': 'KPI', 'weight': 10}
+    with pytest.raises(api.ApiError) as raised:
+        api.bulk_criteria(conn, [kra])
+    assert raised.value.status == 400
+    assert raised.value.details[0]['error'].startswith("[Sales] tổng trọng số đổi từ")
+    assert conn.execute("SELECT COUNT(*) FROM evaluation_criteria WHERE kra_name = ?",
+                        (kra['kra_name'],)).fetchone()[0] == 0
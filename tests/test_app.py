@@ -0,0 +1,80 @@
+# -*- coding: utf-8 -*-
+"""AppTest smoke tests of the Streamlit pages"""
+import os
+
+import pytest
+from streamlit.testing.v1 import AppTest
+
+import session_memory
+from scoring import LEVEL_PERCENTAGES, REVIEW_YEAR
+
+APP = os.path.join(os.path.dirname(os.path.dirname(os.path.abspath(__file__))), 'app.py')
+
+
+def logged_in_app(conn, username):
+    at = AppTest.from_file(APP, default_timeout=60)
+    at.session_state.logged_in = True
+    at.session_state.user = dict(conn.execute("SELECT * FROM users WHERE username = ?", (username,)).fetchone())
+    return at
+
+
+def inputs(at, prefix):
+    return [widget for widget in at.number_input if widget.key and widget.key.startswith(prefix)]
+
+
+def test_employee_submit(conn):
+    at = logged_in_app(conn, 'employee')
+    at.run()
+    assert not at.exception
+
+    kras = inputs(at, 'score_')
+    levels = inputs(at, 'comp_')
+    assert kras and levels
+    kras[0].set_value(80.0)
+    levels[0].set_value(5)
+    at.run()
+    assert not at.exception
+
+    at.button(key='FormSubmitter:employee_evaluation-📤 Nộp hồ sơ').click()
+    at.run()
+    assert not at.exception
+    assert any('lưu thành công' in message.value for message in at.success)
+
+    user_id = at.session_state.user['id']
+    evaluation = conn.execute("SELECT * FROM evaluations WHERE user_id = ? AND year = ? ORDER BY id DESC",
+                              (user_id, REVIEW_YEAR)).fetchone()
+    assert evaluation['status'] == 'submitted'
+    weights = {row['id']: row['weight'] for row in conn.execute(
+        "SELECT id, weight FROM evaluation_criteria WHERE department = 'Sales'")}
+    kra_id = int(kras[0].key.split('_')[1])
+    kpi_result = (sum(weights.values()) * 100 - weights[kra_id] * 20) / sum(weights.values())
+    comp_count = len(levels)
+    comp_result = (LEVEL_PERCENTAGES[5] + LEVEL_PERCENTAGES[3] * (comp_count - 1)) / comp_count
+    assert evaluation['employee_score'] == pytest.approx(kpi_result * 0.9 + comp_result * 0.1)
+    details = conn.execute("SELECT criterion_id, employee_score FROM evaluation_details WHERE evaluation_id = ?",
+                           (evaluation['id'],)).fetchall()
+    assert dict((row[0], row[1]) for row in details)[kra_id] == 80
+
+
+def test_score_edits_survive_state_eviction(conn, monkeypatch):
+    # Every run ends over the threshold, so the governor evicts the score accumulator
+    monkeypatch.setattr(session_memory, 'WARN_SESSION_BYTES', 1)
+    at = logged_in_app(conn, 'employee')
+    at.run()
+    assert 'score_accumulator' not in at.session_state
+    inputs(at, 'score_')[0].set_value(50.0)
+    at.run()
+    inputs(at, 'comp_')[0].set_value(1)
+    at.run()
+    assert not at.exception
+
+
+@pytest.mark.parametrize('username, captured', [('employee', False), ('admin', True)])
+def test_profile_query_param_is_admin_only(conn, tmp_path, monkeypatch, username, captured):
+    import profiling
+    monkeypatch.setattr(profiling, 'PROFILE_DIR', str(tmp_path))
+    at = logged_in_app(conn, username)
+    at.query_params['profile'] = 'cprofile'
+    at.run()
+    assert not at.exception
+    assert bool(os.listdir(tmp_path)) == captured
@@ -0,0 +1,84 @@
+# -*- coding: utf-8 -*-
+import os
+
+import pytest
+
+import archive
+from scoring import REVIEW_YEAR
+
+YEAR = 2019
+
+
+@pytest.fixture
+def archive_dir(tmp_path, monkeypatch):
+    monkeypatch.setattr(archive, 'ARCHIVE_DIR', str(tmp_path / 'archive'))
+    return tmp_path / 'archive'
+
+
+def year_rows(conn, schema='main'):
+    """Rows of YEAR per table, in a comparable form"""
+    rows = {}
+    for table in archive.TABLES:
+        where = archive.YEAR_FILTERS[table].format(schema=schema)
+        rows[table] = sorted(tuple(row) for row in conn.execute(
+            f"SELECT * FROM {schema}.{table} WHERE {where}", (YEAR,)))
+    return rows
+
+
+def year_rollups(conn):
+    return ([tuple(row) for row in conn.execute(
+                "SELECT * FROM rollup_ratings WHERE year = ? ORDER BY 2, 3, 4", (YEAR,))],
+            [tuple(row) for row in conn.execute(
+                "SELECT * FROM rollup_competencies WHERE year = ? ORDER BY 2, 3", (YEAR,))])
+
+
+def add_year(conn):
+    users = [row[0] for row in conn.execute("SELECT id FROM users WHERE role_type != 'admin' ORDER BY id")]
+    competencies = [row[0] for row in conn.execute("SELECT id FROM competencies ORDER BY id LIMIT 2")]
+    for score, user_id in zip((70, 95, 120), users * 3):
+        evaluation_id = conn.execute(
+            "INSERT INTO evaluations (user_id, year, status, employee_score, final_score) "
+            "VALUES (?, ?, 'manager_reviewed', ?, ?)", (user_id, YEAR, score, score)).lastrowid
+        conn.execute("INSERT INTO evaluation_details (evaluation_id, criterion_id, employee_score) "
+                     "VALUES (?, 1, ?)", (evaluation_id, score))
+        for level, competency_id in enumerate(competencies, 3):
+            conn.execute("INSERT INTO competency_evaluations (evaluation_id, competency_id, final_level) "
+                         "VALUES (?, ?, ?)", (evaluation_id, competency_id, level))
+    conn.commit()
+
+
+def test_archive_and_restore_round_trip(scratch_conn, archive_dir):
+    conn = scratch_conn
+    db_path = conn.execute("PRAGMA database_list").fetchone()[2]
+    add_year(conn)
+    live, rollups = year_rows(conn), year_rollups(conn)
+    assert rollups[0] and rollups[1]
+
+    counts = archive.archive_year(YEAR, db_path)
+    assert counts == {table: len(rows) for table, rows in live.items()}
+    assert archive.archived_years() == [YEAR]
+    assert all(rows == [] for rows in year_rows(conn).values())
+    # Trend reports keep the year; history views read it from the archive
+    assert year_rollups(conn) == rollups
+    history = archive.history_tables(conn)
+    assert tuple(conn.execute(f"SELECT COUNT(*), MIN(archived) FROM {history['evaluations']} WHERE year = ?",
+                              (YEAR,)).fetchone()) == (len(live['evaluations']), 1)
+    assert year_rows(conn, archive.schema_name(YEAR)) == live
+    conn.execute(f"DETACH DATABASE {archive.schema_name(YEAR)}")
+
+    assert archive.restore_year(YEAR, db_path) == counts
+    assert archive.archived_years() == []
+    assert not os.path.exists(archive.archive_path(YEAR))
+    assert year_rows(conn) == live
+    assert year_rollups(conn) == rollups
+
+
+def test_open_empty_and_missing_years_are_refused(scratch_conn, archive_dir):
+    db_path = scratch_conn.execute("PRAGMA database_list").fetchone()[2]
+    with pytest.raises(archive.ArchiveError):
+        archive.archive_year(REVIEW_YEAR, db_path)
+    with pytest.raises(archive.ArchiveError):
+        archive.archive_year(YEAR - 1, db_path)
+    with pytest.raises(archive.ArchiveError):
+        archive.restore_year(YEAR, db_path)
+    assert not archive_dir.exists()
@@ -0,0 +1,67 @@
+# -*- coding: utf-8 -*-
+import gzip
+import os
+import sqlite3
+
+import pytest
+
+import backup
+
+
+@pytest.fixture
+def live_db(scratch_conn):
+    """Path of a private copy of the scratch database"""
+    return scratch_conn.execute("PRAGMA database_list").fetchone()[2]
+
+
+def count_users(path):
+    conn = sqlite3.connect(path)
+    try:
+        return conn.execute("SELECT COUNT(*) FROM users").fetchone()[0]
+    finally:
+        conn.close()
+
+
+def test_backup_is_verified_and_compressed(live_db, tmp_path):
+    target = backup.create_backup(live_db, str(tmp_path / 'backups'))
+    assert target.endswith(backup.BACKUP_SUFFIX)
+    raw = tmp_path / 'raw.db'
+    with gzip.open(target, 'rb') as f:
+        raw.write_bytes(f.read())
+    assert backup.integrity_check(str(raw)) == ['ok']
+    assert count_users(str(raw)) == count_users(live_db)
+    # No staging files are left behind
+    assert os.listdir(tmp_path / 'backups') == [os.path.basename(target)]
+
+
+def test_rotation_keeps_the_newest(live_db, tmp_path):
+    backup_dir = str(tmp_path / 'backups')
+    made = [backup.create_backup(live_db, backup_dir, keep=2) for _ in range(4)]
+    assert backup.list_backups(backup_dir) == made[:1:-1]
+
+
+def test_restore_swaps_in_the_backup_and_keeps_the_old_files(live_db, scratch_conn, tmp_path):
+    target = backup.create_backup(live_db, str(tmp_path / 'backups'))
+    before = count_users(live_db)
+    scratch_conn.execute("DELETE FROM users WHERE role_type = 'employee'")
+    scratch_conn.commit()
+    scratch_conn.close()
+    with open(live_db + '-wal', 'wb') as f:
+        f.write(b'stale')
+
+    backup.restore_backup(target, live_db)
+    assert count_users(live_db) == before
+    assert not os.path.exists(live_db + '-wal')
+    kept = [name for name in os.listdir(os.path.dirname(live_db)) if '.pre-restore-' in name]
+    assert len(kept) == 2
+
+
+def test_corrupt_backup_is_refused(live_db, tmp_path):
+    broken = tmp_path / f"{backup.BACKUP_PREFIX}broken{backup.BACKUP_SUFFIX}"
+    with gzip.open(broken, 'wb') as f:
+        f.write(b'SQLite format 3\x00' + b'\x00' * 4096)
+    before = count_users(live_db)
+    with pytest.raises(backup.BackupError):
+        backup.restore_backup(str(broken), live_db)
+    assert count_users(live_db) == before
+    assert not os.path.exists(live_db + '.restore')
@@ -0,0 +1,53 @@
+# -*- coding: utf-8 -*-
+import cache
+
+
+def load(conn, sql):
+    return lambda: conn.execute(sql).fetchone()[0]
+
+
+def test_commit_from_another_connection_drops_only_its_namespace(scratch_conn):
+    db_path = scratch_conn.execute("PRAGMA database_list").fetchone()[2]
+    store = cache.CoherentCache(db_path)
+    users_sql = "SELECT COUNT(*) FROM users"
+    criteria_sql = "SELECT COUNT(*) FROM evaluation_criteria"
+    users = store.get('users', 'count', load(scratch_conn, users_sql))
+    criteria = store.get('criteria', 'count', load(scratch_conn, criteria_sql))
+    assert store.get('users', 'count', lambda: 'stale') == users
+    assert store.stats == {'hits': 1, 'misses': 2, 'invalidations': 0}
+
+    scratch_conn.execute("UPDATE users SET department = department WHERE username = 'employee'")
+    scratch_conn.commit()
+    # users was bumped by its trigger and reloads; criteria is still served from memory
+    assert store.get('users', 'count', lambda: 'fresh') == 'fresh'
+    assert store.get('criteria', 'count', lambda: 'stale') == criteria
+    assert store.stats['invalidations'] == 1
+
+    # Every table of a namespace bumps it
+    user_id = scratch_conn.execute("SELECT id FROM users WHERE username = 'employee'").fetchone()[0]
+    store.get('evaluations', 'count', lambda: 0)
+    evaluation_id = scratch_conn.execute(
+        "INSERT INTO evaluations (user_id, year) VALUES (?, 2031)", (user_id,)).lastrowid
+    scratch_conn.commit()
+    assert store.get('evaluations', 'count', lambda: 1) == 1
+    scratch_conn.execute("INSERT INTO evaluation_details (evaluation_id, criterion_id, employee_score) "
+                         "VALUES (?, 1, 100)", (evaluation_id,))
+    scratch_conn.commit()
+    assert store.get('evaluations', 'count', lambda: 2) == 2
+    scratch_conn.execute("INSERT INTO competency_evaluations (evaluation_id, competency_id, employee_level) "
+                         "VALUES (?, 1, 3)", (evaluation_id,))
+    scratch_conn.commit()
+    assert store.get('evaluations', 'count', lambda: 3) == 3
+
+def test_value_loaded_across_a_write_is_not_kept(scratch_conn):
+    db_path = scratch_conn.execute("PRAGMA database_list").fetchone()[2]
+    store = cache.CoherentCache(db_path)
+
+    def loader():
+        scratch_conn.execute("UPDATE evaluation_criteria SET weight = weight WHERE id = 1")
+        scratch_conn.commit()
+        return 'old'
+
+    assert store.get('criteria', 'all', loader) == 'old'
+    assert store.get('criteria', 'all', lambda: 'new') == 'new'
+    assert store.get('criteria', 'all', lambda: 'again') == 'new'
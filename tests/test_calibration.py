@@ -0,0 +1,79 @@
+# -*- coding: utf-8 -*-
+import numpy as np
+import pandas as pd
+
+import calibration
+from scoring import RATINGS, rating_for
+
+
+def _frame(scores, departments, employee=None, manager=None):
+    n = len(scores)
+    return calibration._prepare(pd.DataFrame({
+        'evaluation_id': range(1, n + 1),
+        'code': [f"E{i}" for i in range(n)],
+        'fullname': [f"Employee {i}" for i in range(n)],
+        'department': departments,
+        'report_to': [''] * n,
+        'employee_score': employee if employee is not None else scores,
+        'manager_score': manager if manager is not None else [None] * n,
+        'final_score': scores,
+    }))
+
+
+def test_rating_bands_match_rating_for():
+    scores = [0, 79.99, 80, 99.9, 100, 119.99, 120, 134.99, 135, 150, None]
+    expected = [rating_for(score) for score in scores]
+    assert list(calibration.rating_bands([np.nan if s is None else s for s in scores])) == expected
+
+
+def test_prepare_falls_back_to_the_self_assessment():
+    df = calibration._prepare(pd.DataFrame({
+        'employee_score': [90, None, '125'], 'manager_score': [None, None, None],
+        'final_score': [None, None, None]}))
+    assert list(df['score']) == [90, 0, 125]
+    assert list(df['rating']) == ['B', 'C', 'A+']
+
+
+def test_forced_distribution_follows_the_curve():
+    scores = np.linspace(60, 150, 100)
+    forced = calibration.forced_distribution(scores)
+    counts = pd.Series(forced).value_counts()
+    assert {rating: counts.get(rating, 0) for rating in RATINGS} == {'A++': 5, 'A+': 15, 'A': 50, 'B': 20, 'C': 10}
+    # Best scores get the best ratings
+    assert forced[np.argmax(scores)] == 'A++' and forced[np.argmin(scores)] == 'C'
+
+
+def test_forced_distribution_normalises_shares_and_handles_empty():
+    forced = calibration.forced_distribution([100, 90, 80, 70], {'A': 2, 'C': 2})
+    assert list(forced) == ['A', 'A', 'C', 'C']
+    assert len(calibration.forced_distribution([])) == 0
+
+
+def test_percentiles_distribution_and_gaps():
+    df = _frame([100, 110, 90, 130], ['IT', 'IT', 'Sales', 'Sales'],
+                employee=[90, 100, 95, 120], manager=[110, 120, None, 140])
+    table = calibration.percentiles(df)
+    assert table.loc['Toàn công ty', 'N'] == 4
+    assert table.loc['IT', 'P50'] == 105
+    shares = calibration.distribution(df['rating'])
+    assert shares.loc['A', 'count'] == 2 and shares['share'].sum() == 1
+    gaps = calibration.score_gaps(df)
+    assert gaps.loc['IT', 'mean'] == 20 and gaps.loc['Sales', 'count'] == 1
+
+
+def test_simulate_within_groups():
+    df = _frame([100, 80, 130, 70], ['IT', 'IT', 'Sales', 'Sales'])
+    simulated = calibration.simulate(df, {'A': 1, 'C': 1}, by='department')
+    assert list(simulated['forced_rating']) == ['A', 'C', 'A', 'C']
+
+
+def test_load_scores(scratch_conn):
+    conn = scratch_conn
+    user_id = conn.execute("SELECT id FROM users WHERE username = 'employee'").fetchone()[0]
+    conn.execute("INSERT INTO evaluations (user_id, year, employee_score, final_score) VALUES (?, 2030, 90, 121)",
+                 (user_id,))
+    conn.commit()
+    df = calibration.load_scores(conn, 2030)
+    assert list(df['score']) == [121] and list(df['rating']) == ['A+']
+    assert calibration.load_scores(conn, 2030, report_to='nobody').empty
+    assert 2030 in calibration.available_years(conn)
@@ -0,0 +1,131 @@
+# -*- coding: utf-8 -*-
+import io
+
+import pytest
+from openpyxl import Workbook, load_workbook
+
+import catalogue
+
+HEADER = ['Nhóm', 'KRA', 'Mô tả', 'Trọng số', 'Tổng nhóm']
+
+
+def workbook(sheets):
+    """In-memory workbook from {title: rows}"""
+    book = Workbook()
+    book.remove(book.active)
+    for title, rows in sheets.items():
+        sheet = book.create_sheet(title)
+        for row in rows:
+            sheet.append(row)
+    target = io.BytesIO()
+    book.save(target)
+    target.seek(0)
+    return target
+
+
+def test_valid_sheet_uses_title_without_department_cell():
+    criteria, competencies, errors = catalogue.read_workbook(workbook({
+        'Sales': [['Danh mục KRA 2025'], HEADER,
+                  ['Kết quả', 'Doanh số', None, 60, 100],
+                  ['Kết quả', 'Khách hàng mới', 'Mở rộng', '40', 100]],
+        'Năng lực': [['Nhóm', 'Năng lực', 'Mô tả', 'Mức độ quan trọng'],
+                     ['Cốt lõi', 'Giao tiếp', None, 3]],
+    }))
+    assert errors == []
+    assert [(c['department'], c['kra_name'], c['weight']) for c in criteria] == [
+        ('Sales', 'Doanh số', 60.0), ('Sales', 'Khách hàng mới', 40.0)]
+    assert competencies[0]['name'] == 'Giao tiếp'
+    assert competencies[0]['importance_level'] == 3
+
+
+def test_validation_errors_name_sheet_and_row():
+    _, _, errors = catalogue.read_workbook(workbook({
+        'Sales': [HEADER,
+                  ['Kết quả', 'Doanh số', None, 60, 100],
+                  ['Kết quả', None, None, 10, None],
+                  ['Kết quả', 'Hợp đồng', None, 'nhiều', None],
+                  ['Kết quả', 'Doanh số', None, 20, None],
+                  ['Kết quả', 'Dự án', None, 30, 90]],
+        'Trống': [['Nhóm', 'Mô tả']],
+        'Năng lực': [['Năng lực', 'Mức độ quan trọng'], ['Giao tiếp', 0]],
+    }))
+    assert errors == [
+        "[Sales] dòng 3: thiếu KRA hoặc Nhóm",
+        "[Sales] dòng 4: trọng số không hợp lệ ('nhiều')",
+        "[Sales] dòng 5: KRA trùng lặp 'Doanh số'",
+        "[Sales] dòng 6: Tổng nhóm của 'Kết quả' không thống nhất",
+        "[Sales] nhóm 'Kết quả': tổng trọng số 90 khác Tổng nhóm 100",
+        "[Trống] không tìm thấy dòng tiêu đề (cần các cột: Nhóm, KRA, Trọng số)",
+        "[Năng lực] dòng 2: mức độ quan trọng không hợp lệ (0)",
+    ]
+
+
+def test_apply_refuses_workbook_with_errors():
+    with pytest.raises(catalogue.CatalogueError):
+        catalogue.apply_catalogue([], [], errors=['lỗi'])
+
+
+def test_export_roundtrip_keeps_long_and_invalid_department_names(scratch_conn):
+    long_name = 'Phòng Phát triển Kinh doanh Khu vực Miền Bắc và Miền Trung'
+    odd_names = [long_name, long_name + ' 2', 'R&D [HN]: AI/ML?', '_Nội bộ', 'Năng lực']
+    scratch_conn.executemany(
+        "INSERT INTO evaluation_criteria (department, kra_name, description, weight, category) "
+        "VALUES (?, 'Mục tiêu', NULL, 100, 'Kết quả')", [(name,) for name in odd_names])
+    scratch_conn.commit()
+    target = io.BytesIO()
+    catalogue.export_workbook(scratch_conn, target)
+
+    titles = load_workbook(io.BytesIO(target.getvalue()), read_only=True).sheetnames
+    assert all(len(title) <= 31 and not set(title) & set('[]:*?/\\') for title in titles)
+    assert len(titles) == len({title.lower() for title in titles})
+    assert titles.count(catalogue.COMPETENCY_SHEET) == 1
+
+    target.seek(0)
+    criteria, competencies, errors = catalogue.read_workbook(target)
+    assert errors == []
+    assert set(odd_names) <= {c['department'] for c in criteria}
+    assert competencies
+    # Nothing new: every department matched its stored name
+    assert catalogue.diff_catalogue(scratch_conn, criteria, competencies) == []
+
+
+def sales_criteria(conn):
+    return [dict(row, description=None) for row in conn.execute(
+        "SELECT department, kra_name, category, weight FROM evaluation_criteria WHERE department = 'Sales'")]
+
+
+def test_department_total_must_not_change_silently(scratch_conn):
+    criteria = sales_criteria(scratch_conn)
+    assert catalogue.total_errors(scratch_conn, criteria) == []
+    # Reweighting inside the same total is fine
+    criteria[0]['weight'] += 5
+    criteria[1]['weight'] -= 5
+    assert catalogue.total_errors(scratch_conn, criteria) == []
+
+    # A new KRA raises the total, and the KRAs left out of the file still count
+    extra = {'department': 'Sales', 'kra_name': 'KRA mới', 'category': criteria[0]['category'],
+             'weight': 10.0, 'description': None}
+    errors = catalogue.total_errors(scratch_conn, [extra])
+    assert len(errors) == 1 and errors[0].startswith("[Sales] tổng trọng số đổi từ")
+    with pytest.raises(catalogue.CatalogueError):
+        catalogue.apply_catalogue([extra], [])
+
+    # Declaring every category's total confirms the new total
+    rows = criteria + [extra]
+    totals = {}
+    for row in rows:
+        totals[row['category']] = totals.get(row['category'], 0) + row['weight']
+    declared = [dict(row, category_total=totals[row['category']]) for row in rows]
+    assert catalogue.total_errors(scratch_conn, declared) == []
+    declared[0]['category_total'] += 1
+    assert "khác Tổng nhóm" in catalogue.total_errors(scratch_conn, declared)[0]
+
+
+def test_fixed_department_total(scratch_conn, monkeypatch):
+    monkeypatch.setattr(catalogue, 'KRA_TOTAL_WEIGHT', 100.0)
+    new = [{'department': 'Phòng mới', 'kra_name': f'KRA {i}', 'category': 'KPI', 'weight': 30.0,
+            'description': None} for i in range(3)]
+    assert catalogue.total_errors(scratch_conn, new) == [
+        "[Phòng mới] tổng trọng số 90 khác 100 (EPR_KRA_TOTAL_WEIGHT)"]
+    new[0]['weight'] = 40.0
+    assert catalogue.total_errors(scratch_conn, new) == []
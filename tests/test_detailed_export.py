@@ -0,0 +1,68 @@
+# -*- coding: utf-8 -*-
+import io
+
+from openpyxl import load_workbook
+
+import detailed_export
+
+YEAR = 2031
+
+
+def read(conn, **filters):
+    target = io.BytesIO()
+    written = detailed_export.export_workbook(conn, target, **filters)
+    book = load_workbook(io.BytesIO(target.getvalue()), read_only=True)
+    return written, {title: [list(row) for row in book[title].iter_rows(values_only=True)]
+                     for title in book.sheetnames}
+
+
+def evaluate(conn, user_id, status, scores, levels):
+    evaluation_id = conn.execute("INSERT INTO evaluations (user_id, year, status, employee_score) "
+                                 "VALUES (?, ?, ?, 100)", (user_id, YEAR, status)).lastrowid
+    conn.executemany("INSERT INTO evaluation_details (evaluation_id, criterion_id, employee_score) VALUES (?, ?, ?)",
+                     [(evaluation_id, criterion_id, score) for criterion_id, score in scores.items()])
+    conn.executemany("INSERT INTO competency_evaluations (evaluation_id, competency_id, employee_level) "
+                     "VALUES (?, ?, ?)", [(evaluation_id, competency_id, level) for competency_id, level in levels.items()])
+    return evaluation_id
+
+
+def test_pivot_sheets_hold_each_departments_columns(scratch_conn):
+    conn = scratch_conn
+    sales = conn.execute("SELECT id, code, fullname FROM users WHERE username = 'employee'").fetchone()
+    other = conn.execute("INSERT INTO users (code, fullname, username, password, department, role_type) "
+                         "VALUES ('EXP001', 'Export Test', 'exp001', 'x', 'R&D [HN]', 'employee')").lastrowid
+    kras = {row['kra_name']: row['id'] for row in conn.execute(
+        "SELECT id, kra_name FROM evaluation_criteria WHERE department = 'Sales' ORDER BY category, kra_name")}
+    first_kra, second_kra = list(kras.values())[:2]
+    competency = conn.execute("SELECT id, name FROM competencies ORDER BY category, id").fetchone()
+    # Superseded by the second submission of the year
+    evaluate(conn, sales['id'], 'submitted', {first_kra: 10, second_kra: 20}, {competency['id']: 1})
+    evaluate(conn, sales['id'], 'submitted', {first_kra: 90}, {competency['id']: 4})
+    evaluate(conn, other, 'manager_reviewed', {second_kra: 75}, {})
+    conn.commit()
+
+    written, sheets = read(conn, year=YEAR)
+    assert written == 2
+    assert list(sheets) == ['R&D -HN-', 'Sales']
+    labels = [label for _, label in detailed_export.EVALUATION_COLUMNS]
+    names = list(kras)
+
+    header, *rows = sheets['Sales']
+    # Columns and values come from the latest submission only
+    assert header == labels + [f"{names[0]} (%)", f"{competency['name']} (mức)"]
+    assert len(rows) == 1
+    assert rows[0][:5] == [sales['code'], sales['fullname'], 'Sales', YEAR, 'submitted']
+    assert rows[0][len(labels):] == [90, 4]
+
+    header, *rows = sheets['R&D -HN-']
+    assert header == labels + [f"{names[1]} (%)"]
+    assert [row[0] for row in rows] == ['EXP001'] and rows[0][len(labels):] == [75]
+
+    written, sheets = read(conn, year=YEAR, status='manager_reviewed')
+    assert written == 1 and list(sheets) == ['R&D -HN-']
+
+
+def test_no_matching_evaluations_gives_a_placeholder_sheet(scratch_conn):
+    written, sheets = read(scratch_conn, year=YEAR + 1)
+    assert written == 0
+    assert sheets == {'Trống': [['Không có đánh giá phù hợp']]}
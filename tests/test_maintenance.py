@@ -0,0 +1,105 @@
+# -*- coding: utf-8 -*-
+import os
+import sqlite3
+import threading
+import time
+
+import pytest
+
+import maintenance
+
+
+def db_path_of(conn):
+    return conn.execute("PRAGMA database_list").fetchone()[2]
+
+
+def leave_free_pages(conn):
+    conn.execute("CREATE TABLE filler (data BLOB)")
+    conn.executemany("INSERT INTO filler VALUES (zeroblob(4000))", [()] * 200)
+    conn.commit()
+    conn.execute("DROP TABLE filler")
+    conn.commit()
+
+
+def test_run_returns_free_pages_and_analyzes(scratch_conn):
+    db_path = db_path_of(scratch_conn)
+    assert scratch_conn.execute("PRAGMA auto_vacuum").fetchone()[0] == 2
+    leave_free_pages(scratch_conn)
+    scratch_conn.close()
+
+    logged = []
+    report = maintenance.run_maintenance(db_path, log=logged.append)
+    assert report['before']['free_pages'] >= 200
+    assert report['after']['free_pages'] == 0
+    assert report['after']['pages'] <= report['before']['pages'] - 200
+    assert report['after']['wal_bytes'] == 0
+    assert set(maintenance.PLAN_QUERIES) >= set(report['plan_changes'])
+    assert logged[0].startswith(f"Maintenance of {db_path}")
+    conn = sqlite3.connect(db_path)
+    assert conn.execute("SELECT COUNT(*) FROM sqlite_stat1").fetchone()[0] > 0
+    conn.close()
+
+
+def test_without_incremental_vacuum_only_warns(tmp_path):
+    db_path = str(tmp_path / 'plain.db')
+    conn = sqlite3.connect(db_path)
+    leave_free_pages(conn)
+    conn.close()
+
+    logged = []
+    report = maintenance.run_maintenance(db_path, log=logged.append)
+    # ANALYZE may reuse a free page for sqlite_stat1, the rest stay
+    assert report['after']['free_pages'] >= report['before']['free_pages'] - 1 > 0
+    assert any("auto_vacuum is not INCREMENTAL" in line for line in logged)
+    assert maintenance.enable_incremental_vacuum(db_path, log=logged.append)
+    assert maintenance.run_maintenance(db_path, log=logged.append)['after']['free_pages'] == 0
+
+
+def test_damaged_file_stops_maintenance(tmp_path):
+    db_path = str(tmp_path / 'damaged.db')
+    conn = sqlite3.connect(db_path)
+    conn.execute("CREATE TABLE t (id INTEGER PRIMARY KEY, name TEXT)")
+    conn.execute("CREATE INDEX ix_t_name ON t (name)")
+    conn.executemany("INSERT INTO t (name) VALUES (?)", [(f"row {i}" * 20,) for i in range(2000)])
+    conn.commit()
+    conn.execute("PRAGMA journal_mode=DELETE")
+    page_size = conn.execute("PRAGMA page_size").fetchone()[0]
+    pages = conn.execute("PRAGMA page_count").fetchone()[0]
+    conn.close()
+    # Scribble over an interior page, well past the schema on page 1
+    with open(db_path, 'r+b') as f:
+        f.seek(page_size * (pages // 2) + 8)
+        f.write(b'\xff' * (page_size - 16))
+
+    with pytest.raises(maintenance.MaintenanceError, match="quick_check"):
+        maintenance.run_maintenance(db_path, log=lambda line: None)
+    conn = sqlite3.connect(db_path)
+    assert conn.execute("SELECT 1 FROM sqlite_master WHERE name = 'sqlite_stat1'").fetchone() is None
+    conn.close()
+
+
+def test_scheduler_waits_for_an_idle_window(tmp_path, monkeypatch):
+    db_path = str(tmp_path / 'idle.db')
+    sqlite3.connect(db_path).close()
+    runs = threading.Event()
+    monkeypatch.setattr(maintenance, 'POLL_SECONDS', 0.01)
+    monkeypatch.setattr(maintenance, 'run_maintenance', lambda path: runs.set())
+
+    stop = threading.Event()
+    # Just written: never idle for a minute during the test
+    thread = maintenance.start_scheduler(0, db_path, idle_minutes=1, stop=stop)
+    assert not runs.wait(0.3)
+    stop.set()
+    thread.join(1)
+    assert not thread.is_alive()
+
+    # Idle for longer than the window
+    old = time.time() - 120
+    os.utime(db_path, (old, old))
+    stop = threading.Event()
+    thread = maintenance.start_scheduler(0, db_path, idle_minutes=1, stop=stop)
+    try:
+        assert runs.wait(2)
+    finally:
+        stop.set()
+        thread.join(1)
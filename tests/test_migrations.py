@@ -0,0 +1,100 @@
+# -*- coding: utf-8 -*-
+import sqlite3
+
+import pytest
+
+import database
+
+
+@pytest.fixture
+def unmigrated(scratch_conn):
+    """Scratch copy as it was before migration 1: no natural-key indexes, duplicate seed rows"""
+    conn = scratch_conn
+    conn.execute("DROP INDEX ux_criteria_department_kra")
+    conn.execute("DROP INDEX ux_competencies_name")
+    conn.execute("PRAGMA user_version = 0")
+    conn.execute("INSERT INTO evaluation_criteria (department, kra_name, description, weight, category) "
+                 "SELECT department, kra_name, 'copy', weight, category FROM evaluation_criteria")
+    conn.execute("INSERT INTO competencies (name, description) SELECT name, 'copy' FROM competencies")
+    user_id = conn.execute("SELECT id FROM users WHERE username = 'employee'").fetchone()[0]
+    evaluation_id = conn.execute("INSERT INTO evaluations (user_id, year) VALUES (?, 2025)", (user_id,)).lastrowid
+    kra = conn.execute("SELECT MAX(id) FROM evaluation_criteria WHERE kra_name = 'Cập nhật thị trường' "
+                       "AND department = 'Sales'").fetchone()[0]
+    competency = conn.execute("SELECT MAX(id) FROM competencies").fetchone()[0]
+    # One evaluation scored a duplicate KRA; another scored both copies of a competency
+    conn.execute("INSERT INTO evaluation_details (evaluation_id, criterion_id, employee_score) VALUES (?, ?, 95)",
+                 (evaluation_id, kra))
+    original = conn.execute("SELECT MIN(id) FROM competencies WHERE name = "
+                            "(SELECT name FROM competencies WHERE id = ?)", (competency,)).fetchone()[0]
+    for competency_id, level in ((original, 3), (competency, 5)):
+        conn.execute("INSERT INTO competency_evaluations (evaluation_id, competency_id, employee_level) "
+                     "VALUES (?, ?, ?)", (evaluation_id, competency_id, level))
+    conn.commit()
+    return conn, evaluation_id, original
+
+
+def test_dedupe_migration(unmigrated):
+    conn, evaluation_id, original = unmigrated
+    database.migrate(conn)
+
+    assert conn.execute("PRAGMA user_version").fetchone()[0] == len(database.MIGRATIONS)
+    assert conn.execute("SELECT COUNT(*) FROM evaluation_criteria WHERE description = 'copy'").fetchone()[0] == 0
+    assert conn.execute("SELECT COUNT(*) FROM competencies WHERE description = 'copy'").fetchone()[0] == 0
+    # Child rows now point at the surviving (lowest) id; the double-scored competency keeps its first row
+    kra = conn.execute("SELECT c.department, c.kra_name FROM evaluation_details d "
+                       "JOIN evaluation_criteria c ON c.id = d.criterion_id WHERE d.evaluation_id = ?",
+                       (evaluation_id,)).fetchone()
+    assert tuple(kra) == ('Sales', 'Cập nhật thị trường')
+    levels = conn.execute("SELECT competency_id, employee_level FROM competency_evaluations "
+                          "WHERE evaluation_id = ?", (evaluation_id,)).fetchall()
+    assert [tuple(row) for row in levels] == [(original, 3)]
+    with pytest.raises(sqlite3.IntegrityError):
+        conn.execute("INSERT INTO competencies (name) SELECT name FROM competencies LIMIT 1")
+
+
+def test_migrate_is_idempotent(unmigrated):
+    conn, _, _ = unmigrated
+    database.migrate(conn)
+    before = conn.execute("SELECT COUNT(*) FROM evaluation_criteria").fetchone()[0]
+    database.migrate(conn)
+    assert conn.execute("SELECT COUNT(*) FROM evaluation_criteria").fetchone()[0] == before
+    assert conn.execute("PRAGMA user_version").fetchone()[0] == len(database.MIGRATIONS)
+
+
+def test_seeding_upserts_on_the_natural_key(epr_db, conn):
+    counts = [conn.execute(f"SELECT COUNT(*) FROM {table}").fetchone()[0]
+              for table in ('evaluation_criteria', 'competencies')]
+    database.init_database()
+    assert counts == [conn.execute(f"SELECT COUNT(*) FROM {table}").fetchone()[0]
+                      for table in ('evaluation_criteria', 'competencies')]
+
+
+def test_rollup_repair_migration(scratch_conn):
+    conn = scratch_conn
+    user_id = conn.execute("SELECT id FROM users WHERE username = 'employee'").fetchone()[0]
+    conn.execute("INSERT INTO evaluations (user_id, year, employee_score) VALUES (?, 2025, 100)", (user_id,))
+    # A department change made before the users trigger existed
+    conn.execute("DROP TRIGGER trg_rollup_users_move")
+    conn.execute("UPDATE users SET department = 'Marketing' WHERE id = ?", (user_id,))
+    conn.execute("PRAGMA user_version = 2")
+    conn.commit()
+
+    database.migrate(conn)
+    keys = {row[0] for row in conn.execute(
+        "SELECT dim_key FROM rollup_ratings WHERE dimension = 'department' AND year = 2025")}
+    assert 'Marketing' in keys
+    assert conn.execute("SELECT COUNT(*) FROM rollup_ratings WHERE evaluations <= 0").fetchone()[0] == 0
+
+
+def test_session_profile_column_is_dropped(scratch_conn):
+    conn = scratch_conn
+    conn.execute("DROP TABLE sessions")
+    conn.execute("CREATE TABLE sessions (session_id TEXT PRIMARY KEY, user_id INTEGER NOT NULL, "
+                 "profile TEXT NOT NULL, created_at REAL NOT NULL, expires_at REAL NOT NULL)")
+    conn.execute("INSERT INTO sessions VALUES ('kept', 1, '{}', 0, 1e12)")
+    conn.execute("PRAGMA user_version = 3")
+    conn.commit()
+
+    database.migrate(conn)
+    assert 'profile' not in {row[1] for row in conn.execute("PRAGMA table_info(sessions)")}
+    assert conn.execute("SELECT session_id FROM sessions").fetchall()[0][0] == 'kept'
@@ -0,0 +1,56 @@
+# -*- coding: utf-8 -*-
+import hashlib
+
+import passwords
+
+
+def test_hash_is_salted_and_versioned():
+    first = passwords.hash_password('secret')
+    second = passwords.hash_password('secret')
+    assert first != second
+    algorithm, version, params, salt, digest = first.split('$')
+    assert (algorithm, version) == ('scrypt', passwords.FORMAT_VERSION)
+    assert params == 'n=1024,r=8,p=1'
+
+
+def test_verify_roundtrip():
+    stored = passwords.hash_password('mật khẩu')
+    assert passwords.verify_password('mật khẩu', stored)
+    assert not passwords.verify_password('mat khau', stored)
+
+
+def test_pbkdf2_roundtrip():
+    hasher = passwords.get_hasher('pbkdf2_sha256', iterations=1000)
+    stored = passwords.hash_password('secret', hasher)
+    assert stored.startswith('pbkdf2_sha256$1$i=1000$')
+    assert passwords.verify_password('secret', stored)
+    assert not passwords.verify_password('Secret', stored)
+
+
+def test_legacy_sha256_verifies_and_needs_rehash():
+    legacy = hashlib.sha256(b'admin123').hexdigest()
+    assert passwords.is_legacy_hash(legacy)
+    assert passwords.verify_password('admin123', legacy)
+    assert not passwords.verify_password('admin124', legacy)
+    assert passwords.needs_rehash(legacy)
+
+
+def test_malformed_hashes_are_rejected():
+    for stored in ('', None, 'scrypt$1$bad', 'scrypt$9$n=1024,r=8,p=1$AA$AA', 'md5$1$x=1$AA$AA'):
+        assert not passwords.verify_password('secret', stored)
+
+
+def test_needs_rehash_when_settings_change():
+    stored = passwords.hash_password('secret')
+    assert not passwords.needs_rehash(stored)
+    assert passwords.needs_rehash(stored, passwords.get_hasher(n=2048))
+    assert passwords.needs_rehash(stored, passwords.get_hasher('pbkdf2_sha256'))
+
+
+def test_check_password_upgrades_legacy_hash():
+    legacy = hashlib.sha256(b'secret').hexdigest()
+    ok, new_hash = passwords.check_password('secret', legacy)
+    assert ok and new_hash.startswith('scrypt$')
+    assert passwords.verify_password('secret', new_hash)
+    assert passwords.check_password('secret', new_hash) == (True, None)
+    assert passwords.check_password('wrong', legacy) == (False, None)
@@ -0,0 +1,75 @@
+# -*- coding: utf-8 -*-
+import re
+
+import pdf_generator
+
+COMMENT = "Hoàn thành đúng hạn, phối hợp tốt với các bộ phận liên quan."
+
+
+def sample_reports(count):
+    for i in range(count):
+        user = {'fullname': f"Nguyễn Văn Thử {i}", 'code': f"T{i:03d}", 'department': 'Sales',
+                'role_type': 'Nhân viên', 'report_to': 'Trưởng phòng'}
+        kpi = [{'name': f"KRA {k} - Doanh số", 'weight': 25, 'result': 100, 'score': 2500, 'evidence': COMMENT}
+               for k in range(4)]
+        comp = [{'name': 'Làm việc nhóm', 'level': 3, 'percentage': 100, 'weight': 2, 'score': 200,
+                 'evidence': COMMENT}]
+        yield user, {'kpi_items': kpi, 'kpi_total': 100, 'comp_items': comp, 'comp_total': 100,
+                     'final_score': 100, 'rating': 'A', 'comments': COMMENT}
+
+
+def pages(pdf):
+    return len(re.findall(rb'/Type /Page\b(?!s)', pdf))
+
+
+def outline_entries(pdf):
+    return len(re.findall(rb'/Dest \[ \d+ 0 R /Fit \]', pdf))
+
+
+def test_single_report():
+    user, data = next(sample_reports(1))
+    pdf = pdf_generator.generate_evaluation_pdf(user, data).getvalue()
+    assert pdf.startswith(b'%PDF') and pdf.rstrip().endswith(b'%%EOF')
+    assert pages(pdf) >= 1
+
+
+def test_department_book_has_a_bookmark_per_report():
+    summary = [{'code': f"T{i:03d}", 'fullname': f"Nguyễn Văn Thử {i}", 'employee_score': 100,
+                'manager_score': None, 'final_score': None, 'rating': None, 'status': 'submitted'}
+               for i in range(3)]
+    consumed = []
+
+    def reports():
+        for report in sample_reports(3):
+            consumed.append(report[0]['code'])
+            yield report
+
+    pdf = pdf_generator.generate_department_book("Sổ đánh giá Sales 2025", summary, reports()).getvalue()
+    assert consumed == ['T000', 'T001', 'T002']
+    assert pdf.startswith(b'%PDF') and b'/Outlines' in pdf
+    # Summary plus one entry per employee, each report starting on its own page
+    assert outline_entries(pdf) == 4
+    assert pages(pdf) >= 4
+
+
+def test_batch_without_summary_and_archival_profile():
+    batch = pdf_generator.generate_department_book("Batch", None, sample_reports(2)).getvalue()
+    archival = pdf_generator.generate_department_book("Batch", None, sample_reports(2), profile='archival').getvalue()
+    assert outline_entries(batch) == outline_entries(archival) == 2
+    assert b'ASCII85Decode' in batch and b'ASCII85Decode' not in archival
+    assert len(archival) < len(batch)
+
+
+def test_profiles_do_not_leak_across_threads():
+    from concurrent.futures import ThreadPoolExecutor
+    from reportlab import rl_config
+    use_a85 = rl_config.useA85
+
+    def render(profile):
+        return pdf_generator.generate_department_book("Batch", None, sample_reports(3), profile=profile).getvalue()
+
+    with ThreadPoolExecutor(max_workers=8) as pool:
+        results = list(pool.map(render, ['default', 'archival'] * 8))
+    for profile, pdf in zip(['default', 'archival'] * 8, results):
+        assert (b'ASCII85Decode' in pdf) == (profile == 'default')
+    assert rl_config.useA85 == use_a85
@@ -0,0 +1,58 @@
+# -*- coding: utf-8 -*-
+import random
+
+import pytest
+
+import scoring
+from scoring import ScoreAccumulator, rating_for
+
+
+def baseline_scores(criteria, competencies, scores, levels):
+    """The employee form's original full recomputation"""
+    kpi_score = sum(scores.get(c['id'], 0) * c['weight'] for c in criteria if c['id'] in scores)
+    total_kpi_weight = sum(c['weight'] for c in criteria)
+    kpi_result = (kpi_score / total_kpi_weight) if total_kpi_weight > 0 else 0
+    comp_score = sum(scoring.LEVEL_PERCENTAGES[levels.get(c['id'], 3)] * c.get('importance_level', 2)
+                     for c in competencies if c['id'] in levels)
+    total_comp_weight = sum(c.get('importance_level', 2) * 100 for c in competencies)
+    comp_result = (comp_score / total_comp_weight * 100) if total_comp_weight > 0 else 0
+    return kpi_result, comp_result, kpi_result * 0.9 + comp_result * 0.1
+
+
+@pytest.mark.parametrize('seed', range(5))
+def test_accumulator_matches_the_baseline_formula(seed):
+    rng = random.Random(seed)
+    criteria = [{'id': i, 'weight': rng.choice([5, 10, 15, 20, 30])} for i in range(rng.randint(1, 12))]
+    competencies = [{'id': 100 + i, 'importance_level': rng.randint(1, 3)} for i in range(rng.randint(1, 8))]
+    competencies.append({'id': 999})  # importance_level defaults to 2
+    accumulator = ScoreAccumulator(criteria, competencies)
+    scores = {c['id']: 100.0 for c in criteria}
+    levels = {c['id']: 3 for c in competencies}
+    for _ in range(50):
+        if rng.random() < 0.6:
+            criterion_id = rng.choice(criteria)['id']
+            scores[criterion_id] = rng.choice([0.0, 55.5, 90.0, 100.0, 120.0, 150.0])
+            accumulator.set_kpi(criterion_id, scores[criterion_id])
+        else:
+            competency_id = rng.choice(competencies)['id']
+            levels[competency_id] = rng.randint(1, 5)
+            accumulator.set_level(competency_id, levels[competency_id])
+        kpi_result, comp_result, final_score = baseline_scores(criteria, competencies, scores, levels)
+        assert accumulator.kpi_result == pytest.approx(kpi_result)
+        assert accumulator.comp_result == pytest.approx(comp_result)
+        assert accumulator.final_score == pytest.approx(final_score)
+        assert accumulator.rating == rating_for(accumulator.final_score)
+
+
+def test_accumulator_defaults_and_empty_catalogue():
+    accumulator = ScoreAccumulator([{'id': 1, 'weight': 30}], [{'id': 2, 'importance_level': 3}])
+    assert accumulator.final_score == pytest.approx(100)
+    accumulator.set_kpi(1, None)
+    assert accumulator.kpi_result == 0
+    empty = ScoreAccumulator([], [])
+    assert (empty.kpi_result, empty.comp_result, empty.final_score) == (0, 0, 0)
+
+
+def test_rating_bands():
+    assert [rating_for(score) for score in (None, 79.9, 80, 100, 120, 135, 200)] == \
+        ['C', 'C', 'B', 'A', 'A+', 'A++', 'A++']
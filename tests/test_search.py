@@ -0,0 +1,51 @@
+# -*- coding: utf-8 -*-
+import pytest
+
+import search
+
+
+def test_fold_removes_diacritics_and_keeps_length():
+    for text in ('Đánh giá năng lực', 'Chủ động hỗ trợ ĐỒNG NGHIỆP', 'ạ ẵ ờ ữ ỹ'):
+        folded = search.fold(text)
+        assert len(folded) == len(text)
+        assert folded == folded.lower()
+    assert search.fold('Đánh giá năng lực') == 'danh gia nang luc'
+    assert search.fold('Chủ động hỗ trợ ĐỒNG NGHIỆP') == 'chu dong ho tro dong nghiep'
+
+
+def test_query_terms_are_quoted():
+    assert search.terms('  Đánh-giá,  KPI ') == ['danh', 'gia', 'kpi']
+    # Operators become plain quoted terms
+    assert search.match_query('khách hàng" OR *') == '"khach" "hang" "or"'
+    assert search.match_query('') == ''
+
+
+def test_excerpt_highlights_the_original_text():
+    text = 'Nhân viên đã hỗ trợ khách hàng rất tốt trong năm.'
+    assert search.excerpt(text, search.terms('khach hang')) == \
+        'Nhân viên đã hỗ trợ **khách** **hàng** rất tốt trong năm.'
+    assert search.excerpt('x' * 300, ['y']).endswith('…')
+
+
+def test_search_finds_folded_matches(scratch_conn):
+    conn = scratch_conn
+    if not search.available(conn):
+        pytest.skip("SQLite built without FTS5")
+    user_id = conn.execute("SELECT id FROM users WHERE username = 'employee'").fetchone()[0]
+    evaluation_id = conn.execute(
+        "INSERT INTO evaluations (user_id, year, employee_comment, manager_comment) VALUES (?, 2025, ?, ?)",
+        (user_id, 'Đề xuất đào tạo kỹ năng đàm phán', 'Đánh giá tốt')).lastrowid
+    conn.commit()
+
+    hits, total = search.search(conn, 'dao tao dam phan')
+    assert total == 1
+    assert hits[0]['evaluation_id'] == evaluation_id
+    assert hits[0]['text'] == 'Đề xuất đào tạo kỹ năng đàm phán'
+    assert '**đào**' in hits[0]['excerpt']
+    assert search.search(conn, 'danh gia', year=2024) == ([], 0)
+
+    # The update trigger re-indexes the changed text
+    conn.execute("UPDATE evaluations SET manager_comment = 'Cần cải thiện' WHERE id = ?", (evaluation_id,))
+    conn.commit()
+    assert search.search(conn, 'danh gia')[1] == 0
+    assert search.search(conn, 'cai thien')[1] == 1
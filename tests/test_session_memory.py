@@ -0,0 +1,29 @@
+# -*- coding: utf-8 -*-
+import session_memory
+
+
+def test_enter_page_drops_other_pages_keys():
+    state = {'user': 'u', 'score_1': 80.0, 'mgr_score_3': 90, 'calib_year_mgr': 2025, 'free': 1}
+    session_memory.enter_page(state, 'manager')
+    assert set(state) == {'user', 'mgr_score_3', 'calib_year_mgr', 'free', session_memory.PAGE_KEY}
+
+
+def test_govern_reports_without_dropping_user_input(monkeypatch, capsys):
+    monkeypatch.setattr(session_memory, 'WARN_SESSION_BYTES', 10_000)
+    session_memory.forget('s1')
+    state = {session_memory.PAGE_KEY: 'employee', 'comment_1': 'x' * 20_000,
+             'score_accumulator': ('signature', list(range(100)))}
+    session_memory.govern(state, 's1')
+    session_memory.govern(state, 's1')
+
+    # Only derived state is dropped; what the user typed stays
+    assert 'score_accumulator' not in state and 'comment_1' in state
+    assert capsys.readouterr().out.count("⚠ Session state") == 1
+    entry = session_memory._registry['s1']
+    assert entry['over_threshold'] and entry['largest'] == 'comment_1' and entry['evictions'] == 1
+    assert session_memory.totals()['over_threshold'] >= 1
+
+    state['comment_1'] = 'short'
+    session_memory.govern(state, 's1')
+    assert not session_memory._registry['s1']['over_threshold']
+    session_memory.forget('s1')
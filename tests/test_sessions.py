@@ -0,0 +1,87 @@
+# -*- coding: utf-8 -*-
+import time
+
+import pytest
+
+import passwords
+import sessions
+import writer
+
+
+@pytest.fixture
+def user(epr_db, conn):
+    """A fresh account in the shared scratch database"""
+    code = f"SES{time.time_ns()}"
+    user_id = writer.run(writer.insert_user, code, 'Session Test', code.lower(),
+                         passwords.hash_password('secret'), 'Sales', 'employee', 'Staff', 'MGR001')
+    return dict(conn.execute("SELECT * FROM users WHERE id = ?", (user_id,)).fetchone())
+
+
+def session_row(conn, token):
+    return conn.execute("SELECT * FROM sessions WHERE session_id = ?", (token.partition('.')[0],)).fetchone()
+
+
+def set_expiry(conn, token, expires_at):
+    writer.run(sessions._extend_session, token.partition('.')[0], expires_at)
+
+
+def test_resolve_returns_current_user_without_password(user, conn):
+    token = sessions.create_session(user)
+    assert sessions.is_token(token)
+    profile = sessions.resolve(token)
+    assert profile['id'] == user['id'] and 'password' not in profile and 'session_expires_at' not in profile
+    # Changes to the users row show up in the next resolve
+    writer.run(lambda c: c.execute("UPDATE users SET department = 'Marketing' WHERE id = ?", (user['id'],)))
+    assert sessions.resolve(token)['department'] == 'Marketing'
+
+
+@pytest.mark.parametrize('tamper', [
+    lambda token: token[:-1] + ('A' if token[-1] != 'A' else 'B'),
+    lambda token: token.partition('.')[0],
+    lambda token: 'x' + token,
+    lambda token: token + "';alert(1);'",
+    lambda token: None,
+])
+def test_bad_signature_is_rejected(user, tamper):
+    token = sessions.create_session(user)
+    assert sessions.resolve(tamper(token)) is None
+
+
+def test_expired_session_is_rejected_and_purged(user, conn):
+    token = sessions.create_session(user)
+    set_expiry(conn, token, time.time() - 1)
+    assert sessions.resolve(token) is None
+    assert sessions.purge_expired() >= 1
+    assert session_row(conn, token) is None
+
+
+def test_expiry_slides_after_half_the_ttl(user, conn):
+    token = sessions.create_session(user)
+    fresh = session_row(conn, token)['expires_at']
+    sessions.resolve(token)
+    # The extension is queued; a later write runs after it
+    writer.run(lambda c: None)
+    assert session_row(conn, token)['expires_at'] == fresh
+
+    set_expiry(conn, token, time.time() + 60)
+    started = time.time()
+    assert sessions.resolve(token) is not None
+    writer.run(lambda c: None)
+    assert session_row(conn, token)['expires_at'] >= started + sessions.SESSION_TTL_HOURS * 3600
+
+
+def test_password_change_and_revoke_user_end_sessions(user, conn):
+    token = sessions.create_session(user)
+    writer.run(writer.update_password, user['id'], passwords.hash_password('changed'))
+    assert sessions.resolve(token) is None
+
+    first, second = sessions.create_session(user), sessions.create_session(user)
+    assert sessions.revoke_user(user['id']) == 2
+    assert sessions.resolve(first) is None and sessions.resolve(second) is None
+
+
+def test_logout_revokes_only_that_session(user):
+    kept, ended = sessions.create_session(user), sessions.create_session(user)
+    sessions.revoke(ended)
+    assert sessions.resolve(ended) is None
+    assert sessions.resolve(kept) is not None
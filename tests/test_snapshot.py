@@ -0,0 +1,49 @@
+# -*- coding: utf-8 -*-
+import pyarrow as pa
+
+import archive
+import calibration
+import snapshot
+
+
+def test_snapshot_includes_archived_years(scratch_conn, tmp_path, monkeypatch):
+    conn = scratch_conn
+    monkeypatch.setattr(archive, 'ARCHIVE_DIR', str(tmp_path / 'archive'))
+    user_id = conn.execute("SELECT id FROM users WHERE username = 'employee'").fetchone()[0]
+    for year, score in ((2020, 90), (2024, 110)):
+        evaluation_id = conn.execute(
+            "INSERT INTO evaluations (user_id, year, employee_score, final_score) VALUES (?, ?, ?, ?)",
+            (user_id, year, score, score)).lastrowid
+        conn.execute("INSERT INTO evaluation_details (evaluation_id, criterion_id, employee_score) "
+                     "VALUES (?, 1, ?)", (evaluation_id, score))
+    conn.commit()
+    db_path = conn.execute("PRAGMA database_list").fetchone()[2]
+    archive.archive_year(2020, db_path)
+
+    snapshot.export_snapshot(db_path, snapshot_dir=str(tmp_path / 'snapshots'))
+    tables = snapshot.load_snapshot(str(tmp_path / 'snapshots'))
+    assert {2020, 2024} <= set(snapshot.distinct(tables['evaluations'], 'year'))
+    assert tables['evaluation_details'].num_rows == conn.execute(
+        "SELECT COUNT(*) FROM evaluation_details").fetchone()[0] + 1
+    assert 'password' not in tables['users'].column_names
+
+    # Same numbers as the live calibration view
+    evaluations = archive.history_tables(conn)['evaluations']
+    live = calibration.load_scores(conn, 2020, source=evaluations)
+    from_snapshot = calibration.scores_from_snapshot(tables, 2020)
+    assert from_snapshot['final_score'].tolist() == live['final_score'].tolist() == [90]
+
+
+def test_snapshot_tables_are_memory_mapped(scratch_conn, tmp_path):
+    db_path = scratch_conn.execute("PRAGMA database_list").fetchone()[2]
+    snapshot.export_snapshot(db_path, snapshot_dir=str(tmp_path))
+    snapshot._cache.clear()
+    # Column buffers point into the mapped files, nothing is allocated
+    before = pa.total_allocated_bytes()
+    tables = snapshot.load_snapshot(str(tmp_path))
+    assert pa.total_allocated_bytes() == before
+    assert tables['evaluations'].num_rows == scratch_conn.execute("SELECT COUNT(*) FROM evaluations").fetchone()[0]
+    assert snapshot.load_snapshot(str(tmp_path)) is tables
+
+    users = snapshot.to_frame(tables['users'], ['id', 'username'], role_type='admin')
+    assert list(users.columns) == ['id', 'username'] and 'admin' in users['username'].tolist()
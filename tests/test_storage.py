@@ -0,0 +1,96 @@
+# -*- coding: utf-8 -*-
+import os
+
+import pytest
+
+import calibration
+import database
+import storage
+
+# Scratch PostgreSQL database for the server backend; its tables are created and written
+PG_URL = os.environ.get('EPR_TEST_DATABASE_URL', '')
+needs_postgres = pytest.mark.skipif(
+    not PG_URL or storage.psycopg is None,
+    reason="set EPR_TEST_DATABASE_URL to a scratch PostgreSQL database (needs psycopg, psycopg-pool)")
+YEAR = 2031
+
+
+class RecordingCursor:
+    """Stands in for a psycopg cursor: records statements, returns the given rows"""
+
+    def __init__(self, rows):
+        self.rows = list(rows)
+        self.statements = []
+
+    def execute(self, sql, params):
+        self.statements.append((sql, params))
+
+    def fetchone(self):
+        return self.rows.pop(0) if self.rows else None
+
+
+def test_qmark_to_format_leaves_literals_alone():
+    assert storage.qmark_to_format("SELECT '?', '50%' FROM t WHERE a = ? AND b LIKE 'x''?'") == \
+        "SELECT '?', '50%%' FROM t WHERE a = %s AND b LIKE 'x''?'"
+
+
+def test_insert_reports_the_new_id_or_none_when_skipped():
+    cursor = storage._PgCursor(RecordingCursor([(7,)]))
+    assert cursor.execute("INSERT INTO users (code) VALUES (?)", ['A']).lastrowid == 7
+    assert cursor._cursor.statements[-1] == ("INSERT INTO users (code) VALUES (%s) RETURNING id", ('A',))
+    # ON CONFLICT DO NOTHING: no row comes back
+    skipped = cursor.execute("INSERT INTO competencies (name) VALUES (?) ON CONFLICT (name) DO NOTHING", ['B'])
+    assert skipped.lastrowid is None
+
+
+def test_read_frame_matches_read_sql_query(conn):
+    import pandas as pd
+    sql = "SELECT id, username FROM users WHERE role_type != ? ORDER BY id"
+    assert storage.dialect_of(conn) == 'sqlite'
+    assert storage.read_frame(conn, sql, ['admin']).equals(pd.read_sql_query(sql, conn, params=['admin']))
+
+
+@pytest.fixture
+def postgres(monkeypatch):
+    backend = storage.PostgresStorage(PG_URL, min_size=1, max_size=2)
+    monkeypatch.setattr(storage, '_storage', backend)
+    database.init_database()
+    yield backend
+    backend.pool.close()
+
+
+@needs_postgres
+def test_postgres_schema_and_seed_are_idempotent(postgres):
+    def counts():
+        with postgres.connection() as conn:
+            return [conn.execute(f"SELECT COUNT(*) FROM {table}").fetchone()[0]
+                    for table in ('users', 'evaluation_criteria', 'competencies')]
+
+    before = counts()
+    database.init_database()
+    assert counts() == before
+    with postgres.connection() as conn:
+        assert storage.dialect_of(conn) == 'postgresql'
+        name = conn.execute("SELECT name FROM competencies ORDER BY id").fetchone()[0]
+        cursor = conn.execute("INSERT INTO competencies (name) VALUES (?) ON CONFLICT (name) DO NOTHING", (name,))
+        assert cursor.lastrowid is None
+        conn.rollback()
+
+
+@needs_postgres
+def test_postgres_calibration_scores(postgres):
+    with postgres.connection() as conn:
+        conn.execute("DELETE FROM evaluations WHERE year = ?", (YEAR,))
+        user_id = conn.execute("SELECT id FROM users WHERE username = 'employee'").fetchone()[0]
+        evaluation_id = conn.execute(
+            "INSERT INTO evaluations (user_id, year, employee_score, final_score) VALUES (?, ?, 90, 95)",
+            (user_id, YEAR)).lastrowid
+        conn.commit()
+        try:
+            df = calibration.load_scores(conn, YEAR)
+            assert df['evaluation_id'].tolist() == [evaluation_id]
+            assert df['final_score'].tolist() == [95]
+            assert df['department'].tolist() == ['Sales']
+        finally:
+            conn.execute("DELETE FROM evaluations WHERE id = ?", (evaluation_id,))
+            conn.commit()
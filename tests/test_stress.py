@@ -0,0 +1,13 @@
+# -*- coding: utf-8 -*-
+import pytest
+
+import stress
+
+
+@pytest.mark.parametrize('mode', ['direct', 'queue'])
+@pytest.mark.parametrize('journal', ['delete', 'truncate', 'wal'])
+def test_runs_in_the_requested_journal_mode(epr_db, mode, journal):
+    summary = stress.run_stress(epr_db, mode=mode, processes=1, threads=2, ops=2, journal=journal)
+    assert summary['journal'] == summary['journal_requested'] == journal
+    assert summary['submissions'] + summary['reviews'] == 4
+    assert summary['busy_errors'] == summary['other_errors'] == 0
@@ -0,0 +1,93 @@
+# -*- coding: utf-8 -*-
+import tracker
+
+YEAR = 2031
+
+
+def participants(conn):
+    return [row['id'] for row in conn.execute(
+        f"SELECT u.id FROM users u WHERE {tracker.PARTICIPANTS_SQL} ORDER BY u.id")]
+
+
+def add_employee(conn, code):
+    user_id = conn.execute(
+        "INSERT INTO users (code, fullname, username, password, department, role_type, report_to) "
+        "VALUES (?, ?, ?, 'x', 'Sales', 'employee', 'Manager')", (code, f"Tracker {code}", code.lower())).lastrowid
+    conn.commit()
+    return user_id
+
+
+def submit(conn, user_id, status='submitted', reviewed_at=None):
+    evaluation_id = conn.execute(
+        "INSERT INTO evaluations (user_id, year, status, manager_submitted_at) VALUES (?, ?, ?, ?)",
+        (user_id, YEAR, status, reviewed_at)).lastrowid
+    conn.commit()
+    return evaluation_id
+
+
+def review(conn, evaluation_id, reviewed_at):
+    conn.execute("UPDATE evaluations SET status = 'manager_reviewed', manager_submitted_at = ? WHERE id = ?",
+                 (reviewed_at, evaluation_id))
+    conn.commit()
+
+
+def fresh_counts(conn):
+    tracked = tracker.Tracker(YEAR)
+    return tracked.refresh(conn)
+
+
+def test_outstanding_is_the_anti_join_plus_awaiting_review(scratch_conn):
+    conn = scratch_conn
+    first, second, third = (add_employee(conn, f"TRK00{i}") for i in range(3))
+    assert {row['id'] for row in tracker.outstanding(conn, YEAR)} == set(participants(conn))
+
+    submit(conn, first)
+    review(conn, submit(conn, second), '2031-12-01 10:00:00')
+    # Only the latest evaluation of the year counts
+    review(conn, submit(conn, third), '2031-12-01 11:00:00')
+    submit(conn, third)
+    conn.execute("INSERT INTO evaluations (user_id, year, status) VALUES (?, ?, 'submitted')", (second, YEAR - 1))
+    conn.commit()
+
+    states = {row['id']: row['state'] for row in tracker.outstanding(conn, YEAR)}
+    assert second not in states
+    assert states[first] == states[third] == tracker.AWAITING_REVIEW
+    assert set(states.values()) == {tracker.NOT_SUBMITTED, tracker.AWAITING_REVIEW}
+    assert len(states) == len(participants(conn)) - 1
+
+    grouped = tracker.group_outstanding(tracker.outstanding(conn, YEAR), 'department')
+    assert sum(len(rows) for states in grouped.values() for rows in states.values()) == len(states)
+
+
+def test_tracker_applies_changes_incrementally(scratch_conn):
+    conn = scratch_conn
+    first, second = participants(conn)[:2]
+    tracked = tracker.Tracker(YEAR)
+    total = len(participants(conn))
+    assert tracked.refresh(conn) == {tracker.NOT_SUBMITTED: total, tracker.AWAITING_REVIEW: 0, tracker.REVIEWED: 0}
+
+    loads = []
+    original_load = tracked._load
+    tracked._load = lambda c: loads.append(1) or original_load(c)
+
+    evaluation_id = submit(conn, first)
+    submit(conn, second)
+    assert tracked.refresh(conn) == fresh_counts(conn) == {
+        tracker.NOT_SUBMITTED: total - 2, tracker.AWAITING_REVIEW: 2, tracker.REVIEWED: 0}
+    review(conn, evaluation_id, '2031-12-01 10:00:00')
+    assert tracked.refresh(conn) == fresh_counts(conn)
+    assert tracked.counts()[tracker.REVIEWED] == 1
+    assert {user['id'] for user in tracked.outstanding()} == set(participants(conn)) - {first}
+    # Nothing new: nothing changes
+    assert tracked.refresh(conn) == fresh_counts(conn)
+    assert loads == []
+
+    # Deletes and new participants fall back to a full reload
+    conn.execute("DELETE FROM evaluations WHERE id = ?", (evaluation_id,))
+    conn.commit()
+    assert tracked.refresh(conn) == fresh_counts(conn)
+    assert tracked.counts()[tracker.REVIEWED] == 0
+    add_employee(conn, 'TRK009')
+    assert tracked.refresh(conn) == fresh_counts(conn) == {
+        tracker.NOT_SUBMITTED: total, tracker.AWAITING_REVIEW: 1, tracker.REVIEWED: 0}
+    assert len(loads) == 2
@@ -0,0 +1,86 @@
+# -*- coding: utf-8 -*-
+import sqlite3
+import threading
+import time
+from concurrent.futures import TimeoutError
+
+import pytest
+
+import storage
+import writer
+
+
+def insert_department(conn, name):
+    conn.execute("INSERT INTO evaluation_criteria (department, kra_name, weight, category) "
+                 "VALUES (?, 'KRA', 10, 'KPI')", (name,))
+    return name
+
+
+def test_failed_transaction_does_not_undo_its_batch(scratch_conn):
+    db_path = scratch_conn.execute("PRAGMA database_list").fetchone()[2]
+    queue = writer.WriteQueue(db_path)
+    try:
+        ok = queue.submit(insert_department, 'Writer A')
+        duplicate = queue.submit(insert_department, 'Writer A')
+        assert ok.result(timeout=5) == 'Writer A'
+        with pytest.raises(sqlite3.IntegrityError):
+            duplicate.result(timeout=5)
+    finally:
+        queue.close()
+    assert scratch_conn.execute(
+        "SELECT COUNT(*) FROM evaluation_criteria WHERE department = 'Writer A'").fetchone()[0] == 1
+    assert queue.stats == {'transactions': 1, 'commits': 1, 'failed': 1}
+
+
+def test_rolled_back_batch_is_not_counted_as_committed(scratch_conn):
+    db_path = scratch_conn.execute("PRAGMA database_list").fetchone()[2]
+    queue = writer.WriteQueue(db_path)
+    try:
+        # COMMIT fails: the job ended the transaction itself
+        with pytest.raises(sqlite3.OperationalError):
+            queue.run(lambda conn: conn.execute("ROLLBACK"))
+    finally:
+        queue.close()
+    assert queue.stats == {'transactions': 0, 'commits': 0, 'failed': 1}
+
+
+def test_timeout_cancels_a_queued_job(scratch_conn, monkeypatch):
+    db_path = scratch_conn.execute("PRAGMA database_list").fetchone()[2]
+    monkeypatch.setattr(writer, 'SUBMIT_TIMEOUT', 0.2)
+    release = threading.Event()
+    queue = writer.WriteQueue(db_path, max_batch=1)
+    try:
+        # Occupies the writer so the next job stays queued past the timeout
+        busy = queue.submit(lambda conn: release.wait(5))
+        with pytest.raises(TimeoutError, match="not applied"):
+            queue.run(insert_department, 'Writer D')
+        release.set()
+        busy.result(timeout=5)
+        # A job already running when the timeout hits is waited for
+        assert queue.run(lambda conn: time.sleep(0.4) or 'slow') == 'slow'
+    finally:
+        release.set()
+        queue.close()
+    assert scratch_conn.execute(
+        "SELECT COUNT(*) FROM evaluation_criteria WHERE department = 'Writer D'").fetchone()[0] == 0
+
+
+def test_connection_failure_fails_pending_and_later_jobs(monkeypatch):
+    opening = threading.Event()
+
+    def write_connection(self):
+        opening.wait(5)
+        raise sqlite3.OperationalError("unable to open database file")
+
+    monkeypatch.setattr(storage.SQLiteStorage, 'write_connection', write_connection)
+    queue = writer.WriteQueue('unused.db')
+    pending = queue.submit(insert_department, 'Writer B')
+    opening.set()
+    with pytest.raises(sqlite3.OperationalError):
+        pending.result(timeout=5)
+    assert isinstance(queue.error, sqlite3.OperationalError)
+
+    started = time.monotonic()
+    with pytest.raises(sqlite3.OperationalError):
+        queue.run(insert_department, 'Writer C')
+    assert time.monotonic() - started < 1
@@ -0,0 +1,316 @@
+# -*- coding: utf-8 -*-
+"""
+Submission-status tracker and reminders for EPR System
+
+Everyone who fills in a self-assessment (non-admin users without a manager
+dashboard) is either not submitted, awaiting manager review, or reviewed.
+One anti-join of users against their latest evaluation of the year gives
+the outstanding list, grouped per department and per manager. A Tracker
+keeps those counts current by applying only the evaluations written since
+its last refresh.
+
+Reminders go out asynchronously through an SMTP relay: recipients are split
+into batches sent over one connection each, with at most SMTP_CONCURRENCY
+connections open at a time.
+
+Usage:
+    python tracker.py status [--year 2025]
+    python tracker.py remind [--year 2025] [--dry-run]
+    python tracker.py smtpd [--port 8025]   # local stand-in relay (pip install aiosmtpd)
+"""
+import argparse
+import asyncio
+import os
+import smtplib
+import threading
+from email.message import EmailMessage
+
+import storage
+from scoring import REVIEW_YEAR
+
+SMTP_HOST = os.environ.get('EPR_SMTP_HOST', 'localhost')
+SMTP_PORT = int(os.environ.get('EPR_SMTP_PORT', 25))
+SMTP_USER = os.environ.get('EPR_SMTP_USER', '')
+SMTP_PASSWORD = os.environ.get('EPR_SMTP_PASSWORD', '')
+SMTP_STARTTLS = os.environ.get('EPR_SMTP_STARTTLS', '0') == '1'
+SMTP_FROM = os.environ.get('EPR_SMTP_FROM', 'epr@localhost')
+SMTP_BATCH_SIZE = int(os.environ.get('EPR_SMTP_BATCH_SIZE', 20))
+SMTP_CONCURRENCY = int(os.environ.get('EPR_SMTP_CONCURRENCY', 4))
+APP_URL = os.environ.get('EPR_APP_URL', 'http://localhost:8501')
+
+NOT_SUBMITTED = 'not_submitted'
+AWAITING_REVIEW = 'awaiting_review'
+REVIEWED = 'reviewed'
+STATE_LABELS = {
+    NOT_SUBMITTED: 'Chưa nộp',
+    AWAITING_REVIEW: 'Chờ quản lý đánh giá',
+    REVIEWED: 'Đã hoàn tất',
+}
+
+# Users who fill in a self-assessment
+PARTICIPANTS_SQL = "u.role_type != 'admin' AND COALESCE(u.is_manager, 0) = 0"
+
+
+def _state(status):
+    if status is None:
+        return NOT_SUBMITTED
+    return AWAITING_REVIEW if status == 'submitted' else REVIEWED
+
+
+def participant_states(conn, year, outstanding_only=False):
+    """Participants with the state of their latest evaluation of the year
+
+    With outstanding_only the LEFT JOIN becomes an anti-join (no evaluation)
+    plus the evaluations still waiting for the manager.
+    """
+    cursor = conn.cursor()
+    cursor.execute(f'''
+    SELECT u.id, u.code, u.fullname, u.email, u.department, u.report_to,
+           e.id AS evaluation_id, e.status
+    FROM users u
+    LEFT JOIN (
+        SELECT user_id, MAX(id) AS id FROM evaluations WHERE year = ? GROUP BY user_id
+    ) latest ON latest.user_id = u.id
+    LEFT JOIN evaluations e ON e.id = latest.id
+    WHERE {PARTICIPANTS_SQL}
+    {"AND (latest.id IS NULL OR e.status = 'submitted')" if outstanding_only else ""}
+    ORDER BY u.department, u.fullname
+    ''', (year,))
+    return [dict(row, state=_state(row['status'])) for row in cursor.fetchall()]
+
+
+def outstanding(conn, year):
+    """Participants not submitted or awaiting review for the year"""
+    return participant_states(conn, year, outstanding_only=True)
+
+
+def group_outstanding(rows, key):
+    """{department or manager: {state: [rows]}}"""
+    groups = {}
+    for row in rows:
+        groups.setdefault(row[key] or '', {}).setdefault(row['state'], []).append(row)
+    return groups
+
+
+class Tracker:
+    """Per-user states for one year, refreshed incrementally"""
+
+    def __init__(self, year):
+        self.year = year
+        self._lock = threading.Lock()
+        self.users = {}
+        self._signature = None
+        self._last_id = 0
+        self._last_review = None
+        self._evaluations = 0
+
+    def _load(self, conn):
+        self.users = {row['id']: row for row in participant_states(conn, self.year)}
+        cursor = conn.cursor()
+        cursor.execute("SELECT COALESCE(MAX(id), 0), MAX(manager_submitted_at), COUNT(*) "
+                       "FROM evaluations WHERE year = ?", (self.year,))
+        self._last_id, self._last_review, self._evaluations = cursor.fetchone()
+
+    def refresh(self, conn):
+        """Apply evaluations written since the last refresh (full reload if users or deletes changed things)"""
+        with self._lock:
+            cursor = conn.cursor()
+            cursor.execute(f"SELECT COUNT(*), COALESCE(MAX(id), 0) FROM users u WHERE {PARTICIPANTS_SQL}")
+            signature = tuple(cursor.fetchone())
+            if signature != self._signature:
+                self._signature = signature
+                self._load(conn)
+                return self.counts()
+
+            # New submissions, and reviews saved since the newest one seen
+            query = ("SELECT id, user_id, status, manager_submitted_at FROM evaluations "
+                     "WHERE year = ? AND (id > ?")
+            params = [self.year, self._last_id]
+            if self._last_review is not None:
+                query += " OR manager_submitted_at > ?"
+                params.append(self._last_review)
+            else:
+                query += " OR manager_submitted_at IS NOT NULL"
+            cursor.execute(query + ") ORDER BY id", params)
+            changes = cursor.fetchall()
+            new = sum(1 for row in changes if row['id'] > self._last_id)
+            cursor.execute("SELECT COUNT(*) FROM evaluations WHERE year = ?", (self.year,))
+            if cursor.fetchone()[0] != self._evaluations + new:
+                # Something was deleted; deltas cannot express that
+                self._load(conn)
+                return self.counts()
+            for row in changes:
+                user = self.users.get(row['user_id'])
+                if user is not None and row['id'] >= (user['evaluation_id'] or 0):
+                    user['evaluation_id'] = row['id']
+                    user['status'] = row['status']
+                    user['state'] = _state(row['status'])
+                self._last_id = max(self._last_id, row['id'])
+                reviewed_at = row['manager_submitted_at']
+                if reviewed_at is not None and (self._last_review is None or reviewed_at > self._last_review):
+                    self._last_review = reviewed_at
+            self._evaluations += new
+            return self.counts()
+
+    def counts(self):
+        """{state: number of participants}"""
+        totals = {state: 0 for state in STATE_LABELS}
+        for user in self.users.values():
+            totals[user['state']] += 1
+        return totals
+
+    def outstanding(self):
+        return [user for user in self.users.values() if user['state'] != REVIEWED]
+
+
+def _employee_message(user, year):
+    message = EmailMessage()
+    message['From'] = SMTP_FROM
+    message['To'] = user['email']
+    message['Subject'] = f"[EPR {year}] Nhắc nộp bản tự đánh giá"
+    message.set_content(
+        f"Chào {user['fullname']},\n\n"
+        f"Bạn chưa nộp bản tự đánh giá năm {year}. Vui lòng hoàn thành tại {APP_URL}.\n\n"
+        "Trân trọng,\nHFM EPR System"
+    )
+    return message
+
+
+def _manager_message(manager, team, year):
+    names = '\n'.join(f"  - {user['fullname']} ({user['code']})" for user in team)
+    message = EmailMessage()
+    message['From'] = SMTP_FROM
+    message['To'] = manager['email']
+    message['Subject'] = f"[EPR {year}] {len(team)} bản đánh giá đang chờ bạn duyệt"
+    message.set_content(
+        f"Chào {manager['fullname']},\n\n"
+        f"Các nhân viên sau đã nộp bản tự đánh giá năm {year} và đang chờ bạn đánh giá:\n{names}\n\n"
+        f"Vui lòng hoàn thành tại {APP_URL}.\n\nTrân trọng,\nHFM EPR System"
+    )
+    return message
+
+
+def build_reminders(conn, year):
+    """Reminder emails for the outstanding list, plus recipients skipped for lack of an email"""
+    rows = outstanding(conn, year)
+    messages, skipped = [], []
+    for user in rows:
+        if user['state'] == NOT_SUBMITTED:
+            if user['email']:
+                messages.append(_employee_message(user, year))
+            else:
+                skipped.append(user['fullname'])
+
+    cursor = conn.cursor()
+    cursor.execute("SELECT fullname, email FROM users WHERE email IS NOT NULL AND email != ''")
+    manager_emails = {row['fullname']: row['email'] for row in cursor.fetchall()}
+    for manager, states in group_outstanding(rows, 'report_to').items():
+        team = states.get(AWAITING_REVIEW)
+        if not team:
+            continue
+        if manager in manager_emails:
+            messages.append(_manager_message({'fullname': manager, 'email': manager_emails[manager]}, team, year))
+        else:
+            skipped.append(manager or '(không có quản lý)')
+    return messages, skipped
+
+
+def _send_batch(messages, host, port):
+    """Send a batch over one SMTP connection (runs in a worker thread)"""
+    sent, failed = 0, []
+    with smtplib.SMTP(host, port, timeout=30) as smtp:
+        if SMTP_STARTTLS:
+            smtp.starttls()
+        if SMTP_USER:
+            smtp.login(SMTP_USER, SMTP_PASSWORD)
+        for message in messages:
+            try:
+                smtp.send_message(message)
+                sent += 1
+            except smtplib.SMTPException as e:
+                failed.append((message['To'], str(e)))
+    return sent, failed
+
+
+async def send_reminders(messages, host=None, port=None, batch_size=None, concurrency=None):
+    """Send messages in batches, at most `concurrency` SMTP connections at once"""
+    host = host or SMTP_HOST
+    port = port or SMTP_PORT
+    batch_size = batch_size or SMTP_BATCH_SIZE
+    semaphore = asyncio.Semaphore(concurrency or SMTP_CONCURRENCY)
+
+    async def dispatch(batch):
+        async with semaphore:
+            try:
+                return await asyncio.to_thread(_send_batch, batch, host, port)
+            except (OSError, smtplib.SMTPException) as e:
+                return 0, [(message['To'], str(e)) for message in batch]
+
+    batches = [messages[i:i + batch_size] for i in range(0, len(messages), batch_size)]
+    results = await asyncio.gather(*(dispatch(batch) for batch in batches))
+    return {'sent': sum(sent for sent, _ in results),
+            'failed': [failure for _, failures in results for failure in failures],
+            'batches': len(batches)}
+
+
+def remind(year, **smtp_options):
+    """Build and send all reminders for a year; returns the send report"""
+    with storage.get_storage().connection() as conn:
+        messages, skipped = build_reminders(conn, year)
+    report = asyncio.run(send_reminders(messages, **smtp_options)) if messages else \
+        {'sent': 0, 'failed': [], 'batches': 0}
+    report['skipped'] = skipped
+    return report
+
+
+def serve_debug_smtp(port=8025):
+    """Local SMTP relay that prints every message it receives"""
+    try:
+        from aiosmtpd.controller import Controller
+        from aiosmtpd.handlers import Debugging
+    except ImportError:
+        raise SystemExit("The local relay needs: pip install aiosmtpd")
+    controller = Controller(Debugging(), hostname='127.0.0.1', port=port)
+    controller.start()
+    print(f"SMTP stand-in listening on 127.0.0.1:{port} (Ctrl+C to stop)")
+    try:
+        threading.Event().wait()
+    except KeyboardInterrupt:
+        pass
+    finally:
+        controller.stop()
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Submission tracker and reminders")
+    sub = parser.add_subparsers(dest='command', required=True)
+    for name in ('status', 'remind'):
+        p = sub.add_parser(name)
+        p.add_argument('--year', type=int, default=REVIEW_YEAR)
+    sub.choices['remind'].add_argument('--dry-run', action='store_true')
+    sub.add_parser('smtpd').add_argument('--port', type=int, default=8025)
+    args = parser.parse_args()
+
+    if args.command == 'smtpd':
+        serve_debug_smtp(args.port)
+        return
+    with storage.get_storage().connection() as conn:
+        if args.command == 'status':
+            rows = outstanding(conn, args.year)
+            for department, states in group_outstanding(rows, 'department').items():
+                summary = ', '.join(f"{STATE_LABELS[state]}: {len(users)}" for state, users in states.items())
+                print(f"{department or '(không có phòng ban)'}: {summary}")
+            return
+        if args.dry_run:
+            messages, skipped = build_reminders(conn, args.year)
+            for message in messages:
+                print(f"{message['To']}: {message['Subject']}")
+            print(f"{len(messages)} reminders, {len(skipped)} without email: {', '.join(skipped)}")
+            return
+    report = remind(args.year)
+    print(f"Sent {report['sent']} in {report['batches']} batches, {len(report['failed'])} failed, "
+          f"{len(report['skipped'])} without email")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,246 @@
+# -*- coding: utf-8 -*-
+"""
+Single-writer queue for EPR System
+
+One background thread owns the only write connection of the process. Callers
+queue write transactions (plain functions taking a connection) and get a
+Future back; the writer drains whatever is queued into one group commit, with
+a SAVEPOINT per transaction so a failing one does not take the others down.
+This replaces many short-lived connections racing for SQLite's write lock,
+which is what produced "database is locked" at the review deadline.
+"""
+import os
+import queue
+import threading
+from concurrent.futures import Future, TimeoutError
+from datetime import datetime
+
+import storage
+
+MAX_BATCH = int(os.environ.get('EPR_WRITER_MAX_BATCH', 64))
+# How long the writer waits for more work before committing a partial batch
+BATCH_WINDOW = float(os.environ.get('EPR_WRITER_BATCH_WINDOW', 0.002))
+SUBMIT_TIMEOUT = float(os.environ.get('EPR_WRITER_TIMEOUT', 30))
+
+
+# Write transactions; each takes the connection first and must not commit
+
+def submit_evaluation(conn, user_id, year, final_score, overall_comment, development_areas,
+                      scores, comments, comp_levels, comp_comments):
+    """Insert a self-assessment with its per-criterion and per-competency rows"""
+    cursor = conn.cursor()
+    cursor.execute('''
+    INSERT INTO evaluations
+    (user_id, year, period, status, employee_score, employee_comment, development_areas, employee_submitted_at)
+    VALUES (?, ?, ?, ?, ?, ?, ?, ?)
+    ''', (user_id, year, 'Annual', 'submitted',
+          final_score, overall_comment, development_areas, datetime.now()))
+
+    evaluation_id = cursor.lastrowid
+
+    # Save criterion details
+    cursor.executemany('''
+    INSERT INTO evaluation_details
+    (evaluation_id, criterion_id, employee_score, employee_comment)
+    VALUES (?, ?, ?, ?)
+    ''', [(evaluation_id, criterion_id, score, comments.get(criterion_id, ''))
+          for criterion_id, score in scores.items()])
+
+    # Save competency evaluations
+    cursor.executemany('''
+    INSERT INTO competency_evaluations
+    (evaluation_id, competency_id, employee_level, employee_comment)
+    VALUES (?, ?, ?, ?)
+    ''', [(evaluation_id, comp_id, level, comp_comments.get(comp_id, ''))
+          for comp_id, level in comp_levels.items()])
+    return evaluation_id
+
+
+def save_manager_review(conn, evaluation_id, employee_score, manager_score, manager_comment):
+    """Store the manager's score and comment and derive the final score"""
+    conn.execute('''
+    UPDATE evaluations
+    SET manager_score = ?, manager_comment = ?,
+        manager_submitted_at = ?, status = 'manager_reviewed',
+        final_score = ?, rating = ?
+    WHERE id = ?
+    ''', (manager_score, manager_comment, datetime.now(),
+          ((employee_score or 0) + manager_score) / 2,
+          'Đạt' if manager_score >= 70 else 'Chưa đạt',
+          evaluation_id))
+
+
+def insert_user(conn, code, fullname, username, password_hash, department,
+                role_type, emp_type, report_to):
+    """Add a user account"""
+    cursor = conn.cursor()
+    cursor.execute('''
+    INSERT INTO users (code, fullname, username, password, department,
+                      role_type, emp_type, report_to)
+    VALUES (?, ?, ?, ?, ?, ?, ?, ?)
+    ''', (code, fullname, username, password_hash,
+         department, role_type, emp_type, report_to))
+    return cursor.lastrowid
+
+
+def update_password(conn, user_id, password_hash, revoke_sessions=True):
+    """Replace a user's stored password hash, ending their sessions"""
+    conn.execute(
+        "UPDATE users SET password = ?, updated_at = CURRENT_TIMESTAMP WHERE id = ?",
+        (password_hash, user_id)
+    )
+    if revoke_sessions:
+        # Sessions started with the old password must not outlive it
+        conn.execute("DELETE FROM sessions WHERE user_id = ?", (user_id,))
+
+
+class WriteQueue:
+    """Background thread applying queued write transactions in group commits"""
+
+    def __init__(self, db_path=None, max_batch=MAX_BATCH, batch_window=BATCH_WINDOW, journal_mode=None):
+        # An explicit path targets that SQLite file (in journal_mode, default EPR_JOURNAL_MODE),
+        # otherwise the configured backend
+        self.storage = (storage.SQLiteStorage(db_path, journal_mode) if db_path
+                        else storage.get_storage())
+        self.max_batch = max_batch
+        self.batch_window = batch_window
+        self._queue = queue.Queue()
+        # Set when the write connection cannot be opened; jobs then fail at once
+        self.error = None
+        self._error_lock = threading.Lock()
+        self._stats_lock = threading.Lock()
+        self.stats = {'transactions': 0, 'commits': 0, 'failed': 0}
+        self._thread = threading.Thread(target=self._run, name='epr-writer', daemon=True)
+        self._thread.start()
+
+    def submit(self, fn, *args, **kwargs):
+        """Queue fn(conn, *args, **kwargs); the Future resolves after COMMIT"""
+        future = Future()
+        with self._error_lock:
+            if self.error is None:
+                self._queue.put((fn, args, kwargs, future))
+                return future
+        future.set_exception(self.error)
+        return future
+
+    def run(self, fn, *args, **kwargs):
+        """Queue a write transaction and wait for its result
+
+        After SUBMIT_TIMEOUT a job still waiting in the queue is cancelled and
+        TimeoutError means it was not applied; a job already in a batch is
+        waited for, so the caller always learns the real outcome.
+        """
+        future = self.submit(fn, *args, **kwargs)
+        try:
+            return future.result(timeout=SUBMIT_TIMEOUT)
+        except TimeoutError:
+            if future.cancel():
+                raise TimeoutError(f"Write queue busy for {SUBMIT_TIMEOUT:g}s; the transaction was not applied")
+            return future.result()
+
+    def close(self):
+        """Finish queued work and stop the writer thread"""
+        self._queue.put(None)
+        self._thread.join()
+
+    def _next_batch(self):
+        """Block for the first job, then take whatever else arrives within the window"""
+        first = self._queue.get()
+        batch = [first]
+        if first is None:
+            return batch
+        while len(batch) < self.max_batch:
+            try:
+                job = self._queue.get(timeout=self.batch_window)
+            except queue.Empty:
+                break
+            batch.append(job)
+            if job is None:
+                break
+        return batch
+
+    def _run(self):
+        # Autocommit mode: transactions are controlled explicitly in _apply
+        try:
+            conn = self.storage.write_connection()
+        except Exception as e:
+            print(f"❌ Writer could not open the database: {e}")
+            self._fail(e)
+            return
+        stopping = False
+        while not stopping:
+            batch = self._next_batch()
+            if batch[-1] is None:
+                stopping = True
+                batch = batch[:-1]
+            if batch:
+                self._apply(conn, batch)
+        conn.close()
+
+    def _fail(self, error):
+        """Fail queued jobs and every later submit with error"""
+        with self._error_lock:
+            self.error = error
+            while True:
+                try:
+                    job = self._queue.get_nowait()
+                except queue.Empty:
+                    break
+                if job is not None and job[3].set_running_or_notify_cancel():
+                    job[3].set_exception(error)
+
+    def _apply(self, conn, batch):
+        jobs = [job for job in batch if job[3].set_running_or_notify_cancel()]
+        results = []
+        try:
+            # Other processes may hold the lock; busy_timeout makes this wait
+            conn.execute(self.storage.begin_write_sql)
+            for fn, args, kwargs, future in jobs:
+                conn.execute("SAVEPOINT txn")
+                try:
+                    value = fn(conn, *args, **kwargs)
+                except Exception as e:
+                    conn.execute("ROLLBACK TO txn")
+                    conn.execute("RELEASE txn")
+                    results.append((future, None, e))
+                else:
+                    conn.execute("RELEASE txn")
+                    results.append((future, value, None))
+            conn.execute("COMMIT")
+            committed = True
+        except Exception as e:
+            # Nothing in this batch was committed
+            if conn.in_transaction:
+                conn.execute("ROLLBACK")
+            results = [(job[3], None, e) for job in jobs]
+            committed = False
+
+        with self._stats_lock:
+            if committed:
+                self.stats['commits'] += 1
+                self.stats['transactions'] += sum(1 for _, _, error in results if error is None)
+            self.stats['failed'] += sum(1 for _, _, error in results if error is not None)
+        # Results are only published once the batch is durable
+        for future, value, error in results:
+            if error is not None:
+                future.set_exception(error)
+            else:
+                future.set_result(value)
+
+
+_writer = None
+_writer_lock = threading.Lock()
+
+
+def get_writer():
+    """Process-wide WriteQueue, started on first use and restarted if it could not connect"""
+    global _writer
+    with _writer_lock:
+        if _writer is None or _writer.error is not None:
+            _writer = WriteQueue()
+        return _writer
+
+
+def run(fn, *args, **kwargs):
+    """Run a write transaction on the process-wide writer and wait for it"""
+    return get_writer().run(fn, *args, **kwargs)